@@ -12,7 +12,6 @@ import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter ,URLRouter
 from channels.security.websocket import AllowedHostsOriginValidator
-from channels.auth import AuthMiddlewareStack
 
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'a_core.settings')
@@ -20,11 +19,12 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'a_core.settings')
 django_asgi_app = get_asgi_application()
 
 from a_rtchat import routing
+from a_rtchat.auth import CachedAuthMiddlewareStack
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": AllowedHostsOriginValidator(
-        AuthMiddlewareStack(URLRouter(routing.websocket_urlpatterns))
+        CachedAuthMiddlewareStack(URLRouter(routing.websocket_urlpatterns))
     ),
 
 })
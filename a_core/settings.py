@@ -80,6 +80,8 @@ MIDDLEWARE = [
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'allauth.account.middleware.AccountMiddleware',
     'django_htmx.middleware.HtmxMiddleware',
+    'a_rtchat.middleware.QueryCountMiddleware',
+    'a_rtchat.middleware.PrimaryPinMiddleware',
 ]
 
 if DEBUG:
@@ -103,6 +105,7 @@ TEMPLATES = [
                 'django.contrib.messages.context_processors.messages',
                 'a_home.cprocs.project_title',
                 'a_rtchat.context_processors.user_groupchats',
+                'a_rtchat.context_processors.unread_mentions',
             ],
         },
     },
@@ -137,6 +140,29 @@ CHANNEL_LAYERS = {
     },
 }
 
+# -------------------------
+# Cache
+# -------------------------
+
+if ENVIRONMENT == "development":
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": env("REDIS_URL"),
+        }
+    }
+
+
+# Sessions are read through the cache, WebSocket handshakes resolve users
+# from it too (a_rtchat.auth)
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 
 # -------------------------
 # Database
@@ -152,11 +178,30 @@ if ENVIRONMENT == 'development':
             }
         }
     }
+    # A second SQLite file standing in for a read replica, to exercise the
+    # routing locally. Nothing replicates to it: `manage.py sync_sqlite_replica`
+    # copies db.sqlite3 over it (schema and rows), run it again to catch up.
+    # Not mirrored, so tests get a separate empty replica database and can
+    # tell which database a read went to
+    if env.bool('SQLITE_REPLICA', default=False):
+        DATABASES['replica'] = {
+            **DATABASES['default'],
+            'NAME': BASE_DIR / 'db_replica.sqlite3',
+        }
+        CHAT_DB_REPLICAS = ['replica']
 else:
     import dj_database_url
     DATABASES = {
         'default': dj_database_url.parse(env('DATABASE_URL'))
     }
+    # Read replicas, comma separated URLs
+    for index, url in enumerate(env.list('DATABASE_REPLICA_URLS', default=[]), start=1):
+        DATABASES[f'replica{index}'] = {**dj_database_url.parse(url), 'TEST': {'MIRROR': 'default'}}
+
+# History, search and sidebar reads go to a replica (a_rtchat.replicas),
+# users who just wrote read from the primary for CHAT_DB_PIN_SECONDS
+DATABASE_ROUTERS = ['a_rtchat.replicas.ReplicaRouter']
+CHAT_DB_PIN_SECONDS = 5
 
 # -------------------------
 # Authentication
@@ -241,6 +286,84 @@ if ENVIRONMENT == "production":
     CSRF_COOKIE_SECURE = True
     SECURE_SSL_REDIRECT = True
 
+# -------------------------
+# Chat
+# -------------------------
+CHAT_TYPING_THROTTLE = 3.0
+CHAT_TYPING_TTL = 6.0
+CHAT_TYPING_TICK = 1.0
+CHAT_MULTIPLEX_MAX_ROOMS = 20
+
+# Days of messages kept in GroupMessage, per room override with ChatGroup.retention_days.
+# None keeps everything, see `manage.py archive_messages`
+CHAT_DEFAULT_RETENTION_DAYS = env.int('CHAT_DEFAULT_RETENTION_DAYS', default=None)
+CHAT_ARCHIVE_CHUNK_SIZE = 500
+
+# Rendered messages kept per room for the initial chat render (Redis when REDIS_URL is set)
+CHAT_RECENT_CACHE = True
+CHAT_RECENT_CACHE_SIZE = 50
+
+# Seconds a WebSocket handshake may reuse a cached User
+CHAT_WS_USER_CACHE_TTL = 60
+
+# WebSocket admission per worker, refused clients retry after 1..CHAT_WS_RETRY_JITTER s.
+# Open sockets are closed over CHAT_WS_DRAIN_WINDOW s on shutdown
+CHAT_WS_ADMIT_RATE = 50.0
+CHAT_WS_ADMIT_BURST = 100
+CHAT_WS_RETRY_JITTER = 10.0
+CHAT_WS_DRAIN_WINDOW = 20.0
+
+# Quiet sockets are pinged every interval and closed after the timeout
+CHAT_WS_HEARTBEAT_INTERVAL = 25.0
+CHAT_WS_HEARTBEAT_TIMEOUT = 75.0
+CHAT_WS_REAP_BATCH = 100
+# Seconds over which online count broadcasts are merged
+CHAT_BROADCAST_COALESCE = 0.5
+
+# Frames of at least this many bytes are deflated for clients connecting
+# with ?compress=deflate, None disables compression on the endpoint
+CHAT_WS_COMPRESSION = {
+    'chatroom': 512,
+    'multiplex': 512,
+    'online-status': None,
+}
+CHAT_WS_COMPRESSION_LEVEL = 6
+
+# Reject messages containing links, on top of the BlockedTerm list
+CHAT_BLOCK_LINKS = True
+CHAT_MODERATION_RELOAD_INTERVAL = 5.0
+
+# Room and account deletions are purged by run_purge_worker in batches
+CHAT_PURGE_BATCH_SIZE = 500
+CHAT_PURGE_BATCH_PAUSE = 0.05
+
+# Message sends allowed per user as (messages, seconds), by room kind
+CHAT_RATE_LIMITS = {
+    'public': (10, 10),
+    'group': (20, 10),
+    'private': (30, 10),
+}
+
+# Bearer token for /metrics, staff sessions are accepted when empty
+METRICS_TOKEN = env('METRICS_TOKEN', default='')
+
+# -------------------------
+# Logging
+# -------------------------
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'verbose': {'format': '%(asctime)s %(levelname)s %(name)s %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'verbose'},
+    },
+    'loggers': {
+        'a_rtchat': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
 # -------------------------
 # Redis Debug Logs
 # -------------------------
@@ -30,6 +30,7 @@ urlpatterns = [
     path('', include('a_rtchat.urls')),
     path('profile/', include('a_users.urls')),
     path('@<username>/', profile_view, name="profile"),
+    path('metrics', metrics_view, name="metrics"),
 ]
 
 # Only used when DEBUG=True, whitenoise can serve files when DEBUG=False
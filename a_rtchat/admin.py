@@ -1,7 +1,50 @@
 from django.contrib import admin
+from django.db.models import Count
 # Import specific models to avoid NameError
-from .models import ChatGroup, GroupMessage
+from .models import BlockedTerm, ChatGroup, GroupMessage, MessageArchive, PurgeJob
 # Register your models here.
 
-admin.site.register(ChatGroup)
-admin.site.register(GroupMessage)
\ No newline at end of file
+admin.site.register(GroupMessage)
+
+
+@admin.register(ChatGroup)
+class ChatGroupAdmin(admin.ModelAdmin):
+    list_display = ('group_name', 'groupchat_name', 'admin', 'is_private', 'online', 'message_count', 'deleted_at')
+    list_filter = ('is_private',)
+    search_fields = ('group_name', 'groupchat_name')
+
+    def get_queryset(self, request):
+        # Rooms waiting for their purge too, the default manager hides them
+        queryset = ChatGroup.all_objects.annotate(online_count=Count('users_online', distinct=True))
+        ordering = self.get_ordering(request)
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        return queryset
+
+    @admin.display(description='Online', ordering='online_count')
+    def online(self, chat_group):
+        # Across every worker, what the room's online count shows
+        return chat_group.online_count
+
+
+@admin.register(MessageArchive)
+class MessageArchiveAdmin(admin.ModelAdmin):
+    list_display = ('group', 'month', 'first_message_id', 'last_message_id', 'message_count', 'archived')
+    list_filter = ('month',)
+    exclude = ('data',)
+
+
+@admin.register(BlockedTerm)
+class BlockedTermAdmin(admin.ModelAdmin):
+    list_display = ('term', 'action', 'substring', 'created')
+    list_filter = ('action', 'substring')
+    search_fields = ('term',)
+
+
+@admin.register(PurgeJob)
+class PurgeJobAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'label', 'status', 'deleted', 'total', 'progress', 'attempts', 'created', 'finished')
+    list_filter = ('kind', 'status')
+    readonly_fields = (
+        'total', 'deleted', 'attempts', 'error', 'created', 'started', 'heartbeat', 'retry_at', 'finished'
+    )
@@ -0,0 +1,194 @@
+import gzip
+import json
+import os
+from datetime import timedelta
+from itertools import groupby
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import GroupMessage, Mention, MessageArchive
+
+ARCHIVE_CHUNK_SIZE = getattr(settings, 'CHAT_ARCHIVE_CHUNK_SIZE', 500)
+DEFAULT_RETENTION_DAYS = getattr(settings, 'CHAT_DEFAULT_RETENTION_DAYS', None)
+
+
+def retention_cutoff(group, days=None):
+    """Messages created before the returned datetime are due for archival"""
+    days = days or group.retention_days or DEFAULT_RETENTION_DAYS
+    if not days:
+        return None
+    return timezone.now() - timedelta(days=days)
+
+
+def serialize_message(message):
+    row = {
+        'id': message.id,
+        'author_id': message.author_id,
+        'body': message.body,
+        'file': str(message.file) if message.file else None,
+        'created': message.created.isoformat(),
+    }
+    if message.reply_to_id:
+        row['reply_to'] = message.reply_to_id
+    if message.deleted_at:
+        # Archived rows can't be undeleted, the content isn't kept
+        row.update(body=None, file=None, deleted=True)
+    elif message.reactions:
+        row['reactions'] = message.reactions
+    return row
+
+
+def _write_chunk(group, month, rows, export_dir=None):
+    payload = '\n'.join(json.dumps(row) for row in rows).encode('utf-8')
+    data = gzip.compress(payload)
+    archive = MessageArchive.objects.create(
+        group=group,
+        month=month,
+        first_message_id=rows[0]['id'],
+        last_message_id=rows[-1]['id'],
+        first_created=parse_datetime(rows[0]['created']),
+        last_created=parse_datetime(rows[-1]['created']),
+        message_count=len(rows),
+        data=data,
+    )
+    if export_dir:
+        # Monthly JSONL export next to the database copy, one gzip member per chunk
+        path = os.path.join(export_dir, group.group_name, f'{month:%Y-%m}.jsonl.gz')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'ab') as f:
+            f.write(data)
+    return archive
+
+
+def _archive_bound(group, cutoff):
+    """
+    Id below which a group's messages can be archived, None for all of them.
+
+    The first message from cutoff on, moved down to the parent of any
+    thread still running past it: a thread is archived whole, and what is
+    archived stays a run of ids older than everything live.
+    """
+    messages = GroupMessage.objects.filter(group=group)
+    bound = messages.filter(created__gte=cutoff).order_by('id').values_list('id', flat=True).first()
+    while bound is not None:
+        parent = (
+            messages.filter(id__lt=bound, replies__id__gte=bound).order_by('id').values_list('id', flat=True).first()
+        )
+        if parent is None:
+            break
+        bound = parent
+    return bound
+
+
+def _keep_mentions(messages):
+    """Mentions of archived messages stay in the inboxes, with an excerpt of the body"""
+    bodies = {message.id: (message.body or '')[:200] for message in messages}
+    mentions = list(Mention.objects.filter(message_id__in=bodies).only('id', 'message_id'))
+    for mention in mentions:
+        mention.excerpt = bodies[mention.message_id]
+    Mention.objects.bulk_update(mentions, ['excerpt'])
+
+
+def archive_group(group, cutoff, chunk_size=ARCHIVE_CHUNK_SIZE, export_dir=None, dry_run=False):
+    """
+    Move messages of a group created before cutoff into MessageArchive chunks.
+
+    Works oldest first in bounded transactions so it can be interrupted and
+    rerun at any time. Threads still getting replies from cutoff on are left
+    live, with everything after them. Returns the number of archived messages.
+    """
+    queryset = GroupMessage.objects.filter(group=group).order_by('id')
+    bound = _archive_bound(group, cutoff)
+    if bound is not None:
+        queryset = queryset.filter(id__lt=bound)
+    if dry_run:
+        return queryset.count()
+
+    archived = 0
+    while True:
+        with transaction.atomic():
+            batch = list(queryset[:chunk_size])
+            if not batch:
+                break
+            # Up to the last reply of the threads started in the batch,
+            # deleting a parent on its own would detach its replies
+            while True:
+                last_reply = GroupMessage.objects.filter(reply_to__in=[m.id for m in batch]).aggregate(
+                    last=Max('id')
+                )['last']
+                if last_reply is None or last_reply <= batch[-1].id:
+                    break
+                batch.extend(queryset.filter(id__gt=batch[-1].id, id__lte=last_reply))
+            # A chunk never spans two months so monthly exports stay aligned
+            for month, messages in groupby(batch, key=lambda m: m.created.date().replace(day=1)):
+                _write_chunk(group, month, [serialize_message(m) for m in messages], export_dir)
+            _keep_mentions(batch)
+            GroupMessage.objects.filter(id__in=[m.id for m in batch]).delete()
+        archived += len(batch)
+    return archived
+
+
+def _deserialize(rows, group):
+    file_field = GroupMessage._meta.get_field('file')
+    authors = User.objects.select_related('profile').in_bulk({row['author_id'] for row in rows})
+    messages = []
+    for row in rows:
+        author = authors.get(row['author_id'])
+        if author is None:
+            continue
+        message = GroupMessage(
+            id=row['id'],
+            group=group,
+            author=author,
+            body=row['body'],
+            file=file_field.to_python(row['file']) if row['file'] else None,
+        )
+        message.created = parse_datetime(row['created'])
+        message.deleted_at = message.created if row.get('deleted') else None
+        message.reactions = row.get('reactions') or {}
+        message.reply_to_id = row.get('reply_to')
+        message.is_archived = True
+        messages.append(message)
+    return messages
+
+
+def archived_messages_before(group, before_id, limit):
+    """Newest archived messages of a group with an id below before_id, newest first"""
+    rows = []
+    archives = MessageArchive.objects.filter(group=group, first_message_id__lt=before_id)
+    for archive in archives.iterator(chunk_size=4):
+        chunk = [json.loads(line) for line in gzip.decompress(archive.data).decode('utf-8').splitlines()]
+        # Archived replies stay out of the timeline like live ones
+        rows.extend(row for row in reversed(chunk) if row['id'] < before_id and not row.get('reply_to'))
+        if len(rows) >= limit:
+            break
+    return _deserialize(rows[:limit], group)
+
+
+def iter_archived_rows(group):
+    """Every archived message row of a group, oldest first"""
+    for archive in MessageArchive.objects.filter(group=group).order_by('first_message_id').iterator(chunk_size=4):
+        for line in gzip.decompress(archive.data).decode('utf-8').splitlines():
+            yield json.loads(line)
+
+
+def history_page(group, before_id, limit):
+    """
+    One page of history older than before_id, oldest first.
+
+    Reads GroupMessage and transparently continues into the archive once the
+    live table runs out.
+    """
+    messages = list(
+        group.chat_messages.select_related('author__profile', 'last_reply__author')
+        .filter(id__lt=before_id, reply_to__isnull=True)
+        .order_by('-id')[:limit]
+    )
+    if len(messages) < limit:
+        oldest = messages[-1].id if messages else before_id
+        messages.extend(archived_messages_before(group, oldest, limit - len(messages)))
+    messages.reverse()
+    return messages
@@ -0,0 +1,76 @@
+"""
+WebSocket authentication that resolves the session user through the cache.
+
+A reconnect storm after a deploy would otherwise cost a session read and
+a User (+ Profile) query per socket. With SESSION_ENGINE=cached_db the
+session comes from the cache too, so a warm handshake never touches the
+database.
+"""
+import time
+from channels.auth import AuthMiddleware
+from channels.db import database_sync_to_async
+from channels.sessions import CookieMiddleware, SessionMiddleware
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare
+from .metrics import HANDSHAKE_SECONDS
+
+WS_USER_CACHE_TTL = getattr(settings, 'CHAT_WS_USER_CACHE_TTL', 60)
+
+
+def _user_cache_key(user_id):
+    return f'chat:wsuser:{user_id}'
+
+
+def invalidate_cached_user(user_id):
+    cache.delete(_user_cache_key(user_id))
+
+
+def _load_user(user_id):
+    """Returns (user, source), source being the metric label"""
+    key = _user_cache_key(user_id)
+    user = cache.get(key)
+    if user is not None:
+        return user, "cache"
+    try:
+        user = get_user_model().objects.select_related('profile').get(pk=user_id)
+    except get_user_model().DoesNotExist:
+        return None, "db"
+    if user.is_active:
+        cache.set(key, user, WS_USER_CACHE_TTL)
+    return user, "db"
+
+
+@database_sync_to_async
+def get_cached_user(scope):
+    """Same checks as channels.auth.get_user, with the User served from the cache"""
+    session = scope["session"]
+    try:
+        user_id = get_user_model()._meta.pk.to_python(session[SESSION_KEY])
+        backend_path = session[BACKEND_SESSION_KEY]
+    except KeyError:
+        return AnonymousUser(), "anonymous"
+    if backend_path not in settings.AUTHENTICATION_BACKENDS:
+        return AnonymousUser(), "anonymous"
+
+    user, source = _load_user(user_id)
+    if user is None or not user.is_active:
+        return AnonymousUser(), source
+    # A password change rotates the hash and logs out other sessions
+    session_hash = session.get(HASH_SESSION_KEY)
+    if not (session_hash and constant_time_compare(session_hash, user.get_session_auth_hash())):
+        return AnonymousUser(), source
+    return user, source
+
+
+class CachedAuthMiddleware(AuthMiddleware):
+    async def resolve_scope(self, scope):
+        started = time.perf_counter()
+        scope["user"]._wrapped, source = await get_cached_user(scope)
+        HANDSHAKE_SECONDS.observe(time.perf_counter() - started, source=source)
+
+
+def CachedAuthMiddlewareStack(inner):
+    return CookieMiddleware(SessionMiddleware(CachedAuthMiddleware(inner)))
@@ -0,0 +1,31 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Coalescer:
+    """
+    Runs the latest callback scheduled under a key at most once per delay.
+
+    Used for broadcasts whose content is computed when they fire (online
+    counts), so a burst of joins/leaves costs one group_send, not one each.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self._pending = {}
+
+    def schedule(self, key, func):
+        first = key not in self._pending
+        self._pending[key] = func
+        if first:
+            asyncio.get_running_loop().create_task(self._run(key))
+
+    async def _run(self, key):
+        await asyncio.sleep(self.delay)
+        func = self._pending.pop(key)
+        try:
+            await func()
+        except Exception as e:
+            logger.error(f"Coalesced broadcast {key} failed: {e}")
@@ -0,0 +1,76 @@
+"""
+Optional per-message compression of outgoing WebSocket frames.
+
+Daphne doesn't negotiate permessage-deflate, so compression is done at the
+application level instead: a client that connects with ?compress=deflate
+receives frames longer than its endpoint's threshold as binary raw-deflate
+messages (a browser inflates them with DecompressionStream('deflate-raw')),
+and everything shorter as plain text. Every message is compressed on its
+own, like permessage-deflate with no context takeover, so frames can be
+inflated independently and no per-socket window is held in memory.
+"""
+import zlib
+from urllib.parse import parse_qs
+from django.conf import settings
+from .metrics import COMPRESSED_FRAMES, COMPRESSION_SECONDS, FRAME_BYTES
+
+# Minimum frame size in bytes worth compressing, per endpoint; None turns
+# compression off for that endpoint
+DEFAULT_THRESHOLDS = {
+    'chatroom': 512,
+    'multiplex': 512,
+    'online-status': None,
+}
+THRESHOLDS = {**DEFAULT_THRESHOLDS, **getattr(settings, 'CHAT_WS_COMPRESSION', {})}
+LEVEL = getattr(settings, 'CHAT_WS_COMPRESSION_LEVEL', 6)
+
+
+def deflate(data, level=LEVEL):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def inflate(data):
+    return zlib.decompress(data, -zlib.MAX_WBITS)
+
+
+def negotiate(scope, endpoint):
+    """Threshold for this socket, None when it shouldn't be compressed"""
+    threshold = THRESHOLDS.get(endpoint)
+    if threshold is None:
+        return None
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    if 'deflate' not in query.get('compress', []):
+        return None
+    return threshold
+
+
+def encode(text, threshold, endpoint):
+    """Returns the (text_data, bytes_data) pair to send for a frame"""
+    if threshold is None or len(text) < threshold:
+        return text, None
+    raw = text.encode('utf-8')
+    with COMPRESSION_SECONDS.time(endpoint=endpoint):
+        compressed = deflate(raw)
+    if len(compressed) >= len(raw):
+        COMPRESSED_FRAMES.inc(endpoint=endpoint, result="skipped")
+        return text, None
+    COMPRESSED_FRAMES.inc(endpoint=endpoint, result="compressed")
+    FRAME_BYTES.inc(len(raw), endpoint=endpoint, stage="raw")
+    FRAME_BYTES.inc(len(compressed), endpoint=endpoint, stage="compressed")
+    return None, compressed
+
+
+class CompressionMixin:
+    """Compresses large text frames for clients that opted in on connect"""
+
+    compression_endpoint = None
+
+    def negotiate_compression(self):
+        self.compress_threshold = negotiate(self.scope, self.compression_endpoint)
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        threshold = getattr(self, 'compress_threshold', None)
+        if text_data is not None and threshold is not None:
+            text_data, bytes_data = encode(text_data, threshold, self.compression_endpoint)
+        await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
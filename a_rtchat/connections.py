@@ -0,0 +1,239 @@
+"""
+Admission control and graceful draining for WebSocket connections.
+
+Every worker admits at most CHAT_WS_ADMIT_RATE connects per second (with
+CHAT_WS_ADMIT_BURST of headroom). Refused sockets are accepted, told when
+to come back with a {"type": "retry", "after": ms} frame and closed with
+CLOSE_RETRY, so a reconnect storm after a restart is spread out by the
+server instead of every client's own backoff.
+
+On shutdown the open sockets are closed the same way, spread over
+CHAT_WS_DRAIN_WINDOW seconds.
+
+A reaper pings sockets that have been quiet for CHAT_WS_HEARTBEAT_INTERVAL
+seconds and closes, in batches, those silent for CHAT_WS_HEARTBEAT_TIMEOUT;
+their disconnect handlers then clear the presence state they held.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import signal
+import sys
+import threading
+import time
+import weakref
+from django.conf import settings
+from .metrics import CONNECTIONS_REFUSED, IDLE_SOCKETS, PROCESS_MEMORY, REAPED_SOCKETS, TRACKED_SOCKETS
+
+logger = logging.getLogger(__name__)
+
+ADMIT_RATE = getattr(settings, 'CHAT_WS_ADMIT_RATE', 50.0)
+ADMIT_BURST = getattr(settings, 'CHAT_WS_ADMIT_BURST', 100)
+RETRY_JITTER = getattr(settings, 'CHAT_WS_RETRY_JITTER', 10.0)
+DRAIN_WINDOW = getattr(settings, 'CHAT_WS_DRAIN_WINDOW', 20.0)
+HEARTBEAT_INTERVAL = getattr(settings, 'CHAT_WS_HEARTBEAT_INTERVAL', 25.0)
+HEARTBEAT_TIMEOUT = getattr(settings, 'CHAT_WS_HEARTBEAT_TIMEOUT', 75.0)
+REAP_BATCH = getattr(settings, 'CHAT_WS_REAP_BATCH', 100)
+
+# Application close codes: "try again later" (the retry frame says when)
+# and "no heartbeat"
+CLOSE_RETRY = 4013
+CLOSE_IDLE = 4008
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def wait_time(self):
+        """Seconds until the next token is available"""
+        with self._lock:
+            self._refill()
+            return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class ConnectionRegistry:
+    """Open sockets of this worker, reaped when silent and drained on shutdown"""
+
+    def __init__(self):
+        self.consumers = weakref.WeakSet()
+        self.draining = False
+        self._hook_installed = False
+        self._reaper = None
+
+    def add(self, consumer):
+        self.consumers.add(consumer)
+
+    def discard(self, consumer):
+        self.consumers.discard(consumer)
+
+    async def drain(self, window=DRAIN_WINDOW):
+        self.draining = True
+        consumers = list(self.consumers)
+        logger.info(f"Draining {len(consumers)} WebSocket connections over {window}s")
+
+        async def close_later(consumer):
+            await asyncio.sleep(random.uniform(0, window))
+            CONNECTIONS_REFUSED.inc(reason="drain")
+            await send_retry(consumer)
+
+        await asyncio.gather(*(close_later(c) for c in consumers), return_exceptions=True)
+
+    def start_reaper(self):
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.get_running_loop().create_task(self._reap_forever())
+
+    async def _reap_forever(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            try:
+                await self.reap()
+            except Exception as e:
+                logger.error(f"Reaper sweep failed: {e}")
+
+    async def reap(self):
+        """One heartbeat sweep: ping quiet sockets, close dead ones in batches"""
+        now = time.monotonic()
+        quiet, dead = [], []
+        for consumer in list(self.consumers):
+            idle = now - getattr(consumer, 'last_seen', now)
+            if idle >= HEARTBEAT_TIMEOUT:
+                dead.append(consumer)
+            elif idle >= HEARTBEAT_INTERVAL:
+                quiet.append(consumer)
+
+        TRACKED_SOCKETS.set(len(self.consumers))
+        IDLE_SOCKETS.set(len(quiet) + len(dead))
+        PROCESS_MEMORY.set(process_memory())
+
+        await asyncio.gather(
+            *(c.send(text_data=json.dumps({"type": "ping"})) for c in quiet), return_exceptions=True
+        )
+        for start in range(0, len(dead), REAP_BATCH):
+            batch = dead[start:start + REAP_BATCH]
+            for consumer in batch:
+                # Don't let a socket that never answers be reaped twice
+                self.discard(consumer)
+            await asyncio.gather(*(c.close(code=CLOSE_IDLE) for c in batch), return_exceptions=True)
+            REAPED_SOCKETS.inc(len(batch))
+            # Give the disconnect handlers of this batch room to run
+            await asyncio.sleep(0.1)
+        if dead:
+            logger.info(f"Reaped {len(dead)} idle WebSocket connections")
+        return len(dead)
+
+    def install_drain_hook(self):
+        """Drain before the server stops, called from the running event loop"""
+        if self._hook_installed:
+            return
+        self._hook_installed = True
+        loop = asyncio.get_running_loop()
+
+        reactor = sys.modules.get('twisted.internet.reactor')
+        if reactor is not None and reactor.running:
+            # Daphne: delay the reactor shutdown until the drain is done
+            from twisted.internet.defer import Deferred
+            reactor.addSystemEventTrigger(
+                'before', 'shutdown', lambda: Deferred.fromFuture(loop.create_task(self.drain()))
+            )
+            return
+
+        # Chained to the handler already installed, whoever installed it
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def resume(_):
+            # Hand the signal back to whatever handled it before, so the
+            # process still stops (SIG_DFL) or the server's handler runs
+            signal.signal(signal.SIGTERM, signal.SIG_DFL if previous is None else previous)
+            if callable(previous):
+                previous(signal.SIGTERM, None)
+            elif previous != signal.SIG_IGN:
+                signal.raise_signal(signal.SIGTERM)
+
+        def start_drain():
+            loop.create_task(self.drain()).add_done_callback(resume)
+
+        def on_sigterm(signum, frame):
+            # Python handlers run in the main thread, the drain runs on the loop
+            loop.call_soon_threadsafe(start_drain)
+
+        try:
+            signal.signal(signal.SIGTERM, on_sigterm)
+        except ValueError:
+            # Only the main thread may set handlers
+            logger.warning("No SIGTERM drain hook, connections will close at once on shutdown")
+
+
+bucket = TokenBucket(ADMIT_RATE, ADMIT_BURST)
+registry = ConnectionRegistry()
+
+
+def process_memory():
+    """Resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        # Peak rather than current, in KiB on Linux and bytes on macOS
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def touch(consumer):
+    """Record client activity, any frame counts as a heartbeat"""
+    consumer.last_seen = time.monotonic()
+
+
+def retry_delay(extra=0.0):
+    """Server-chosen reconnect delay in milliseconds"""
+    return int((extra + random.uniform(1.0, RETRY_JITTER)) * 1000)
+
+
+async def send_retry(consumer, delay=None):
+    await consumer.send(text_data=json.dumps({"type": "retry", "after": delay or retry_delay()}))
+    await consumer.close(code=CLOSE_RETRY)
+
+
+async def admit(consumer):
+    """
+    Accept the socket, or accept it only to hand out a retry delay and close
+    it. Returns whether the connection was admitted.
+    """
+    registry.install_drain_hook()
+    registry.start_reaper()
+    await consumer.accept()
+    if registry.draining:
+        CONNECTIONS_REFUSED.inc(reason="draining")
+        await send_retry(consumer)
+        return False
+    if not bucket.take():
+        CONNECTIONS_REFUSED.inc(reason="rate")
+        await send_retry(consumer, retry_delay(bucket.wait_time()))
+        return False
+    touch(consumer)
+    registry.add(consumer)
+    return True
+
+
+def release(consumer):
+    registry.discard(consumer)
@@ -1,56 +1,137 @@
 import json
 import asyncio
+import logging
+import re
+from collections import Counter
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from .models import ChatGroup, GroupMessage
+from .models import ChatGroup, GroupMessage, RoomReadState
+from .typing_indicators import typing_tracker, typing_text
+from .recent_cache import message_payload, push_message, refresh_entries
+from .edits import delete_message, edit_message, toggle_reaction
+from .threads import reply_count, thread_root
+from .connections import admit, release, touch
+from .coalesce import Coalescer
+from .compression import CompressionMixin
+from .ratelimit import acheck, error_frame, room_kind
+from .moderation import MessageBlocked, clean_body
+from .mentions import notify_mentions, record_mentions, user_group
+from .replicas import pin_primary, replica_reads
+from .spectators import get_counter
+from .metrics import (
+    ACTIVE_ROOMS, FRAMES_RECEIVED, FRAMES_SENT, MESSAGES_CREATED, ONLINE_USERS_TRACKED, OPERATION_SECONDS,
+    ROOM_SOCKETS, SOCKETS_OPEN, instrument,
+)
+
+logger = logging.getLogger(__name__)
 
 # Track online users by username
 ONLINE_USERS = {}
 
-class ChatroomConsumer(AsyncWebsocketConsumer):
-    """Production-ready WebSocket consumer with proper timeout handling"""
+# Sockets subscribed to each room in this process, only aggregates are exported
+ROOM_SOCKET_COUNTS = Counter()
 
-    async def connect(self):
-        """Handle WebSocket connection with timeout protection"""
-        try:
-            # Set connection timeout
-            await asyncio.wait_for(self._connect_internal(), timeout=15.0)
-        except asyncio.TimeoutError:
-            print("[ERROR] WebSocket connection timeout")
-            await self.close(code=1011)  # Internal error code
-        except Exception as e:
-            print(f"[ERROR] Connection failed: {e}")
-            await self.close()
+PRESENCE_GROUP = "online_status"
 
+# Maximum number of rooms one multiplexed socket may subscribe to
+MULTIPLEX_MAX_ROOMS = getattr(settings, 'CHAT_MULTIPLEX_MAX_ROOMS', 20)
 
-    async def _connect_internal(self):
-        """Internal connection method"""
-        self.user = self.scope["user"]
-        if not self.user.is_authenticated:
-            await self.close(code=4000)  # Custom close code for auth failure
-            return
+# Room names a socket may subscribe to: what routing.py accepts, within
+# the channel layer's limit on group names
+ROOM_NAME = re.compile(r'[\w\-]{1,99}')
+
+# Online count broadcasts are merged over this many seconds
+broadcasts = Coalescer(getattr(settings, 'CHAT_BROADCAST_COALESCE', 0.5))
+
+# Reaction counts changed since the room's last reactions broadcast,
+# {room: {message_id: counts}}, sent merged once per CHAT_REACTION_COALESCE
+pending_reactions = {}
+reaction_broadcasts = Coalescer(getattr(settings, 'CHAT_REACTION_COALESCE', 0.25))
+
+
+@database_sync_to_async
+def get_online_count_sync(chatroom):
+    """Sync method to get online count, and the room's SSE spectators"""
+    return chatroom.users_online.count(), get_counter().count(chatroom.group_name)
+
+
+async def send_online_count(chatroom):
+    try:
+        online_count, spectators = await get_online_count_sync(chatroom)
+        await get_channel_layer().group_send(
+            chatroom.group_name,
+            {
+                "type": "online.count",
+                "room": chatroom.group_name,
+                "online_count": online_count,
+                "spectators": spectators,
+            }
+        )
+    except Exception as e:
+        logger.error(f"Online count update failed: {e}")
+
+
+def schedule_online_count(chatroom):
+    """Broadcast a room's online count, once per burst of joins, leaves and SSE streams"""
+    broadcasts.schedule(("online", chatroom.group_name), lambda: send_online_count(chatroom))
+
+
+class RoomSession:
+    """State and handlers of one chatroom joined by a socket"""
+
+    def __init__(self, consumer, chatroom_name):
+        self.consumer = consumer
+        self.user = consumer.user
+        self.chatroom_name = chatroom_name
+        self.chatroom = None
+
+    @property
+    def channel_layer(self):
+        return self.consumer.channel_layer
+
+    async def join(self):
+        """Subscribe the socket to the room group and mark the user online"""
+        await self.channel_layer.group_add(self.chatroom_name, self.consumer.channel_name)
 
-        self.chatroom_name = self.scope["url_route"]["kwargs"]["chatroom_name"]
-        
-        # Accept connection immediately
-        await self.accept()
-        
-        # Add to channel group
-        await self.channel_layer.group_add(self.chatroom_name, self.channel_name)
-        
         # Get chatroom info with timeout
         try:
             await asyncio.wait_for(self._setup_chatroom(), timeout=10.0)
         except asyncio.TimeoutError:
-            print("[WARNING] Chatroom setup timed out, but connection remains open")
+            logger.warning("Chatroom setup timed out, but connection remains open")
         except Exception as e:
-            print(f"[ERROR] Chatroom setup failed: {e}")
+            logger.error(f"Chatroom setup failed: {e}")
+        if self.chatroom is not None:
+            ROOM_SOCKET_COUNTS[self.chatroom_name] += 1
+            ROOM_SOCKETS.inc()
+            ACTIVE_ROOMS.set(len(ROOM_SOCKET_COUNTS))
+        return self.chatroom is not None
+
+    async def leave(self):
+        """Unsubscribe from the room group and clean up presence"""
+        await self.channel_layer.group_discard(self.chatroom_name, self.consumer.channel_name)
+        self._stop_typing()
+
+        # Cleanup user from online list
+        if self.chatroom:
+            ROOM_SOCKET_COUNTS[self.chatroom_name] -= 1
+            if ROOM_SOCKET_COUNTS[self.chatroom_name] <= 0:
+                del ROOM_SOCKET_COUNTS[self.chatroom_name]
+            ROOM_SOCKETS.dec()
+            ACTIVE_ROOMS.set(len(ROOM_SOCKET_COUNTS))
+            await self._remove_user_from_online()
+            await self._update_online_count()
 
     @database_sync_to_async
+    @instrument("setup_chatroom")
     def _setup_chatroom_sync(self):
         """Sync method for chatroom setup"""
         chatroom = ChatGroup.objects.filter(group_name=self.chatroom_name).first()
+        if chatroom and chatroom.is_private and not chatroom.members.filter(id=self.user.id).exists():
+            return None
+        self.display_name = self.user.profile.name
         if chatroom and not chatroom.users_online.filter(id=self.user.id).exists():
             chatroom.users_online.add(self.user)
         return chatroom
@@ -58,232 +139,584 @@ class ChatroomConsumer(AsyncWebsocketConsumer):
     async def _setup_chatroom(self):
         """Setup chatroom after connection is established"""
         self.chatroom = await self._setup_chatroom_sync()
-        
+
         if not self.chatroom:
-            print(f"[ERROR] Chatroom {self.chatroom_name} not found")
+            logger.error(f"Chatroom {self.chatroom_name} not found")
             return
 
         await self._update_online_count()
 
-    async def disconnect(self, close_code):
-        """Handle disconnection with proper cleanup"""
-        try:
-            if hasattr(self, 'chatroom_name'):
-                await self.channel_layer.group_discard(self.chatroom_name, self.channel_name)
-
-            # Cleanup user from online list
-            if hasattr(self, 'chatroom') and hasattr(self, 'user'):
-                await self._remove_user_from_online()
-                    
-        except Exception as e:
-            print(f"[ERROR] Disconnect cleanup failed: {e}")
-
     @database_sync_to_async
     def _remove_user_from_online(self):
         """Sync method to remove user from online list"""
         if self.chatroom.users_online.filter(id=self.user.id).exists():
             self.chatroom.users_online.remove(self.user)
 
-    async def receive(self, text_data):
-        """Handle incoming messages with error handling"""
-        try:
-            data = json.loads(text_data)
-            if data.get("type") == "seen":
-                await self._handle_seen()
-            elif data.get("body"):
-                await self.handle_message(data["body"])
-        except json.JSONDecodeError:
-            print("[ERROR] Invalid JSON received")
-        except Exception as e:
-            print(f"[ERROR] Message processing failed: {e}")
+    async def receive(self, data):
+        """Dispatch a decoded client frame addressed to this room"""
+        if data.get("type") == "seen":
+            await self._handle_seen()
+        elif data.get("type") == "typing":
+            self._handle_typing()
+        elif data.get("type") == "edit":
+            await self._handle_edit(data)
+        elif data.get("type") == "delete":
+            await self._handle_delete(data)
+        elif data.get("type") == "react":
+            await self._handle_reaction(data)
+        elif data.get("body"):
+            reply_to = data.get("reply_to")
+            await self.handle_message(data["body"], reply_to if isinstance(reply_to, int) else None)
 
     @database_sync_to_async
-    def create_message_sync(self, body):
-        """Sync method to create message"""
-        return GroupMessage.objects.create(
-            body=body, author=self.user, group=self.chatroom
+    @instrument("create_message")
+    def create_message_sync(self, body, reply_to=None):
+        """
+        Sync method to create message, returns it with its recent cache
+        entry and the ids of the users it mentions, or None when the
+        message it replies to is gone
+        """
+        if reply_to is not None:
+            reply_to = thread_root(self.chatroom, reply_to)
+            if reply_to is None:
+                return None
+        message = GroupMessage.objects.create(
+            body=clean_body(body), author=self.user, group=self.chatroom, reply_to_id=reply_to
         )
-
-    async def handle_message(self, body):
+        pin_primary(self.user)
+        entry = push_message(message)
+        if reply_to is not None:
+            # Clients update the parent's thread summary from the reply's frame
+            entry["payload"]["reply_count"] = reply_count(reply_to)
+        return message, entry, record_mentions(message)
+
+    async def handle_message(self, body, reply_to=None):
         """Handle new message creation"""
-        if not hasattr(self, 'chatroom'):
+        if not self.chatroom:
+            return
+
+        retry_after = await acheck(self.user.id, room_kind(self.chatroom), "websocket")
+        if retry_after:
+            await self.consumer.send_frame(error_frame(retry_after), self.chatroom_name)
+            return
+
+        try:
+            created = await self.create_message_sync(body, reply_to)
+        except MessageBlocked:
+            await self._send_moderated()
             return
-            
-        message = await self.create_message_sync(body)
-        
+        if created is None:
+            await self.consumer.send_frame(
+                {"type": "error", "code": "thread_gone", "message": "The message you replied to was deleted"},
+                self.chatroom_name,
+            )
+            return
+        message, entry, mentioned = created
+        MESSAGES_CREATED.inc(source="websocket")
+        self._stop_typing()
+
         # Send to all group members
+        with OPERATION_SECONDS.time(operation="group_send"):
+            await self.channel_layer.group_send(
+                self.chatroom_name,
+                {
+                    "type": "chat.message",
+                    "room": self.chatroom_name,
+                    "message_id": message.id,
+                    "username": self.user.username,
+                    "payload": entry["payload"],
+                }
+            )
+        if mentioned:
+            await notify_mentions(self.channel_layer, message, mentioned)
+
+    async def _send_moderated(self):
+        await self.consumer.send_frame(
+            {"type": "error", "code": "moderated", "message": "Your message was blocked by the content filter"},
+            self.chatroom_name,
+        )
+
+    @database_sync_to_async
+    @instrument("edit_message")
+    def edit_message_sync(self, message_id, body):
+        event = edit_message(self.chatroom, self.user, message_id, body)
+        if event:
+            pin_primary(self.user)
+        return event
+
+    async def _handle_edit(self, data):
+        """Edit one of the user's messages, everyone gets the new body as a delta"""
+        if not self.chatroom or not isinstance(data.get("message_id"), int):
+            return
+        # An edit costs the same as a send
+        retry_after = await acheck(self.user.id, room_kind(self.chatroom), "websocket")
+        if retry_after:
+            await self.consumer.send_frame(error_frame(retry_after), self.chatroom_name)
+            return
+        try:
+            event = await self.edit_message_sync(data["message_id"], data.get("body"))
+        except MessageBlocked:
+            await self._send_moderated()
+            return
+        if event:
+            await self.channel_layer.group_send(self.chatroom_name, event)
+
+    @database_sync_to_async
+    @instrument("delete_message")
+    def delete_message_sync(self, message_id):
+        event = delete_message(self.chatroom, self.user, message_id)
+        if event:
+            pin_primary(self.user)
+        return event
+
+    async def _handle_delete(self, data):
+        if not self.chatroom or not isinstance(data.get("message_id"), int):
+            return
+        event = await self.delete_message_sync(data["message_id"])
+        if event:
+            await self.channel_layer.group_send(self.chatroom_name, event)
+
+    @database_sync_to_async
+    @instrument("toggle_reaction")
+    def toggle_reaction_sync(self, message_id, emoji):
+        counts = toggle_reaction(self.chatroom, self.user, message_id, emoji)
+        if counts is not None:
+            pin_primary(self.user)
+        return counts
+
+    async def _handle_reaction(self, data):
+        """Toggle a reaction, the new counts go out merged with the room's other reactions"""
+        message_id = data.get("message_id")
+        if not self.chatroom or not isinstance(message_id, int):
+            return
+        counts = await self.toggle_reaction_sync(message_id, data.get("emoji"))
+        if counts is None:
+            return
+        pending_reactions.setdefault(self.chatroom_name, {})[message_id] = counts
+        reaction_broadcasts.schedule(("reactions", self.chatroom_name), self._send_reactions)
+
+    async def _send_reactions(self):
+        changed = pending_reactions.pop(self.chatroom_name, None)
+        if not changed:
+            return
+        # Cached renders of these messages show the old counts
+        await database_sync_to_async(refresh_entries)(self.chatroom.pk, list(changed))
         await self.channel_layer.group_send(
             self.chatroom_name,
             {
-                "type": "chat.message",
-                "message_id": message.id,
-                "username": self.user.username,
+                "type": "message.reactions",
+                "room": self.chatroom_name,
+                # Keyed as they will be in the JSON frame
+                "reactions": {str(message_id): counts for message_id, counts in changed.items()},
             }
         )
 
     @database_sync_to_async
+    @instrument("handle_seen")
     def handle_seen_sync(self):
         """Sync method to mark messages as seen"""
         unseen_messages = GroupMessage.objects.filter(
             group=self.chatroom
         ).exclude(seen_by=self.user)
-        
+
         for msg in unseen_messages:
             msg.seen_by.add(self.user)
+        RoomReadState.mark_read(self.user, self.chatroom)
 
     async def _handle_seen(self):
         """Mark messages as seen"""
-        if not hasattr(self, 'chatroom'):
+        if not self.chatroom:
             return
         await self.handle_seen_sync()
 
+    def _handle_typing(self):
+        """Register a typing event, the tracker throttles and merges them"""
+        if not self.chatroom:
+            return
+        if typing_tracker.touch(self.chatroom_name, self.user.username, self.display_name):
+            typing_tracker.schedule(self.chatroom_name, self.channel_layer)
+
+    def _stop_typing(self):
+        """Remove the user from the typing list of the room"""
+        if typing_tracker.clear(self.chatroom_name, self.user.username):
+            typing_tracker.schedule(self.chatroom_name, self.channel_layer)
+
     @database_sync_to_async
+    @instrument("get_message_data")
     def get_message_data_sync(self, message_id):
         """Sync method to get message data"""
-        try:
-            message = GroupMessage.objects.select_related('author').get(id=message_id)
-            
-            # Check if message has valid content
-            if not message.body and not message.file:
-                return None
-                
-            message_data = {
-                "message_id": message.id,
-                "username": message.author.username,
-                "timestamp": message.created.isoformat(),
-            }
-            
-            # Add body only if it exists and is not empty
-            if message.body and message.body.strip():
-                message_data["message"] = message.body.strip()
-                message_data["type"] = "text"
-            elif message.file:
-                # For file messages, send file information
-                message_data["file_url"] = message.file.url
-                message_data["filename"] = message.filename
-                message_data["file_type"] = message.file_type
-                message_data["is_image"] = message.is_image
-                message_data["is_gif"] = message.is_gif
-                message_data["is_pdf"] = message.is_pdf
-                message_data["type"] = "file"
-            else:
-                return None
-                
-            return message_data
-            
-        except GroupMessage.DoesNotExist:
-            return None
-    
+        messages = GroupMessage.objects.select_related('author')
+        with replica_reads(self.user):
+            message = messages.filter(id=message_id).first()
+        if message is None:
+            # Just sent, the replica may not have it yet
+            message = messages.filter(id=message_id).first()
+        return message_payload(message) if message else None
+
+    async def _update_online_count(self):
+        """Update online count for all users, once per burst of joins and leaves"""
+        if self.chatroom:
+            schedule_online_count(self.chatroom)
+
+
+class RoomEventsMixin:
+    """Channel layer handlers for room events, routed by the room they belong to"""
+
+    async def _leave_rooms(self):
+        """Leave every joined room, one failing doesn't keep the user in the others"""
+        rooms, self.rooms = list(self.rooms.values()), {}
+        for room in rooms:
+            try:
+                await room.leave()
+            except Exception as e:
+                logger.error(f"Leaving {room.chatroom_name} failed: {e}")
+
+    def _room_for(self, event):
+        room = self.rooms.get(event.get("room"))
+        if room is None and len(self.rooms) == 1 and "room" not in event:
+            room = next(iter(self.rooms.values()))
+        return room
+
+    async def send_frame(self, payload, room=None):
+        """Send a JSON frame to the client"""
+        FRAMES_SENT.inc(type=payload.get("type"))
+        await self.send(text_data=json.dumps(payload))
 
     async def chat_message(self, event):
         """Send message to client"""
         try:
-            message_data = await self.get_message_data_sync(event["message_id"])
-            
+            room = self._room_for(event)
+            if not room:
+                return
+            # Rendered once by the sender, older events only carry the id
+            message_data = event.get("payload")
+            if message_data:
+                message_data = dict(message_data)
+            else:
+                message_data = await room.get_message_data_sync(event["message_id"])
+
             if not message_data:
-                print(f"[WARNING] Empty or invalid message with ID {event.get('message_id')}")
+                logger.warning(f"Empty or invalid message with ID {event.get('message_id')}")
                 return
-                
-            message_data["type"] = "message"
-            await self.send(text_data=json.dumps(message_data))
-            
-        except Exception as e:
-            print(f"[ERROR] Failed to send message: {e}")
 
-    @database_sync_to_async
-    def get_online_count_sync(self):
-        """Sync method to get online count"""
-        return self.chatroom.users_online.count()
+            message_data["type"] = "message"
+            await self.send_frame(message_data, room.chatroom_name)
 
-    async def _update_online_count(self):
-        """Update online count for all users"""
-        try:
-            if hasattr(self, 'chatroom'):
-                online_count = await self.get_online_count_sync()
-                
-                await self.channel_layer.group_send(
-                    self.chatroom_name,
-                    {
-                        "type": "online.count",
-                        "online_count": online_count,
-                    }
-                )
         except Exception as e:
-            print(f"[ERROR] Online count update failed: {e}")
+            logger.error(f"Failed to send message: {e}")
+
+    # File uploads used to be sent with this event type
+    message_handler = chat_message
+
+    async def message_edit(self, event):
+        """New body of a message already on screen"""
+        room = self._room_for(event)
+        if room:
+            await self.send_frame(
+                {"type": "edit", "message_id": event["message_id"], "message": event["body"],
+                 "edited": event["edited"]},
+                room.chatroom_name,
+            )
+
+    async def message_delete(self, event):
+        room = self._room_for(event)
+        if room:
+            await self.send_frame({"type": "delete", "message_id": event["message_id"]}, room.chatroom_name)
+
+    async def message_reactions(self, event):
+        """Current reaction counts of the messages that changed, {message_id: {emoji: count}}"""
+        room = self._room_for(event)
+        if room:
+            await self.send_frame({"type": "reactions", "reactions": event["reactions"]}, room.chatroom_name)
 
     async def online_count(self, event):
         """Send online count update"""
-        await self.send(text_data=json.dumps({
+        room = self._room_for(event)
+        if not room:
+            return
+        await self.send_frame({
             "type": "online_count",
             "online_count": event["online_count"],
-        }))
+            "spectators": event.get("spectators", 0),
+        }, room.chatroom_name)
 
-    # consumers.py - Add this method to ChatroomConsumer class
-    async def message_handler(self, event):
-        """Handle message_handler type messages (for file uploads)"""
-        try:
-            message_data = await self.get_message_data_sync(event["message_id"])
-            
-            if not message_data:
-                print(f"[WARNING] Empty or invalid message with ID {event.get('message_id')}")
-                return
-                
-            message_data["type"] = "message"
-            await self.send(text_data=json.dumps(message_data))
-            
-        except Exception as e:
-            print(f"[ERROR] Failed to handle message: {e}")
+    async def typing_update(self, event):
+        """Send the merged typing frame, leaving out the receiving user"""
+        room = self._room_for(event)
+        if not room:
+            return
+        names = [name for username, name in event["typists"] if username != self.user.username]
+        await self.send_frame({
+            "type": "typing",
+            "users": names,
+            "text": typing_text(names),
+        }, room.chatroom_name)
 
 
-class OnlineStatusConsumer(AsyncWebsocketConsumer):
-    """Online status consumer for production"""
+class ChatroomConsumer(CompressionMixin, RoomEventsMixin, AsyncWebsocketConsumer):
+    """Production-ready WebSocket consumer with proper timeout handling"""
+
+    compression_endpoint = "chatroom"
 
     async def connect(self):
+        """Handle WebSocket connection with timeout protection"""
+        self.rooms = {}
+        self.admitted = False
+        try:
+            # Set connection timeout
+            await asyncio.wait_for(self._connect_internal(), timeout=15.0)
+        except asyncio.TimeoutError:
+            logger.error("WebSocket connection timeout")
+            await self.close(code=1011)  # Internal error code
+        except Exception as e:
+            logger.error(f"Connection failed: {e}")
+            await self.close()
+
+    async def _connect_internal(self):
+        """Internal connection method"""
         self.user = self.scope["user"]
         if not self.user.is_authenticated:
-            await self.close()
+            await self.close(code=4000)  # Custom close code for auth failure
+            return
+
+        self.chatroom_name = self.scope["url_route"]["kwargs"]["chatroom_name"]
+        self.negotiate_compression()
+
+        # Accept connection immediately, unless this worker is at its connect rate
+        self.admitted = await admit(self)
+        if not self.admitted:
             return
+        SOCKETS_OPEN.inc(endpoint="chatroom")
 
-        self.group_name = "online_status"
+        room = RoomSession(self, self.chatroom_name)
+        self.rooms[self.chatroom_name] = room
+        await room.join()
 
+    async def disconnect(self, close_code):
+        """Handle disconnection with proper cleanup"""
+        try:
+            if self.admitted:
+                SOCKETS_OPEN.dec(endpoint="chatroom")
+                release(self)
+            await self._leave_rooms()
+        except Exception as e:
+            logger.error(f"Disconnect cleanup failed: {e}")
+
+    async def receive(self, text_data):
+        """Handle incoming messages with error handling"""
+        touch(self)
+        try:
+            data = json.loads(text_data)
+            FRAMES_RECEIVED.inc(type=data.get("type") or ("message" if data.get("body") else "unknown"))
+            room = self.rooms.get(self.chatroom_name)
+            if room:
+                await room.receive(data)
+        except json.JSONDecodeError:
+            logger.error("Invalid JSON received")
+        except Exception as e:
+            logger.error(f"Message processing failed: {e}")
+
+
+class PresenceMixin:
+    """Server wide online users tracking shared by the presence sockets"""
+
+    async def presence_join(self):
         # Add to online tracking
         if self.user.username not in ONLINE_USERS:
             ONLINE_USERS[self.user.username] = set()
         ONLINE_USERS[self.user.username].add(self.channel_name)
 
-        await self.channel_layer.group_add(self.group_name, self.channel_name)
-        await self.accept()
-
+        await self.channel_layer.group_add(PRESENCE_GROUP, self.channel_name)
         # Broadcast updated online count to all clients
         await self._broadcast_online_count()
 
-    async def disconnect(self, close_code):
+    async def presence_leave(self):
         if self.user.username in ONLINE_USERS:
             ONLINE_USERS[self.user.username].discard(self.channel_name)
             if not ONLINE_USERS[self.user.username]:
                 del ONLINE_USERS[self.user.username]
 
-        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        await self.channel_layer.group_discard(PRESENCE_GROUP, self.channel_name)
         # Broadcast updated online count to all clients
         await self._broadcast_online_count()
 
-    async def receive(self, text_data):
-        # Keep connection alive
-        await self.send(text_data=json.dumps({"type": "pong"}))
-
     async def _broadcast_online_count(self):
+        broadcasts.schedule(PRESENCE_GROUP, self._send_presence_count)
+
+    async def _send_presence_count(self):
         # Count unique online users
         online_count = len(ONLINE_USERS)
+        ONLINE_USERS_TRACKED.set(online_count)
         await self.channel_layer.group_send(
-            self.group_name,
+            PRESENCE_GROUP,
             {
-                "type": "online.count",
+                "type": "presence.count",
                 "online_count": online_count,
             }
         )
 
-    async def online_count(self, event):
+
+class MultiplexConsumer(CompressionMixin, PresenceMixin, RoomEventsMixin, AsyncWebsocketConsumer):
+    """
+    One socket for many rooms and the presence feed.
+
+    Clients send {"action": "subscribe", "room": name} or
+    {"action": "subscribe", "stream": "presence"} (and "unsubscribe"),
+    room frames carry a "room" key both ways.
+    """
+
+    compression_endpoint = "multiplex"
+
+    async def connect(self):
+        self.rooms = {}
+        self.presence = False
+        self.admitted = False
+        self.user = self.scope["user"]
+        if not self.user.is_authenticated:
+            await self.close(code=4000)
+            return
+        self.negotiate_compression()
+        self.admitted = await admit(self)
+        if self.admitted:
+            SOCKETS_OPEN.inc(endpoint="multiplex")
+            # Mention notifications for this user, whichever rooms are open
+            await self.channel_layer.group_add(user_group(self.user.id), self.channel_name)
+
+    async def disconnect(self, close_code):
+        try:
+            if self.admitted:
+                SOCKETS_OPEN.dec(endpoint="multiplex")
+                release(self)
+                await self.channel_layer.group_discard(user_group(self.user.id), self.channel_name)
+            await self._leave_rooms()
+            if self.presence:
+                await self.presence_leave()
+        except Exception as e:
+            logger.error(f"Disconnect cleanup failed: {e}")
+
+    async def send_frame(self, payload, room=None):
+        if room:
+            payload["room"] = room
+        FRAMES_SENT.inc(type=payload.get("type"))
+        await self.send(text_data=json.dumps(payload))
+
+    async def receive(self, text_data):
+        touch(self)
+        try:
+            data = json.loads(text_data)
+            action = data.get("action")
+            FRAMES_RECEIVED.inc(type=action or data.get("type") or ("message" if data.get("body") else "unknown"))
+            if action == "subscribe":
+                await self._subscribe(data)
+            elif action == "unsubscribe":
+                await self._unsubscribe(data)
+            elif data.get("type") == "ping":
+                await self.send_frame({"type": "pong"})
+            elif data.get("type") == "pong":
+                pass
+            elif data.get("room") in self.rooms:
+                await self.rooms[data["room"]].receive(data)
+        except json.JSONDecodeError:
+            logger.error("Invalid JSON received")
+        except Exception as e:
+            logger.error(f"Message processing failed: {e}")
+
+    async def _subscribe(self, data):
+        if data.get("stream") == "presence":
+            if not self.presence:
+                self.presence = True
+                await self.presence_join()
+            await self.send_frame({"type": "subscribed", "stream": "presence"})
+            return
+
+        chatroom_name = str(data.get("room", ""))
+        if not ROOM_NAME.fullmatch(chatroom_name):
+            await self.send_frame({"type": "error", "code": "not_found"}, chatroom_name[:100])
+            return
+        if chatroom_name in self.rooms:
+            await self.send_frame({"type": "subscribed"}, chatroom_name)
+            return
+        if len(self.rooms) >= MULTIPLEX_MAX_ROOMS:
+            await self.send_frame({"type": "error", "code": "too_many_rooms"}, chatroom_name)
+            return
+
+        room = RoomSession(self, chatroom_name)
+        # Only a joined room is left again on disconnect
+        if await room.join():
+            self.rooms[chatroom_name] = room
+            await self.send_frame({"type": "subscribed"}, chatroom_name)
+        else:
+            await self.channel_layer.group_discard(chatroom_name, self.channel_name)
+            await self.send_frame({"type": "error", "code": "not_found"}, chatroom_name)
+
+    async def _unsubscribe(self, data):
+        if data.get("stream") == "presence":
+            if self.presence:
+                self.presence = False
+                await self.presence_leave()
+            await self.send_frame({"type": "unsubscribed", "stream": "presence"})
+            return
+
+        room = self.rooms.pop(data.get("room"), None)
+        if room:
+            await room.leave()
+            await self.send_frame({"type": "unsubscribed"}, room.chatroom_name)
+
+    async def mention_notify(self, event):
+        await self.send_frame({
+            "type": "mention",
+            "stream": "notifications",
+            "room": event["room"],
+            "message_id": event["message_id"],
+            "author": event["author"],
+            "preview": event["preview"],
+        })
+
+    async def presence_count(self, event):
+        await self.send_frame({
+            "type": "online_count",
+            "stream": "presence",
+            "online_count": event["online_count"],
+        })
+
+
+class OnlineStatusConsumer(CompressionMixin, PresenceMixin, AsyncWebsocketConsumer):
+    """Online status consumer for production"""
+
+    compression_endpoint = "online-status"
+
+    async def connect(self):
+        self.admitted = False
+        self.user = self.scope["user"]
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+
+        self.negotiate_compression()
+        self.admitted = await admit(self)
+        if not self.admitted:
+            return
+        SOCKETS_OPEN.inc(endpoint="online_status")
+        await self.presence_join()
+
+    async def disconnect(self, close_code):
+        if self.admitted:
+            SOCKETS_OPEN.dec(endpoint="online_status")
+            release(self)
+            await self.presence_leave()
+
+    async def receive(self, text_data):
+        # Keep connection alive, answers to the server's heartbeat need no reply
+        touch(self)
+        try:
+            if json.loads(text_data).get("type") == "pong":
+                return
+        except (ValueError, AttributeError):
+            pass
+        await self.send(text_data=json.dumps({"type": "pong"}))
+
+    async def presence_count(self, event):
         await self.send(text_data=json.dumps({
             "type": "online_count",
             "online_count": event["online_count"],
-        }))
\ No newline at end of file
+        }))
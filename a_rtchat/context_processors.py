@@ -1,8 +1,26 @@
-from .models import ChatGroup
+from django.contrib.auth.models import User
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from .models import ChatGroup, Mention, RoomReadState
+from .replicas import reads_from_replica
 
+@reads_from_replica
 def user_groupchats(request):
     if request.user.is_authenticated:
-        groups = ChatGroup.objects.filter(members=request.user)
+        # One query: rooms sorted by activity with their last message,
+        # the other member of private chats and the unread count
+        other_members = User.objects.filter(chat_groups=OuterRef('pk')).exclude(pk=request.user.pk)
+        read_count = RoomReadState.objects.filter(group=OuterRef('pk'), user=request.user).values('read_count')[:1]
+        groups = (
+            ChatGroup.objects.filter(members=request.user)
+            .select_related('last_message__author')
+            .annotate(
+                other_username=Subquery(other_members.values('username')[:1]),
+                other_displayname=Subquery(other_members.values('profile__displayname')[:1]),
+                unread=Greatest(F('message_count') - Coalesce(Subquery(read_count), Value(0)), Value(0)),
+            )
+            .order_by(F('last_activity').desc(nulls_last=True), '-id')
+        )
         group_list = []
         for group in groups:
             # For group chats, use groupchat_name if available
@@ -10,15 +28,29 @@ def user_groupchats(request):
                 display_name = group.groupchat_name
             else:
                 # For private chats, show the other user's name
-                other_members = group.members.exclude(pk=request.user.pk)
-                if other_members.exists():
-                    other = other_members.first()
-                    display_name = getattr(other.profile, 'name', other.username)
-                else:
-                    display_name = group.group_name
+                display_name = group.other_displayname or group.other_username or group.group_name
+            last_message = group.last_message
+            if last_message and last_message.deleted_at:
+                preview, preview_author = 'Message deleted', last_message.author.username
+            elif last_message:
+                preview = last_message.body or last_message.filename or ''
+                preview_author = last_message.author.username
+            else:
+                preview = preview_author = ''
             group_list.append({
                 'group_name': group.group_name,
-                'display_name': display_name
+                'display_name': display_name,
+                'last_activity': group.last_activity,
+                'preview': preview,
+                'preview_author': preview_author,
+                'unread': group.unread,
             })
         return {'user_groupchats': group_list}
     return {'user_groupchats': []}
+
+
+def unread_mentions(request):
+    if request.user.is_authenticated:
+        # Served by the partial (user, unread) index
+        return {'unread_mentions': Mention.objects.filter(user=request.user, read=False).count()}
+    return {'unread_mentions': 0}
@@ -0,0 +1,113 @@
+"""
+Message edits, soft deletes and reactions.
+
+Each change returns a small channel layer event (message.edit,
+message.delete, or the reaction counts of one message) that clients apply
+to the message already on screen, instead of re-fetching or re-rendering
+it. Every change bumps GroupMessage.version, which is part of the cache
+key of the message's rendered fragments. Edits and deletes re-render the
+message's entry in the room's recent messages cache at once; reactions
+come in bursts, so the consumer re-renders the entries once per merged
+reactions broadcast.
+
+Reaction counts live in GroupMessage.reactions, updated under a row lock
+together with the Reaction row, so reading them never needs a COUNT.
+"""
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from .models import GroupMessage, Mention, Reaction
+from .moderation import clean_body
+from .recent_cache import refresh_entries
+
+
+def _live_messages(chat_group):
+    return GroupMessage.objects.filter(group=chat_group, deleted_at__isnull=True)
+
+
+def _touch_thread(message_id):
+    """A thread's parent previews its last reply, re-render it when that reply changes. Returns the parent ids"""
+    parents = GroupMessage.objects.filter(last_reply_id=message_id)
+    parent_ids = list(parents.values_list('id', flat=True))
+    if parent_ids:
+        parents.update(version=F('version') + 1)
+    return parent_ids
+
+
+def edit_message(chat_group, user, message_id, body):
+    """
+    Replace the body of one of user's text messages, returns the event or
+    None when there is nothing user may edit. Raises MessageBlocked.
+    """
+    body = (body or '').strip()
+    if not body:
+        return None
+    body = clean_body(body)
+    edited = timezone.now()
+    updated = _live_messages(chat_group).filter(pk=message_id, author=user, body__gt='').update(
+        body=body, edited=edited, version=F('version') + 1
+    )
+    if not updated:
+        return None
+    refresh_entries(chat_group.pk, [message_id, *_touch_thread(message_id)])
+    return {
+        "type": "message.edit",
+        "room": chat_group.group_name,
+        "message_id": message_id,
+        "body": body,
+        "edited": edited.isoformat(),
+    }
+
+
+def delete_message(chat_group, user, message_id):
+    """Soft delete a message of user's, or any message for the room admin. Returns the event or None"""
+    allowed = Q(author=user) | Q(group__admin=user)
+    updated = _live_messages(chat_group).filter(allowed, pk=message_id).update(
+        deleted_at=timezone.now(), version=F('version') + 1
+    )
+    if not updated:
+        return None
+    # The inbox shouldn't lead to a message that is gone
+    Mention.objects.filter(message_id=message_id).delete()
+    refresh_entries(chat_group.pk, [message_id, *_touch_thread(message_id)])
+    return {
+        "type": "message.delete",
+        "room": chat_group.group_name,
+        "message_id": message_id,
+    }
+
+
+def toggle_reaction(chat_group, user, message_id, emoji):
+    """Add or take back user's emoji on a message, returns its new counts or None"""
+    if emoji not in Reaction.EMOJI:
+        return None
+    with transaction.atomic():
+        message = (
+            _live_messages(chat_group).select_for_update().filter(pk=message_id).only('id', 'reactions').first()
+        )
+        if message is None:
+            return None
+        removed, _ = Reaction.objects.filter(message=message, user=user, emoji=emoji).delete()
+        if not removed:
+            Reaction.objects.create(message=message, user=user, emoji=emoji)
+        counts = dict(message.reactions)
+        count = counts.get(emoji, 0) + (-1 if removed else 1)
+        if count > 0:
+            counts[emoji] = count
+        else:
+            counts.pop(emoji, None)
+        GroupMessage.objects.filter(pk=message.pk).update(reactions=counts, version=F('version') + 1)
+    return counts
+
+
+def refresh_reaction_counts(message_ids):
+    """Recount the reactions of messages, after Reaction rows were removed in bulk"""
+    counts = {message_id: {} for message_id in message_ids}
+    rows = (
+        Reaction.objects.filter(message_id__in=message_ids)
+        .values_list('message_id', 'emoji').annotate(count=Count('id')).order_by()
+    )
+    for message_id, emoji, count in rows:
+        counts[message_id][emoji] = count
+    for message_id, message_counts in counts.items():
+        GroupMessage.objects.filter(pk=message_id).update(reactions=message_counts, version=F('version') + 1)
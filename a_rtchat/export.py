@@ -0,0 +1,127 @@
+"""
+Streaming export of a room's history as JSONL or CSV, optionally gzipped.
+
+Rows come from the archive first (they are the oldest) and then from
+GroupMessage through a server-side cursor, and are encoded, compressed and
+sent in chunks of about EXPORT_CHUNK_BYTES, so memory use doesn't depend
+on the size of the room.
+"""
+import csv
+import json
+import zlib
+from collections import OrderedDict
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from .archive import iter_archived_rows
+
+EXPORT_CHUNK_BYTES = 64 * 1024
+CURSOR_CHUNK_SIZE = 2000
+FIELDS = ('id', 'author', 'body', 'file', 'created', 'reply_to')
+FORMATS = {
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+# Usernames remembered for archived rows, which only carry author_id
+USERNAME_CACHE_SIZE = 10000
+
+
+class _UsernameCache:
+    def __init__(self, size=USERNAME_CACHE_SIZE):
+        self.size = size
+        self._names = OrderedDict()
+
+    def get(self, user_id):
+        if user_id in self._names:
+            self._names.move_to_end(user_id)
+            return self._names[user_id]
+        name = get_user_model().objects.filter(pk=user_id).values_list('username', flat=True).first() or ''
+        self._names[user_id] = name
+        if len(self._names) > self.size:
+            self._names.popitem(last=False)
+        return name
+
+
+def export_rows(group):
+    """Every message of a group as a dict of FIELDS, oldest first"""
+    usernames = _UsernameCache()
+    for row in iter_archived_rows(group):
+        if row.get('deleted'):
+            continue
+        yield {
+            'id': row['id'],
+            'author': usernames.get(row['author_id']),
+            'body': row['body'],
+            'file': row['file'],
+            'created': row['created'],
+            'reply_to': row.get('reply_to'),
+        }
+    messages = group.chat_messages.filter(deleted_at__isnull=True).order_by('id').values_list(
+        'id', 'author__username', 'body', 'file', 'created', 'reply_to'
+    )
+    for message_id, author, body, file, created, reply_to in messages.iterator(chunk_size=CURSOR_CHUNK_SIZE):
+        yield {
+            'id': message_id,
+            'author': author,
+            'body': body,
+            'file': str(file) if file else None,
+            'created': created.isoformat(),
+            'reply_to': reply_to,
+        }
+
+
+class _Line:
+    """File-like target for csv.writer that hands back what was written"""
+
+    def write(self, value):
+        return value
+
+
+def encode_rows(rows, fmt):
+    if fmt == 'csv':
+        writer = csv.writer(_Line())
+        yield writer.writerow(FIELDS)
+        for row in rows:
+            yield writer.writerow([row[field] if row[field] is not None else '' for field in FIELDS])
+    else:
+        for row in rows:
+            yield json.dumps(row) + '\n'
+
+
+def export_chunks(group, fmt='jsonl', compress=False):
+    """Bytes of the export in chunks of about EXPORT_CHUNK_BYTES"""
+    # wbits 31: a gzip container, so the download opens as a .gz file
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = []
+    size = 0
+    for line in encode_rows(export_rows(group), fmt):
+        data = line.encode('utf-8')
+        if compressor:
+            data = compressor.compress(data)
+        if data:
+            buffer.append(data)
+            size += len(data)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if compressor:
+        buffer.append(compressor.flush())
+    if buffer:
+        yield b''.join(buffer)
+
+
+async def aiter_chunks(chunks):
+    """
+    Async wrapper for ASGI: Django would otherwise collect a sync iterator
+    into a list before sending it. Every step runs in the request's sync
+    thread, the one holding the database cursor.
+    """
+    step = sync_to_async(next, thread_sensitive=True)
+    while True:
+        chunk = await step(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def export_filename(group, fmt, compress):
+    return f'{group.group_name}.{fmt}' + ('.gz' if compress else '')
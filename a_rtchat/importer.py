@@ -0,0 +1,241 @@
+"""
+Bulk import of chat history from JSONL files, one room per file.
+
+The first line describes the room, every other line is a message or a
+read state:
+
+    {"room": "general", "name": "General", "private": false, "admin": "alice", "members": ["alice", "bob"]}
+    {"author": "alice", "body": "hi", "created": "2024-01-01T10:00:00Z", "seen_by": ["bob"], "delivered_to": ["bob"]}
+    {"read": {"bob": 120}}
+
+Messages go in with bulk_create in batches of IMPORT_BATCH_SIZE, then one
+bulk_update puts back the created times auto_now_add replaced, their
+seen_by/delivered_to rows with one bulk insert per relation per batch.
+Each batch commits together with the file's ImportCheckpoint (the byte
+offset of the next line), so an interrupted import resumes after the last
+committed batch without duplicating or losing messages.
+
+bulk_create skips save() and the signals, so what they would maintain per
+row is done once per room at the end instead: the group's counters and
+last message and the recent messages cache. Read states are written with
+the batch they follow. Missing users are created with unusable passwords,
+along with their Profile rows.
+"""
+import json
+import logging
+import time
+from datetime import timezone as dt_timezone
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from a_users.models import Profile
+from .mentions import invalidate_room
+from .models import ChatGroup, GroupMessage, ImportCheckpoint, RoomReadState
+from .recent_cache import invalidate_group
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = getattr(settings, 'CHAT_IMPORT_BATCH_SIZE', 2000)
+# Seconds between progress lines of one file
+PROGRESS_INTERVAL = 5.0
+BODY_MAX_LENGTH = GroupMessage._meta.get_field('body').max_length
+# Only maintained for live reads, the import doesn't need it until the end
+DEFERRABLE_INDEXES = ['groupmessage_group_created']
+
+
+class ImportFailed(Exception):
+    pass
+
+
+class _Users:
+    """username -> id, creating the users that don't exist yet"""
+
+    def __init__(self):
+        self.ids = {}
+
+    def resolve(self, usernames):
+        User = get_user_model()
+        # The pre_save signal lowercases usernames, bulk_create doesn't run it
+        missing = {name.lower() for name in usernames if name and name.lower() not in self.ids}
+        if not missing:
+            return
+        found = dict(User.objects.filter(username__in=missing).values_list('username', 'id'))
+        new = missing - found.keys()
+        if new:
+            password = make_password(None)
+            User.objects.bulk_create(
+                [User(username=name, password=password) for name in new], ignore_conflicts=True
+            )
+            created = dict(User.objects.filter(username__in=new).values_list('username', 'id'))
+            Profile.objects.bulk_create(
+                [Profile(user_id=user_id) for user_id in created.values()], ignore_conflicts=True
+            )
+            found.update(created)
+        self.ids.update(found)
+
+    def get(self, username):
+        return self.ids.get((username or '').lower())
+
+
+def create_messages(messages):
+    """bulk_create messages keeping their created values, call it in a transaction"""
+    created = [message.created for message in messages]
+    # auto_now_add stamps every row with now(), the given times are put back
+    # with one more UPDATE rather than by changing the shared field
+    GroupMessage.objects.bulk_create(messages)
+    for message, value in zip(messages, created):
+        message.created = value
+    GroupMessage.objects.bulk_update(messages, ['created'])
+    return messages
+
+
+def _parse_created(value):
+    created = parse_datetime(value) if value else None
+    if created is None:
+        return timezone.now()
+    if timezone.is_naive(created):
+        created = timezone.make_aware(created, dt_timezone.utc)
+    return created
+
+
+def _setup_room(header, users):
+    group_name = header.get('room')
+    if not group_name:
+        raise ImportFailed('first line has no "room"')
+    members = header.get('members') or []
+    users.resolve(members + [header.get('admin')])
+    group, _ = ChatGroup.all_objects.get_or_create(
+        group_name=group_name,
+        defaults={
+            'groupchat_name': header.get('name'),
+            'is_private': bool(header.get('private')),
+            'admin_id': users.get(header.get('admin')),
+        },
+    )
+    ChatGroup.members.through.objects.bulk_create(
+        [ChatGroup.members.through(chatgroup_id=group.pk, user_id=users.get(name))
+         for name in members if users.get(name)],
+        ignore_conflicts=True,
+    )
+    return group
+
+
+def _write_batch(group, records, read_counts, users, checkpoint, offset, fast_commit):
+    users.resolve(read_counts.keys())
+    users.resolve({name for record in records
+                   for name in [record.get('author'), *record.get('seen_by', ()), *record.get('delivered_to', ())]})
+    messages = []
+    receipts = []
+    for record in records:
+        author_id = users.get(record.get('author'))
+        body = (record.get('body') or '')[:BODY_MAX_LENGTH]
+        # GroupMessage.save() drops messages without body or file, so does the import
+        if author_id is None or not body:
+            continue
+        messages.append(GroupMessage(group_id=group.pk, author_id=author_id, body=body,
+                                     created=_parse_created(record.get('created'))))
+        receipts.append(record)
+
+    with transaction.atomic():
+        if fast_commit and connection.vendor == 'postgresql':
+            # The checkpoint commits with the batch, a batch lost to a crash is redone on resume
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL synchronous_commit TO OFF')
+        create_messages(messages)
+        for field in ('seen_by', 'delivered_to'):
+            through = getattr(GroupMessage, field).through
+            through.objects.bulk_create(
+                [through(groupmessage_id=message.pk, user_id=users.get(name))
+                 for message, record in zip(messages, receipts)
+                 for name in record.get(field, ()) if users.get(name)],
+                ignore_conflicts=True,
+            )
+        if read_counts:
+            _apply_read_states(group, read_counts, users)
+        checkpoint.offset = offset
+        checkpoint.messages += len(messages)
+        checkpoint.save(update_fields=['offset', 'messages', 'updated'])
+    return len(messages)
+
+
+def _apply_read_states(group, read_counts, users):
+    RoomReadState.objects.bulk_create(
+        [RoomReadState(user_id=users.get(name), group_id=group.pk, read_count=count)
+         for name, count in read_counts.items() if users.get(name)],
+        update_conflicts=True,
+        unique_fields=['user', 'group'],
+        update_fields=['read_count'],
+    )
+
+
+def import_file(path, batch_size=IMPORT_BATCH_SIZE, fast_commit=False, log=None):
+    """Import one room file, resuming from its checkpoint. Returns (room, messages imported now, seconds)"""
+    log = log or logger.info
+    source = str(path)
+    checkpoint, _ = ImportCheckpoint.objects.get_or_create(source=source)
+    if checkpoint.done:
+        return checkpoint.group.group_name if checkpoint.group else source, 0, 0.0
+
+    started = time.monotonic()
+    last_progress = started
+    imported = 0
+    users = _Users()
+    read_counts = {}
+    with open(path, 'rb') as f:
+        header = json.loads(f.readline())
+        if checkpoint.group is None:
+            checkpoint.group = _setup_room(header, users)
+            checkpoint.offset = f.tell()
+            checkpoint.save(update_fields=['group', 'offset', 'updated'])
+        group = checkpoint.group
+        f.seek(checkpoint.offset)
+        batch = []
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ImportFailed(f'bad JSON at byte {f.tell() - len(line)}: {e}')
+            if 'read' in record:
+                read_counts.update(record['read'])
+                continue
+            batch.append(record)
+            if len(batch) >= batch_size:
+                imported += _write_batch(group, batch, read_counts, users, checkpoint, f.tell(), fast_commit)
+                batch, read_counts = [], {}
+                now = time.monotonic()
+                if now - last_progress >= PROGRESS_INTERVAL:
+                    last_progress = now
+                    log(f'{group.group_name}: {checkpoint.messages} messages, '
+                        f'{imported / (now - started):.0f} rows/s')
+        if batch or read_counts:
+            imported += _write_batch(group, batch, read_counts, users, checkpoint, f.tell(), fast_commit)
+
+    group.refresh_activity(recount=True)
+    invalidate_group(group.pk)
+    invalidate_room(group.pk)
+    checkpoint.done = True
+    checkpoint.save(update_fields=['done', 'updated'])
+    return group.group_name, imported, time.monotonic() - started
+
+
+def drop_deferrable_indexes():
+    """Postgres only: drop the indexes only live reads need, returns their definitions"""
+    if connection.vendor != 'postgresql':
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT indexname, indexdef FROM pg_indexes WHERE indexname = ANY(%s)', [DEFERRABLE_INDEXES])
+        definitions = cursor.fetchall()
+        for name, _ in definitions:
+            cursor.execute(f'DROP INDEX IF EXISTS {name}')
+    return [definition for _, definition in definitions]
+
+
+def create_indexes(definitions):
+    with connection.cursor() as cursor:
+        for definition in definitions:
+            cursor.execute(definition.replace('CREATE INDEX', 'CREATE INDEX IF NOT EXISTS', 1))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from a_rtchat.archive import ARCHIVE_CHUNK_SIZE, archive_group, retention_cutoff
+from a_rtchat.models import ChatGroup
+
+
+class Command(BaseCommand):
+    help = "Move messages past their room's retention into compressed MessageArchive chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, help="Override every room's retention")
+        parser.add_argument("--room", help="Only archive this group_name")
+        parser.add_argument("--chunk-size", type=int, default=ARCHIVE_CHUNK_SIZE)
+        parser.add_argument("--export-dir", help="Also append each chunk to <dir>/<room>/<YYYY-MM>.jsonl.gz")
+        parser.add_argument("--dry-run", action="store_true", help="Only report how many messages would move")
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] <= 0:
+            raise CommandError("--chunk-size must be positive")
+        if options["days"] is not None and options["days"] <= 0:
+            raise CommandError("--days must be positive")
+
+        groups = ChatGroup.objects.all()
+        if options["room"]:
+            groups = groups.filter(group_name=options["room"])
+            if not groups.exists():
+                raise CommandError(f"No room named {options['room']}")
+
+        total = 0
+        for group in groups.iterator():
+            cutoff = retention_cutoff(group, options["days"])
+            if cutoff is None:
+                continue
+            count = archive_group(
+                group, cutoff,
+                chunk_size=options["chunk_size"],
+                export_dir=options["export_dir"],
+                dry_run=options["dry_run"],
+            )
+            if count:
+                self.stdout.write(f"{group.group_name}: {count} messages")
+            total += count
+
+        verb = "would be archived" if options["dry_run"] else "archived"
+        self.stdout.write(self.style.SUCCESS(f"{total} messages {verb}"))
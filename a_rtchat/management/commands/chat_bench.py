@@ -0,0 +1,101 @@
+import json
+import statistics
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from a_rtchat import recent_cache
+from a_rtchat.models import ChatGroup, GroupMessage
+
+USER_PREFIX = "bench_"
+ROOM_NAME = "bench-room"
+
+
+class Command(BaseCommand):
+    help = "Benchmark the initial chat room render: database path vs cold and warm recent cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=200, help="Messages seeded into the bench room")
+        parser.add_argument("--authors", type=int, default=10)
+        parser.add_argument("--iterations", type=int, default=50)
+        parser.add_argument("--output", help="Write the report as JSON to this file")
+        parser.add_argument("--cleanup", action="store_true", help="Delete the bench users and room and exit")
+
+    def handle(self, *args, **options):
+        if options["cleanup"]:
+            ChatGroup.objects.filter(group_name=ROOM_NAME).delete()
+            User.objects.filter(username__startswith=USER_PREFIX).delete()
+            self.stdout.write("Bench data removed")
+            return
+        if options["iterations"] <= 0 or options["authors"] <= 0:
+            raise CommandError("--iterations and --authors must be positive")
+
+        group, viewer = self.seed(options["messages"], options["authors"])
+        client = Client()
+        client.force_login(viewer)
+        url = f"/chat/room/{ROOM_NAME}"
+
+        def database():
+            recent_cache.ENABLED = False
+
+        def cold():
+            recent_cache.ENABLED = True
+            recent_cache.invalidate_group(group.id)
+
+        def warm():
+            recent_cache.ENABLED = True
+
+        enabled = recent_cache.ENABLED
+        report = {"messages": options["messages"], "iterations": options["iterations"]}
+        try:
+            for name, setup in (("database", database), ("cold_cache", cold), ("warm_cache", warm)):
+                report[name] = self.measure(client, url, setup, options["iterations"])
+        finally:
+            recent_cache.ENABLED = enabled
+
+        output = json.dumps(report, indent=2)
+        self.stdout.write(output)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+
+    def seed(self, count, authors):
+        users = []
+        for i in range(authors):
+            user, _ = User.objects.get_or_create(username=f"{USER_PREFIX}{i}")
+            users.append(user)
+        group, _ = ChatGroup.objects.get_or_create(group_name=ROOM_NAME, defaults={"groupchat_name": "Bench"})
+        group.members.add(*users)
+        missing = count - group.chat_messages.count()
+        if missing > 0:
+            GroupMessage.objects.bulk_create(
+                GroupMessage(group=group, author=users[i % authors], body=f"bench message {i}")
+                for i in range(missing)
+            )
+            group.refresh_activity(recount=True)
+        return group, users[0]
+
+    def measure(self, client, url, setup, iterations):
+        timings = []
+        queries = []
+        setup()
+        # Warm up templates, sessions and the cache itself
+        client.get(url)
+        for _ in range(iterations):
+            setup()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise CommandError(f"{url} returned {response.status_code}")
+            queries.append(len(captured))
+        timings.sort()
+        return {
+            "p50_ms": round(statistics.median(timings), 2),
+            "p95_ms": round(timings[int(len(timings) * 0.95) - 1 if len(timings) > 1 else 0], 2),
+            "mean_ms": round(statistics.fmean(timings), 2),
+            "queries": statistics.median(queries),
+        }
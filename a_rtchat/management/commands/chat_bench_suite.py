@@ -0,0 +1,266 @@
+import asyncio
+import json
+import statistics
+import subprocess
+import time
+from contextlib import ExitStack
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Count
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from a_rtchat import connections as ws_connections, ratelimit, routing
+from a_rtchat.consumers import broadcasts
+from a_rtchat.context_processors import user_groupchats
+from a_rtchat.metrics import OPERATION_SECONDS
+from a_rtchat.models import ChatGroup, GroupMessage
+from a_rtchat.views import chat_dropdown_context
+
+PATHS = ("chat_view", "user_groupchats", "chat_dropdown_context", "get_or_create_chatroom",
+         "ws_connect", "ws_send", "ws_seen")
+
+
+def summarize(timings, queries):
+    timings = sorted(timings)
+    return {
+        "p50_ms": round(statistics.median(timings), 2),
+        "p95_ms": round(timings[int(len(timings) * 0.95) - 1 if len(timings) > 1 else 0], 2),
+        "mean_ms": round(statistics.fmean(timings), 2),
+        "queries": statistics.median(queries),
+    }
+
+
+def bench_host():
+    """A Host header the site accepts, the test client's testserver isn't in ALLOWED_HOSTS"""
+    host = settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost'
+    return 'localhost' if host == '*' else host.lstrip('.')
+
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "Time the key chat paths and count their queries against a seed_chat_data dataset"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--prefix", default="seed", help="Prefix the dataset was generated with")
+        parser.add_argument("--iterations", type=int, default=30)
+        parser.add_argument("--paths", nargs="+", choices=PATHS, default=list(PATHS))
+        parser.add_argument("--output", help="Write the report as JSON to this file")
+        parser.add_argument("--compare", help="Report of an earlier run to compare against")
+
+    def handle(self, *args, **options):
+        if options["iterations"] <= 0:
+            raise CommandError("--iterations must be positive")
+        prefix = options["prefix"]
+        rooms = ChatGroup.objects.filter(group_name__startswith=f"{prefix}-")
+        room = rooms.filter(is_private=False).order_by("-message_count").first()
+        private_room = rooms.filter(is_private=True).order_by("-message_count").first()
+        if room is None or private_room is None:
+            raise CommandError(f"No {prefix} dataset, generate one with seed_chat_data first")
+        # The member of the busiest room who is in the most rooms: the heaviest sidebar
+        self.viewer = (
+            User.objects.filter(pk__in=room.members.values("pk"))
+            .annotate(rooms=Count("chat_groups")).order_by("-rooms", "id").first()
+        )
+        self.room = room
+        self.private_members = list(private_room.members.order_by("id"))
+        self.iterations = options["iterations"]
+
+        report = {
+            "commit": current_commit(),
+            "vendor": connection.vendor,
+            "iterations": self.iterations,
+            "dataset": {
+                "users": User.objects.filter(username__startswith=f"{prefix}_").count(),
+                "rooms": rooms.count(),
+                "messages": GroupMessage.objects.filter(group__in=rooms).count(),
+                "room": room.group_name,
+                "room_messages": room.message_count,
+                "viewer_rooms": self.viewer.rooms,
+            },
+            "paths": {},
+        }
+        rate_limit_enabled = ratelimit.ENABLED
+        ratelimit.ENABLED = False
+        try:
+            for name in options["paths"]:
+                self.stdout.write(f"{name}...")
+                report["paths"][name] = getattr(self, f"bench_{name}")()
+        finally:
+            ratelimit.ENABLED = rate_limit_enabled
+
+        output = json.dumps(report, indent=2)
+        self.stdout.write(output)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        if options["compare"]:
+            self.compare(report, options["compare"])
+
+    def measure(self, func):
+        func()  # warm up
+        timings = []
+        queries = []
+        for _ in range(self.iterations):
+            # Queries on the primary and on the replicas
+            with ExitStack() as stack:
+                captured = [stack.enter_context(CaptureQueriesContext(conn)) for conn in connections.all()]
+                started = time.perf_counter()
+                func()
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(sum(len(queries) for queries in captured))
+        return summarize(timings, queries)
+
+    def get(self, user, url, status=200):
+        client = Client(HTTP_HOST=bench_host())
+        client.force_login(user)
+
+        def request():
+            response = client.get(url)
+            if response.status_code != status:
+                raise CommandError(f"{url} returned {response.status_code}")
+        return request
+
+    def bench_chat_view(self):
+        return self.measure(self.get(self.viewer, f"/chat/room/{self.room.group_name}"))
+
+    def _context(self, processor):
+        request = RequestFactory().get("/")
+        request.user = self.viewer
+        return lambda: processor(request)
+
+    def bench_user_groupchats(self):
+        return self.measure(self._context(user_groupchats))
+
+    def bench_chat_dropdown_context(self):
+        return self.measure(self._context(chat_dropdown_context))
+
+    def bench_get_or_create_chatroom(self):
+        # An existing private chat: the lookup, not the creation, is what runs on every click
+        user, other = self.private_members
+        return self.measure(self.get(user, f"/chat/{other.username}", status=302))
+
+    # WebSocket paths run through the real consumer. Their database work is
+    # sent back to this thread (database_sync_to_async is thread sensitive),
+    # so queries are counted on this thread's connection.
+
+    def bench_ws_connect(self):
+        return self._ws_bench(self._ws_close, self._ws_open)
+
+    def bench_ws_send(self):
+        return self._ws_bench(None, self._ws_send)
+
+    def bench_ws_seen(self):
+        return self._ws_bench(self._ws_new_message, self._ws_seen)
+
+    def _ws_bench(self, prepare, step):
+        db = connections["default"]
+        debug_cursor = db.force_debug_cursor
+        db.force_debug_cursor = True
+        last_id = GroupMessage.objects.filter(group=self.room).order_by("-id").values_list("id", flat=True).first()
+        try:
+            return async_to_sync(self._ws_run)(prepare, step, db)
+        finally:
+            db.force_debug_cursor = debug_cursor
+            self._remove_bench_messages(last_id or 0)
+
+    def _remove_bench_messages(self, after_id):
+        """Leave the dataset as it was for the next run"""
+        GroupMessage.objects.filter(group=self.room, id__gt=after_id, body="bench message").delete()
+        self.room.refresh_activity(recount=True)
+
+    async def _ws_run(self, prepare, step, db):
+        """prepare(communicator) runs untimed before each timed step(communicator)"""
+        timings = []
+        queries = []
+        communicator = await self._ws_open()
+        try:
+            for i in range(self.iterations + 1):
+                if prepare:
+                    communicator = await prepare(communicator)
+                db.queries_log.clear()
+                started = time.perf_counter()
+                communicator = await step(communicator)
+                # The first round warms up
+                if i:
+                    timings.append((time.perf_counter() - started) * 1000)
+                    queries.append(len(db.queries_log))
+        finally:
+            await communicator.disconnect()
+            # Let coalesced presence broadcasts fire before the loop goes away
+            await asyncio.sleep(broadcasts.delay + 0.1)
+        return summarize(timings, queries)
+
+    async def _ws_open(self, communicator=None):
+        app = URLRouter(routing.websocket_urlpatterns)
+        communicator = WebsocketCommunicator(app, f"/ws/chatroom/{self.room.group_name}/")
+        communicator.scope["user"] = self.viewer
+        # Connects are admitted at a fixed rate per worker, the bench shouldn't hit it
+        ws_connections.bucket.tokens = ws_connections.bucket.burst
+        before = OPERATION_SECONDS.count(operation="setup_chatroom")
+        connected, _ = await communicator.connect()
+        if not connected:
+            raise CommandError("WebSocket connection refused")
+        await self._wait_for("setup_chatroom", before)
+        return communicator
+
+    async def _ws_close(self, communicator):
+        await communicator.disconnect()
+        return None
+
+    async def _wait_for(self, operation, before, timeout=10.0):
+        """Until the consumer has run an instrumented operation once more"""
+        deadline = time.monotonic() + timeout
+        while OPERATION_SECONDS.count(operation=operation) == before:
+            if time.monotonic() > deadline:
+                raise CommandError(f"{operation} didn't run")
+            await asyncio.sleep(0)
+
+    async def _ws_send(self, communicator):
+        await communicator.send_to(text_data=json.dumps({"body": "bench message"}))
+        while True:
+            frame = json.loads(await communicator.receive_from(10))
+            if frame.get("type") == "message":
+                return communicator
+
+    @database_sync_to_async
+    def _create_other_message(self):
+        author = self.room.members.exclude(pk=self.viewer.pk).first() or self.viewer
+        GroupMessage.objects.create(group=self.room, author=author, body="bench message")
+
+    async def _ws_new_message(self, communicator):
+        # Something unseen for the seen frame to mark
+        await self._create_other_message()
+        return communicator
+
+    async def _ws_seen(self, communicator):
+        before = OPERATION_SECONDS.count(operation="handle_seen")
+        await communicator.send_to(text_data=json.dumps({"type": "seen"}))
+        await self._wait_for("handle_seen", before)
+        return communicator
+
+    def compare(self, report, path):
+        with open(path) as f:
+            baseline = json.load(f)
+        self.stdout.write(f"Compared with {baseline.get('commit') or path}:")
+        for name, result in report["paths"].items():
+            before = baseline.get("paths", {}).get(name)
+            if not before:
+                continue
+            change = (result["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100 if before["p50_ms"] else 0
+            self.stdout.write(
+                f"  {name}: p50 {before['p50_ms']} -> {result['p50_ms']} ms ({change:+.0f}%), "
+                f"queries {before['queries']} -> {result['queries']}"
+            )
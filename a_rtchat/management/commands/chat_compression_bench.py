@@ -0,0 +1,84 @@
+import json
+import statistics
+import time
+from django.core.management.base import BaseCommand, CommandError
+from a_rtchat.compression import deflate, inflate
+from a_rtchat.models import GroupMessage
+from a_rtchat.recent_cache import message_payload
+
+
+class Command(BaseCommand):
+    help = "Measure the bandwidth saved by WebSocket frame compression against its CPU cost"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--frames", type=int, default=500, help="Frames sampled per kind")
+        parser.add_argument("--levels", default="1,6,9", help="Comma separated zlib levels to compare")
+        parser.add_argument("--threshold", type=int, default=512, help="Frames shorter than this are sent as is")
+        parser.add_argument("--output", help="Write the report as JSON to this file")
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(level) for level in options["levels"].split(",")]
+        except ValueError:
+            raise CommandError("--levels must be comma separated integers")
+        if options["frames"] <= 0:
+            raise CommandError("--frames must be positive")
+
+        report = {"threshold": options["threshold"], "kinds": {}}
+        for kind, frames in self.sample(options["frames"]).items():
+            report["kinds"][kind] = {
+                f"level_{level}": self.measure(frames, level, options["threshold"]) for level in levels
+            }
+
+        output = json.dumps(report, indent=2)
+        self.stdout.write(output)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+
+    def sample(self, count):
+        """Frames as the consumers send them, from stored messages when there are any"""
+        messages = list(
+            GroupMessage.objects.select_related('author').order_by('-created')[:count]
+        )
+        payloads = [p for p in map(message_payload, messages) if p]
+        if not payloads:
+            payloads = [
+                {"message_id": i, "username": f"user{i % 20}", "timestamp": "2025-01-01T12:00:00+00:00",
+                 "message": f"sample chat message number {i}", "type": "text"}
+                for i in range(count)
+            ]
+        message_frames = [json.dumps({**p, "type": "message", "room": "bench-room"}) for p in payloads]
+        # A history catch-up: the last 30 messages in one frame
+        catch_up = [json.dumps({"type": "history", "messages": payloads[i:i + 30]}) for i in range(0, len(payloads), 30)]
+        presence = [json.dumps({"type": "online_count", "online_count": i, "stream": "presence"}) for i in range(count)]
+        return {"message": message_frames, "catch_up": catch_up, "presence": presence}
+
+    def measure(self, frames, level, threshold):
+        raw_bytes = sent_bytes = compressed = 0
+        timings = []
+        for frame in frames:
+            raw = frame.encode("utf-8")
+            raw_bytes += len(raw)
+            if len(raw) < threshold:
+                sent_bytes += len(raw)
+                continue
+            started = time.perf_counter()
+            data = deflate(raw, level)
+            timings.append((time.perf_counter() - started) * 1_000_000)
+            if inflate(data) != raw:
+                raise CommandError("Compressed frame didn't round trip")
+            if len(data) < len(raw):
+                compressed += 1
+                sent_bytes += len(data)
+            else:
+                sent_bytes += len(raw)
+        return {
+            "frames": len(frames),
+            "compressed_frames": compressed,
+            "raw_bytes": raw_bytes,
+            "sent_bytes": sent_bytes,
+            "saved_pct": round(100 * (1 - sent_bytes / raw_bytes), 1) if raw_bytes else 0.0,
+            "cpu_us_per_frame_p50": round(statistics.median(timings), 1) if timings else 0.0,
+            "cpu_us_per_frame_mean": round(statistics.fmean(timings), 1) if timings else 0.0,
+        }
@@ -0,0 +1,377 @@
+import asyncio
+import base64
+import json
+import os
+import random
+import statistics
+import struct
+import threading
+import time
+import tracemalloc
+from importlib import import_module
+from urllib.parse import urlparse
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.backends.signals import connection_created
+from a_rtchat.models import ChatGroup
+
+USER_PREFIX = "loadtest_"
+ROOM_PREFIX = "loadtest-"
+PAYLOAD_MARKER = "lt"
+
+
+class QueryCounter:
+    """Counts queries on every DB connection opened while it is installed"""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self):
+        connection_created.connect(self._on_connection, weak=False)
+
+    def _on_connection(self, sender, connection, **kwargs):
+        connection.execute_wrappers.append(self)
+
+
+class InProcessClient:
+    """Talks to the consumers through channels.testing, no network involved"""
+
+    def __init__(self, user, path):
+        from channels.routing import URLRouter
+        from channels.testing import WebsocketCommunicator
+        from a_rtchat import routing
+        self.communicator = WebsocketCommunicator(URLRouter(routing.websocket_urlpatterns), path)
+        self.communicator.scope["user"] = user
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=30)
+        return connected
+
+    async def send(self, payload):
+        await self.communicator.send_to(text_data=json.dumps(payload))
+
+    async def receive(self, timeout):
+        try:
+            return await self.communicator.receive_from(timeout=timeout)
+        except (asyncio.TimeoutError, AssertionError):
+            return None
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class LiveClient:
+    """
+    Real WebSocket client against a running Daphne, authenticated by session cookie.
+
+    A minimal RFC 6455 client on asyncio streams: autobahn's asyncio flavour
+    can't be used in a process where daphne already selected twisted.
+    """
+
+    def __init__(self, url, session_key):
+        self.url = url
+        self.session_key = session_key
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        parsed = urlparse(self.url)
+        secure = parsed.scheme == "wss"
+        port = parsed.port or (443 if secure else 80)
+        self.reader, self.writer = await asyncio.open_connection(parsed.hostname, port, ssl=secure or None)
+        key = base64.b64encode(os.urandom(16)).decode()
+        request = (
+            f"GET {parsed.path or '/'} HTTP/1.1\r\n"
+            f"Host: {parsed.hostname}:{port}\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\n"
+            "Sec-WebSocket-Version: 13\r\n"
+            f"Origin: {'https' if secure else 'http'}://{parsed.hostname}\r\n"
+            f"Cookie: {settings.SESSION_COOKIE_NAME}={self.session_key}\r\n"
+            "\r\n"
+        )
+        self.writer.write(request.encode())
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        return head.split(b" ", 2)[1] == b"101"
+
+    async def send(self, payload):
+        self._write_frame(0x1, json.dumps(payload).encode("utf8"))
+        await self.writer.drain()
+
+    def _write_frame(self, opcode, data):
+        mask = os.urandom(4)
+        header = bytes([0x80 | opcode])
+        if len(data) < 126:
+            header += bytes([0x80 | len(data)])
+        elif len(data) < 65536:
+            header += bytes([0x80 | 126]) + struct.pack("!H", len(data))
+        else:
+            header += bytes([0x80 | 127]) + struct.pack("!Q", len(data))
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+        self.writer.write(header + mask + masked)
+
+    async def _read_frame(self):
+        first, second = await self.reader.readexactly(2)
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", await self.reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", await self.reader.readexactly(8))[0]
+        return first & 0x0F, await self.reader.readexactly(length)
+
+    async def receive(self, timeout):
+        try:
+            while True:
+                opcode, data = await asyncio.wait_for(self._read_frame(), timeout=timeout)
+                if opcode == 0x1:
+                    return data.decode("utf8")
+                if opcode == 0x2:
+                    return data
+                if opcode == 0x8:
+                    return None
+                if opcode == 0x9:
+                    self._write_frame(0xA, data)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            return None
+
+    async def close(self):
+        if self.writer:
+            self._write_frame(0x8, struct.pack("!H", 1000))
+            self.writer.close()
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+    cuts = statistics.quantiles(values, n=100, method="inclusive") if len(values) > 1 else values * 99
+    return {
+        "count": len(values),
+        "p50_ms": round(cuts[49] * 1000, 2),
+        "p95_ms": round(cuts[94] * 1000, 2),
+        "p99_ms": round(cuts[98] * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2),
+    }
+
+
+class Command(BaseCommand):
+    help = "Simulate N users across M rooms and report connect, delivery and per-message DB cost"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--rooms", type=int, default=5)
+        parser.add_argument("--duration", type=float, default=30.0, help="Seconds of steady traffic")
+        parser.add_argument("--rate", type=float, default=0.2, help="Messages per second per user")
+        parser.add_argument("--seen-interval", type=float, default=5.0, help="Seconds between seen events per user, 0 disables")
+        parser.add_argument("--storm", type=float, default=0.0, help="Fraction of clients dropped and reconnected at once halfway through")
+        parser.add_argument("--url", help="ws://host:port of a running server, in-process communicators are used when omitted")
+        parser.add_argument("--endpoint", choices=["chatroom", "multiplex"], default="chatroom")
+        parser.add_argument("--output", help="Write the report as JSON to this file")
+        parser.add_argument("--cleanup", action="store_true", help="Delete the load test users and rooms and exit")
+
+    def handle(self, *args, **options):
+        if options["cleanup"]:
+            ChatGroup.objects.filter(group_name__startswith=ROOM_PREFIX).delete()
+            User.objects.filter(username__startswith=USER_PREFIX).delete()
+            self.stdout.write("Load test data removed")
+            return
+
+        if options["users"] < 1 or options["rooms"] < 1:
+            raise CommandError("--users and --rooms must be positive")
+
+        self.options = options
+        self.users, self.rooms = self._prepare()
+        self.query_counter = QueryCounter()
+        if not options["url"]:
+            self.query_counter.install()
+
+        report = asyncio.run(self._run())
+
+        self.stdout.write(json.dumps(report, indent=2))
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
+
+    def _prepare(self):
+        users = []
+        for i in range(self.options["users"]):
+            user, _ = User.objects.get_or_create(username=f"{USER_PREFIX}{i}")
+            users.append(user)
+        rooms = []
+        for i in range(self.options["rooms"]):
+            room, _ = ChatGroup.objects.get_or_create(
+                group_name=f"{ROOM_PREFIX}{i}", defaults={"groupchat_name": f"Load test {i}"}
+            )
+            rooms.append(room)
+        for i, user in enumerate(users):
+            rooms[i % len(rooms)].members.add(user)
+        if self.options["url"]:
+            for user in users:
+                session = import_module(settings.SESSION_ENGINE).SessionStore()
+                session[SESSION_KEY] = str(user.pk)
+                session[BACKEND_SESSION_KEY] = "django.contrib.auth.backends.ModelBackend"
+                session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+                session.create()
+                user.loadtest_session = session.session_key
+        return users, rooms
+
+    def _client(self, index):
+        user = self.users[index]
+        room = self.rooms[index % len(self.rooms)].group_name
+        if self.options["endpoint"] == "multiplex":
+            path = "/ws/multiplex/"
+        else:
+            path = f"/ws/chatroom/{room}/"
+        if self.options["url"]:
+            client = LiveClient(self.options["url"].rstrip("/") + path, user.loadtest_session)
+        else:
+            client = InProcessClient(user, path)
+        client.room = room
+        return client
+
+    async def _open(self, client):
+        started = time.perf_counter()
+        connected = await client.connect()
+        if connected and self.options["endpoint"] == "multiplex":
+            await client.send({"action": "subscribe", "room": client.room})
+        return connected, time.perf_counter() - started
+
+    async def _connect_all(self, clients):
+        results = await asyncio.gather(*(self._open(c) for c in clients), return_exceptions=True)
+        latencies, failures = [], 0
+        for result in results:
+            if isinstance(result, Exception) or not result[0]:
+                failures += 1
+            else:
+                latencies.append(result[1])
+        return latencies, failures
+
+    async def _run(self):
+        options = self.options
+        in_process = not options["url"]
+        if in_process:
+            tracemalloc.start()
+            memory_before = tracemalloc.get_traced_memory()[0]
+
+        self.clients = clients = [self._client(i) for i in range(len(self.users))]
+        connect_latencies, connect_failures = await self._connect_all(clients)
+
+        memory_per_connection = None
+        if in_process:
+            memory_after = tracemalloc.get_traced_memory()[0]
+            memory_per_connection = (memory_after - memory_before) / max(1, len(connect_latencies))
+
+        self.delivery = []
+        self.sent = 0
+        self.received = 0
+        self.refused = 0
+        self.running = True
+        readers = [asyncio.ensure_future(self._reader(c)) for c in clients]
+        queries_before = self.query_counter.count
+
+        storm = {}
+        senders = [asyncio.ensure_future(self._sender(i)) for i in range(len(clients))]
+        if options["storm"] > 0:
+            await asyncio.sleep(options["duration"] / 2)
+            storm = await self._storm(clients, readers)
+            await asyncio.sleep(options["duration"] / 2)
+        else:
+            await asyncio.sleep(options["duration"])
+
+        self.running = False
+        await asyncio.gather(*senders, return_exceptions=True)
+        # Let in-flight messages arrive
+        await asyncio.sleep(2)
+        for reader in readers:
+            reader.cancel()
+        queries = self.query_counter.count - queries_before
+
+        await asyncio.gather(*(c.close() for c in clients), return_exceptions=True)
+        if in_process:
+            tracemalloc.stop()
+
+        return {
+            "mode": "in-process" if in_process else options["url"],
+            "endpoint": options["endpoint"],
+            "users": len(self.users),
+            "rooms": len(self.rooms),
+            "duration_s": options["duration"],
+            "connect": {**percentiles(connect_latencies), "failures": connect_failures},
+            "reconnect_storm": storm,
+            "refused_with_retry": self.refused,
+            "messages_sent": self.sent,
+            "messages_delivered": self.received,
+            "messages_per_second": round(self.sent / options["duration"], 2),
+            "delivery": percentiles(self.delivery),
+            "db_queries_per_message": round(queries / self.sent, 2) if in_process and self.sent else None,
+            "memory_per_connection_bytes": round(memory_per_connection) if memory_per_connection is not None else None,
+        }
+
+    async def _sender(self, index):
+        rate = self.options["rate"]
+        seen_interval = self.options["seen_interval"]
+        last_seen = time.perf_counter()
+        # Spread the first sends so users don't fire in lockstep
+        await asyncio.sleep(random.random() / rate if rate else 0)
+        while self.running:
+            # The client may have been replaced by a reconnect storm
+            client = self.clients[index]
+            if rate:
+                body = f"{PAYLOAD_MARKER} {time.perf_counter():.6f}"
+                try:
+                    await client.send({"room": client.room, "body": body})
+                    self.sent += 1
+                except Exception:
+                    pass
+            if seen_interval and time.perf_counter() - last_seen >= seen_interval:
+                try:
+                    await client.send({"room": client.room, "type": "seen"})
+                except Exception:
+                    pass
+                last_seen = time.perf_counter()
+            await asyncio.sleep(random.expovariate(rate) if rate else seen_interval or 1)
+
+    async def _reader(self, client):
+        while True:
+            frame = await client.receive(timeout=1)
+            if frame is None:
+                continue
+            try:
+                data = json.loads(frame)
+            except (TypeError, ValueError):
+                continue
+            if data.get("type") == "retry":
+                # Refused by admission control (or drained), the socket is closing
+                self.refused += 1
+                continue
+            parts = str(data.get("message", "")).split(" ")
+            if data.get("type") == "message" and len(parts) == 2 and parts[0] == PAYLOAD_MARKER:
+                self.delivery.append(time.perf_counter() - float(parts[1]))
+                self.received += 1
+
+    async def _storm(self, clients, readers):
+        """Drop a fraction of the clients and reconnect them all at once"""
+        count = max(1, int(len(clients) * self.options["storm"]))
+        indexes = random.sample(range(len(clients)), count)
+        await asyncio.gather(*(clients[i].close() for i in indexes), return_exceptions=True)
+        for i in indexes:
+            readers[i].cancel()
+            clients[i] = self._client(i)
+        started = time.perf_counter()
+        latencies, failures = await self._connect_all([clients[i] for i in indexes])
+        for i in indexes:
+            readers[i] = asyncio.ensure_future(self._reader(clients[i]))
+        return {
+            "clients": count,
+            "total_s": round(time.perf_counter() - started, 3),
+            "connect": {**percentiles(latencies), "failures": failures},
+        }
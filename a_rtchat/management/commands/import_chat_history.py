@@ -0,0 +1,122 @@
+import multiprocessing
+import sys
+import time
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from a_rtchat.importer import (
+    IMPORT_BATCH_SIZE, ImportFailed, create_indexes, drop_deferrable_indexes, import_file,
+)
+from a_rtchat.models import ImportCheckpoint
+
+
+def _init_worker():
+    # Connections inherited from the parent can't be shared, each worker opens its own
+    connections.close_all()
+
+
+def _log(line):
+    sys.stdout.write(line + '\n')
+    sys.stdout.flush()
+
+
+def _import(args):
+    path, batch_size, fast_commit = args
+    try:
+        return str(path), import_file(path, batch_size, fast_commit, log=_log), None
+    except (ImportFailed, ValueError, OSError) as e:
+        return str(path), None, str(e)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Import chat history from JSONL files (one room per file), resumable and in parallel across rooms"
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="JSONL files or directories of *.jsonl files")
+        parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+        parser.add_argument("--workers", type=int, default=min(4, multiprocessing.cpu_count()),
+                            help="Rooms imported in parallel (always 1 on SQLite)")
+        parser.add_argument("--restart", action="store_true", help="Forget the checkpoints of these files first")
+        parser.add_argument("--defer-indexes", action="store_true",
+                            help="Postgres: drop the message timeline index during the import, rebuild it after")
+        parser.add_argument("--fast-commit", action="store_true",
+                            help="Postgres: commit batches with synchronous_commit off")
+
+    def _files(self, paths):
+        files = []
+        for value in paths:
+            path = Path(value).resolve()
+            if path.is_dir():
+                files.extend(sorted(path.glob('*.jsonl')))
+            elif path.is_file():
+                files.append(path)
+            else:
+                raise CommandError(f"{value} does not exist")
+        return files
+
+    def handle(self, *args, **options):
+        if options["batch_size"] <= 0:
+            raise CommandError("--batch-size must be positive")
+        if options["workers"] <= 0:
+            raise CommandError("--workers must be positive")
+        files = self._files(options["paths"])
+        if not files:
+            raise CommandError("No .jsonl files found")
+        if options["restart"]:
+            ImportCheckpoint.objects.filter(source__in=[str(path) for path in files]).delete()
+
+        workers = min(options["workers"], len(files))
+        if connection.vendor == 'sqlite' or 'fork' not in multiprocessing.get_all_start_methods():
+            # SQLite has a single writer, and workers need fork to inherit the Django setup
+            workers = 1
+        deferred = drop_deferrable_indexes() if options["defer_indexes"] else []
+        if deferred:
+            self.stdout.write(f"Dropped {len(deferred)} indexes for the import")
+
+        jobs = [(path, options["batch_size"], options["fast_commit"]) for path in files]
+        started = time.monotonic()
+        total = 0
+        failed = 0
+        try:
+            if workers > 1:
+                connections.close_all()
+                with multiprocessing.get_context('fork').Pool(workers, initializer=_init_worker) as pool:
+                    results = pool.imap_unordered(_import, jobs)
+                    total, failed = self._report(results, started)
+            else:
+                total, failed = self._report(map(_import, jobs), started)
+        finally:
+            if deferred:
+                self.stdout.write("Rebuilding indexes")
+                create_indexes(deferred)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {total} messages from {len(files) - failed} files in {elapsed:.1f}s "
+            f"({total / elapsed if elapsed else 0:.0f} rows/s)"
+        ))
+        if failed:
+            raise CommandError(f"{failed} files failed, run again to resume them")
+
+    def _report(self, results, started):
+        total = 0
+        failed = 0
+        for path, result, error in results:
+            if error:
+                failed += 1
+                self.stderr.write(f"{path}: {error}")
+                continue
+            room, imported, seconds = result
+            if not imported and not seconds:
+                self.stdout.write(f"{room}: already imported")
+                continue
+            total += imported
+            elapsed = time.monotonic() - started
+            rate = imported / seconds if seconds else 0
+            self.stdout.write(
+                f"{room}: {imported} messages in {seconds:.1f}s ({rate:.0f} rows/s), "
+                f"total {total} ({total / elapsed if elapsed else 0:.0f} rows/s)"
+            )
+        return total, failed
@@ -0,0 +1,76 @@
+import json
+import random
+import re
+import statistics
+import string
+import time
+from django.core.management.base import BaseCommand, CommandError
+from a_rtchat.moderation import Matcher, apply
+
+
+class Command(BaseCommand):
+    help = "Microbenchmark the content filter against per-pattern regex matching"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--patterns", type=int, default=10000)
+        parser.add_argument("--messages", type=int, default=2000)
+        parser.add_argument("--regex-messages", type=int, default=50,
+                            help="Messages for the per-pattern regex loop, it is orders of magnitude slower")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--output", help="Write the report as JSON to this file")
+
+    def handle(self, *args, **options):
+        if options["patterns"] <= 0 or options["messages"] <= 0:
+            raise CommandError("--patterns and --messages must be positive")
+        rng = random.Random(options["seed"])
+        terms = sorted({self.word(rng, 4, 10) for _ in range(options["patterns"])})
+        vocabulary = [self.word(rng, 2, 8) for _ in range(2000)]
+        messages = []
+        for i in range(options["messages"]):
+            words = rng.choices(vocabulary, k=rng.randint(3, 25))
+            # One message in ten carries a filtered term
+            if i % 10 == 0:
+                words.insert(rng.randrange(len(words) + 1), rng.choice(terms))
+            messages.append(" ".join(words))
+
+        started = time.perf_counter()
+        matcher = Matcher((term, "mask", False) for term in terms)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        report = {
+            "patterns": len(terms),
+            "messages": len(messages),
+            "automaton_states": len(matcher.goto),
+            "build_ms": round(build_ms, 1),
+            "aho_corasick": self.measure(messages, lambda text: apply(matcher, text)),
+        }
+
+        compiled = [re.compile(rf"\b{re.escape(term)}\b", re.IGNORECASE) for term in terms]
+        report["regex_per_pattern"] = self.measure(
+            messages[:options["regex_messages"]], lambda text: [m for p in compiled for m in p.finditer(text)]
+        )
+        alternation = re.compile(r"\b(?:" + "|".join(map(re.escape, terms)) + r")\b", re.IGNORECASE)
+        report["regex_alternation"] = self.measure(messages, lambda text: list(alternation.finditer(text)))
+
+        output = json.dumps(report, indent=2)
+        self.stdout.write(output)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+
+    def word(self, rng, shortest, longest):
+        return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(shortest, longest)))
+
+    def measure(self, messages, scan):
+        timings = []
+        for text in messages:
+            started = time.perf_counter()
+            scan(text)
+            timings.append((time.perf_counter() - started) * 1_000_000)
+        timings.sort()
+        return {
+            "messages": len(messages),
+            "p50_us": round(statistics.median(timings), 1),
+            "p99_us": round(timings[max(0, int(len(timings) * 0.99) - 1)], 1),
+            "mean_us": round(statistics.fmean(timings), 1),
+        }
@@ -0,0 +1,39 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from a_rtchat.purge import BATCH_PAUSE, BATCH_SIZE, claim_job, requeue_stale, run_job
+
+
+class Command(BaseCommand):
+    help = "Purge soft-deleted rooms and accounts in batches, from the PurgeJob queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Exit when the queue is empty")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+        parser.add_argument("--pause", type=float, default=BATCH_PAUSE, help="Seconds to sleep between batches")
+        parser.add_argument("--poll", type=float, default=5.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument("--stale-after", type=int, default=10,
+                            help="Minutes without a finished batch after which a running job is considered abandoned")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] <= 0:
+            raise CommandError("--batch-size must be positive")
+        stale_after = timedelta(minutes=options["stale_after"])
+
+        while True:
+            requeued = requeue_stale(stale_after)
+            if requeued:
+                self.stdout.write(f"Requeued {requeued} abandoned jobs")
+            job = claim_job()
+            if job is None:
+                if options["once"]:
+                    return
+                time.sleep(options["poll"])
+                continue
+            self.stdout.write(f"Purging {job.kind} {job.label or job.target_id} (attempt {job.attempts})")
+            started = time.monotonic()
+            job = run_job(job, options["batch_size"], options["pause"])
+            self.stdout.write(
+                f"{job.kind} {job.label or job.target_id}: {job.status}, "
+                f"{job.deleted}/{job.total} messages in {time.monotonic() - started:.1f}s"
+            )
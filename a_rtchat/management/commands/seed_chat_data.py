@@ -0,0 +1,145 @@
+import random
+import time
+from collections import Counter
+from datetime import timedelta
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from a_rtchat.importer import create_messages
+from a_rtchat.models import ChatGroup, GroupMessage, RoomReadState
+from a_users.models import Profile
+
+
+class Command(BaseCommand):
+    help = "Generate a synthetic chat dataset: users, rooms with power-law activity, messages and read state"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--rooms", type=int, default=1000, help="Group chats")
+        parser.add_argument("--private", type=int, default=2000, help="Private chats between two users")
+        parser.add_argument("--messages", type=int, default=100000)
+        parser.add_argument("--alpha", type=float, default=1.1,
+                            help="Zipf exponent of messages per room, higher puts more traffic in the busiest rooms")
+        parser.add_argument("--max-members", type=int, default=50, help="Largest group chat")
+        parser.add_argument("--days", type=int, default=90, help="Span of the message timestamps")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=42, help="Random seed, the same seed gives the same dataset")
+        parser.add_argument("--prefix", default="seed", help="Prefix of the generated usernames and room names")
+        parser.add_argument("--cleanup", action="store_true", help="Delete the data generated with --prefix and exit")
+
+    def handle(self, *args, **options):
+        prefix = options["prefix"]
+        if options["cleanup"]:
+            ChatGroup.all_objects.filter(group_name__startswith=f"{prefix}-").delete()
+            User.objects.filter(username__startswith=f"{prefix}_").delete()
+            self.stdout.write(f"Removed the {prefix} dataset")
+            return
+        for name in ("users", "messages", "batch_size", "max_members", "days"):
+            if options[name] <= 0:
+                raise CommandError(f"--{name.replace('_', '-')} must be positive")
+        if options["users"] < 2:
+            raise CommandError("--users must be at least 2")
+        if User.objects.filter(username__startswith=f"{prefix}_").exists():
+            raise CommandError(f"A {prefix} dataset exists, remove it with --cleanup or pick another --prefix")
+
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        started = time.monotonic()
+
+        users = self.create_users(prefix, options["users"])
+        rooms = self.create_rooms(prefix, users, options["rooms"], options["private"], options["max_members"])
+        self.stdout.write(f"{len(users)} users, {len(rooms)} rooms ({time.monotonic() - started:.1f}s)")
+
+        written, receipts = self.create_messages(rooms, options["messages"], options["alpha"], options["days"])
+        for group, _ in rooms:
+            group.refresh_activity(recount=True)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{written} messages and {receipts} receipts in {elapsed:.1f}s ({(written + receipts) / elapsed:.0f} rows/s)"
+        ))
+
+    def create_users(self, prefix, count):
+        # bulk_create skips the signals: usernames are already lowercase and profiles are made here
+        password = make_password(None)
+        User.objects.bulk_create(
+            [User(username=f"{prefix}_user_{i}", password=password) for i in range(count)],
+            batch_size=self.batch_size,
+        )
+        ids = list(User.objects.filter(username__startswith=f"{prefix}_user_").order_by("id").values_list("id", flat=True))
+        Profile.objects.bulk_create(
+            [Profile(user_id=user_id, displayname=f"User {i}") for i, user_id in enumerate(ids)],
+            batch_size=self.batch_size,
+        )
+        return ids
+
+    def create_rooms(self, prefix, users, group_count, private_count, max_members):
+        """[(group, member ids)], group chats first, in an order unrelated to their activity"""
+        specs = []
+        for i in range(group_count):
+            # Room sizes follow a power law too: mostly small rooms, a few large ones
+            size = min(max_members, len(users), 2 + int(self.rng.paretovariate(1.2)) - 1)
+            members = self.rng.sample(users, max(2, size))
+            specs.append((ChatGroup(group_name=f"{prefix}-room-{i}", groupchat_name=f"Room {i}", admin_id=members[0]),
+                          members))
+        for i in range(private_count):
+            specs.append((ChatGroup(group_name=f"{prefix}-dm-{i}", is_private=True), self.rng.sample(users, 2)))
+        ChatGroup.objects.bulk_create([group for group, _ in specs], batch_size=self.batch_size)
+
+        ids = dict(ChatGroup.objects.filter(group_name__startswith=f"{prefix}-").values_list("group_name", "id"))
+        for group, _ in specs:
+            group.pk = ids[group.group_name]
+        Membership = ChatGroup.members.through
+        Membership.objects.bulk_create(
+            [Membership(chatgroup_id=group.pk, user_id=user_id) for group, members in specs for user_id in members],
+            batch_size=self.batch_size,
+        )
+        self.rng.shuffle(specs)
+        return specs
+
+    def create_messages(self, rooms, total, alpha, days):
+        # Messages per room follow Zipf's law over the (shuffled) room order
+        weights = [1 / (rank + 1) ** alpha for rank in range(len(rooms))]
+        assignment = self.rng.choices(range(len(rooms)), weights=weights, k=total)
+        counts = Counter(assignment)
+
+        # Each member has read a room up to some point, most of them nearly to the end
+        read_upto = {}
+        states = []
+        for index, (group, members) in enumerate(rooms):
+            count = counts.get(index, 0)
+            cutoffs = {user_id: int(count * self.rng.random() ** 0.25) for user_id in members}
+            read_upto[index] = cutoffs
+            states.extend(RoomReadState(user_id=user_id, group_id=group.pk, read_count=cutoff)
+                          for user_id, cutoff in cutoffs.items())
+        RoomReadState.objects.bulk_create(states, batch_size=self.batch_size)
+
+        start = timezone.now() - timedelta(days=days)
+        step = timedelta(days=days) / total
+        position = Counter()
+        Seen = GroupMessage.seen_by.through
+        written = receipts = 0
+        for offset in range(0, total, self.batch_size):
+            messages = []
+            seen = []
+            for n in range(offset, min(offset + self.batch_size, total)):
+                index = assignment[n]
+                group, members = rooms[index]
+                messages.append(GroupMessage(
+                    group_id=group.pk,
+                    author_id=self.rng.choice(members),
+                    body=f"message {position[index]} in {group.group_name}",
+                    created=start + step * n,
+                ))
+                seen.append([user_id for user_id, cutoff in read_upto[index].items() if cutoff > position[index]])
+                position[index] += 1
+            with transaction.atomic():
+                create_messages(messages)
+                rows = [Seen(groupmessage_id=message.pk, user_id=user_id)
+                        for message, user_ids in zip(messages, seen) for user_id in user_ids]
+                Seen.objects.bulk_create(rows, batch_size=self.batch_size)
+            written += len(messages)
+            receipts += len(rows)
+            self.stdout.write(f"{written}/{total} messages")
+        return written, receipts
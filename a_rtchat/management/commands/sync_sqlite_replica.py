@@ -0,0 +1,28 @@
+import sqlite3
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = "Copy the SQLite primary onto the SQLite file standing in for a read replica (SQLITE_REPLICA=True)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default="replica", help="Alias of the stand-in replica")
+
+    def handle(self, *args, **options):
+        alias = options["database"]
+        if alias == DEFAULT_DB_ALIAS or alias not in connections.databases:
+            raise CommandError(f"No {alias} database, set SQLITE_REPLICA=True in development")
+        for name in (DEFAULT_DB_ALIAS, alias):
+            if connections[name].vendor != "sqlite":
+                raise CommandError("Only a SQLite stand-in can be synced, real replicas replicate")
+        # The copy replaces the file under any open connection
+        connections[alias].close()
+        source = sqlite3.connect(connections.databases[DEFAULT_DB_ALIAS]["NAME"])
+        target = sqlite3.connect(connections.databases[alias]["NAME"])
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        self.stdout.write(self.style.SUCCESS(f"Copied {DEFAULT_DB_ALIAS} onto {alias}"))
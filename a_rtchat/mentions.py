@@ -0,0 +1,171 @@
+"""
+@mentions: parsing at write time and autocomplete.
+
+Mentions are parsed once when a message is stored and written to the
+Mention table, so a user's inbox and badge are index reads rather than
+scans over message bodies. Mentioned users get a "mention.notify" event
+on their personal group, which every multiplexed socket of theirs joins.
+
+Autocomplete uses an in-memory prefix trie per recently used room, keyed
+by lowercase username and display name. A membership change bumps the
+room's version in the cache and a profile change bumps a global one; a
+trie built against older versions is rebuilt on its next lookup.
+"""
+import re
+import threading
+from collections import OrderedDict
+from django.core.cache import cache
+
+MAX_ROOMS = 500
+SUGGESTION_LIMIT = 8
+# Mentions stored per message, a pasted member list shouldn't fan out further
+MAX_MENTIONS = 20
+
+MENTION_RE = re.compile(r'(?<![\w@])@([\w.\-]{1,150})')
+
+GLOBAL_VERSION_KEY = 'chat:members:version'
+
+
+def _room_version_key(group_id):
+    return f'chat:members:version:{group_id}'
+
+
+class PrefixTrie:
+    def __init__(self):
+        self.root = {}
+
+    def insert(self, key, value):
+        node = self.root
+        for char in key:
+            node = node.setdefault(char, {})
+        node.setdefault(None, []).append(value)
+
+    def search(self, prefix, limit):
+        """Values under prefix, shortest keys first, without duplicates"""
+        node = self.root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+        found = []
+        level = [node]
+        while level and len(found) < limit:
+            following = []
+            for current in level:
+                for value in current.get(None, ()):
+                    if value not in found:
+                        found.append(value)
+                following.extend(child for char, child in current.items() if char is not None)
+            level = following
+        return found[:limit]
+
+
+class RoomIndex:
+    def __init__(self, version, members):
+        self.version = version
+        self.members = {}
+        self.trie = PrefixTrie()
+        for user_id, username, displayname in members:
+            self.members[user_id] = (username, displayname or username)
+            self.trie.insert(username.lower(), user_id)
+            if displayname:
+                self.trie.insert(displayname.lower(), user_id)
+
+    def suggest(self, prefix, limit=SUGGESTION_LIMIT, exclude=None):
+        ids = self.trie.search(prefix.lower(), limit + 1)
+        return [
+            {'id': user_id, 'username': self.members[user_id][0], 'name': self.members[user_id][1]}
+            for user_id in ids if user_id != exclude
+        ][:limit]
+
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+
+def _versions(group_id):
+    values = cache.get_many([GLOBAL_VERSION_KEY, _room_version_key(group_id)])
+    return values.get(GLOBAL_VERSION_KEY, 0), values.get(_room_version_key(group_id), 0)
+
+
+def room_index(chat_group):
+    version = _versions(chat_group.id)
+    with _lock:
+        index = _indexes.get(chat_group.id)
+        if index is not None and index.version == version:
+            _indexes.move_to_end(chat_group.id)
+            return index
+    members = chat_group.members.filter(is_active=True).values_list('id', 'username', 'profile__displayname')
+    index = RoomIndex(version, members)
+    with _lock:
+        _indexes[chat_group.id] = index
+        _indexes.move_to_end(chat_group.id)
+        while len(_indexes) > MAX_ROOMS:
+            _indexes.popitem(last=False)
+    return index
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def invalidate_room(group_id):
+    _bump(_room_version_key(group_id))
+
+
+def invalidate_all():
+    """Names changed, every room holding the user is stale"""
+    _bump(GLOBAL_VERSION_KEY)
+
+
+def user_group(user_id):
+    """Channel layer group of all sockets of one user"""
+    return f'user.{user_id}'
+
+
+def parse_mentions(body):
+    """Usernames mentioned in a body, in order and without duplicates"""
+    names = []
+    for name in MENTION_RE.findall(body or ''):
+        # Sentence punctuation right after a name isn't part of it
+        name = name.rstrip('.-')
+        if name and name not in names:
+            names.append(name)
+    return names[:MAX_MENTIONS]
+
+
+def record_mentions(message):
+    """Store the mentions of a saved message, returns the mentioned user ids"""
+    from .models import Mention
+    names = parse_mentions(message.body)
+    if not names:
+        return []
+    user_ids = list(
+        message.group.members.filter(username__in=names).exclude(pk=message.author_id).values_list('pk', flat=True)
+    )
+    Mention.objects.bulk_create(
+        [Mention(user_id=user_id, message=message, author_id=message.author_id, group_id=message.group_id,
+                 created=message.created)
+         for user_id in user_ids],
+        ignore_conflicts=True,
+    )
+    return user_ids
+
+
+def mention_event(message):
+    return {
+        "type": "mention.notify",
+        "room": message.group.group_name,
+        "message_id": message.id,
+        "author": message.author.username,
+        "preview": (message.body or '')[:100],
+    }
+
+
+async def notify_mentions(channel_layer, message, user_ids):
+    event = mention_event(message)
+    for user_id in user_ids:
+        await channel_layer.group_send(user_group(user_id), event)
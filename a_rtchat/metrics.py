@@ -0,0 +1,300 @@
+"""
+Lightweight in-process metrics with Prometheus text exposition.
+
+Every worker process keeps its own registry; scrape each worker (or put
+them behind a per-process port) the same way as any multi-process
+Prometheus target.
+"""
+import asyncio
+import functools
+import threading
+import time
+from bisect import bisect_left
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, key, extra=None):
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{self._format_labels(key)} {value}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            value = self._values.get(key, 0) - amount
+            if value or not self.labelnames:
+                self._values[key] = value
+            else:
+                # Don't keep a series around for every room that ever existed
+                self._values.pop(key, None)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += 1
+            state[2] += value
+
+    def time(self, **labels):
+        return Timer(self, labels)
+
+    def count(self, **labels):
+        """How many values were observed with these labels"""
+        with self._lock:
+            state = self._values.get(self._key(labels))
+        return state[1] if state else 0
+
+    def _render_sample(self, key, value):
+        counts, total, total_sum = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{self._format_labels(key, ('le', repr(bound)))} {cumulative}")
+        lines.append(f"{self.name}_bucket{self._format_labels(key, ('le', '+Inf'))} {total}")
+        lines.append(f"{self.name}_count{self._format_labels(key)} {total}")
+        lines.append(f"{self.name}_sum{self._format_labels(key)} {total_sum}")
+        return lines
+
+
+class Timer:
+    """Times a block or a (sync or async) function into a histogram"""
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+    def __call__(self, func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with Timer(self.histogram, self.labels):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Timer(self.histogram, self.labels):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as {metric.kind}")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+counter = registry.counter
+gauge = registry.gauge
+histogram = registry.histogram
+
+
+# Chat hot path
+OPERATION_SECONDS = histogram(
+    "chat_operation_seconds", "Time spent in chat consumer operations", ["operation"]
+)
+OPERATION_ERRORS = counter(
+    "chat_operation_errors_total", "Chat consumer operations that raised", ["operation"]
+)
+MESSAGES_CREATED = counter(
+    "chat_messages_created_total", "Messages stored, by the path that created them", ["source"]
+)
+FRAMES_RECEIVED = counter(
+    "chat_ws_frames_received_total", "Frames received from clients, by frame type", ["type"]
+)
+FRAMES_SENT = counter(
+    "chat_ws_frames_sent_total", "Frames sent to clients, by frame type", ["type"]
+)
+SOCKETS_OPEN = gauge(
+    "chat_ws_connections", "Open WebSocket connections, by endpoint", ["endpoint"]
+)
+# Not labeled by room: the label set would be unbounded and expose room
+# names. Per-room presence is in the admin's room list
+ROOM_SOCKETS = gauge(
+    "chat_room_sockets", "Room subscriptions held by sockets in this process"
+)
+ACTIVE_ROOMS = gauge(
+    "chat_active_rooms", "Rooms with at least one subscribed socket in this process"
+)
+TRACKED_SOCKETS = gauge(
+    "chat_ws_tracked_connections", "Admitted sockets this worker holds, as of the last heartbeat sweep"
+)
+IDLE_SOCKETS = gauge(
+    "chat_ws_idle_connections", "Sockets silent for longer than the heartbeat interval at the last sweep"
+)
+REAPED_SOCKETS = counter(
+    "chat_ws_reaped_total", "Sockets closed for missing the heartbeat timeout"
+)
+PROCESS_MEMORY = gauge(
+    "process_resident_memory_bytes", "Resident memory of this worker, as of the last heartbeat sweep"
+)
+ONLINE_USERS_TRACKED = gauge(
+    "chat_online_users", "Users in this worker's presence map"
+)
+CONNECTIONS_REFUSED = counter(
+    "chat_ws_refused_total", "Sockets closed with a retry delay, by reason (rate, draining, drain)", ["reason"]
+)
+RATE_LIMITED = counter(
+    "chat_rate_limited_total", "Message sends rejected by flood control, by room kind and path", ["kind", "source"]
+)
+COMPRESSED_FRAMES = counter(
+    "chat_ws_compressed_frames_total", "Frames over the compression threshold, by result (compressed, skipped)",
+    ["endpoint", "result"]
+)
+FRAME_BYTES = counter(
+    "chat_ws_compressed_bytes_total", "Size of compressed frames before and after deflate", ["endpoint", "stage"]
+)
+COMPRESSION_SECONDS = histogram(
+    "chat_ws_compression_seconds", "Time spent deflating one frame", ["endpoint"],
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01),
+)
+SSE_STREAMS = gauge(
+    "chat_sse_streams", "Open Server-Sent Events room streams"
+)
+SSE_EVENTS_SENT = counter(
+    "chat_sse_events_sent_total", "Events sent on room streams, by frame type", ["type"]
+)
+HANDSHAKE_SECONDS = histogram(
+    "chat_ws_handshake_seconds", "Session user resolution on WebSocket connect, by where the user came from", ["source"]
+)
+
+# HTTP
+REQUEST_SECONDS = histogram(
+    "http_request_duration_seconds", "Request latency by view", ["view", "method"]
+)
+REQUEST_QUERIES = histogram(
+    "http_request_db_queries", "Database queries per request by view", ["view"],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+
+
+def instrument(operation):
+    """Decorator timing an operation into chat_operation_seconds and counting failures"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    OPERATION_ERRORS.inc(operation=operation)
+                    raise
+                finally:
+                    OPERATION_SECONDS.observe(time.perf_counter() - started, operation=operation)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                OPERATION_ERRORS.inc(operation=operation)
+                raise
+            finally:
+                OPERATION_SECONDS.observe(time.perf_counter() - started, operation=operation)
+        return wrapper
+    return decorator
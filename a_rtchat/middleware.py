@@ -0,0 +1,48 @@
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+from .metrics import REQUEST_QUERIES, REQUEST_SECONDS
+from .replicas import pin_primary
+
+
+class QueryCountMiddleware:
+    """Records latency and the number of DB queries of every request, per view"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = [0]
+
+        def count_query(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        # Queries on the primary and on the replicas
+        with ExitStack() as stack:
+            for conn in connections.all(initialized_only=False):
+                stack.enter_context(conn.execute_wrapper(count_query))
+            response = self.get_response(request)
+
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match else "unresolved"
+        REQUEST_SECONDS.observe(time.perf_counter() - started, view=view, method=request.method)
+        REQUEST_QUERIES.observe(queries[0], view=view)
+        if settings.DEBUG:
+            response["X-DB-Queries"] = str(queries[0])
+        return response
+
+
+class PrimaryPinMiddleware:
+    """After a successful write request the user reads from the primary for a while"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            pin_primary(request.user)
+        return response
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.4 on 2026-10-19 09:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('a_rtchat', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('first_message_id', models.BigIntegerField()),
+                ('last_message_id', models.BigIntegerField()),
+                ('first_created', models.DateTimeField()),
+                ('last_created', models.DateTimeField()),
+                ('message_count', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('archived', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-last_message_id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='chatgroup',
+            name='retention_days',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='groupmessage',
+            index=models.Index(fields=['group', '-created'], name='groupmessage_group_created'),
+        ),
+        migrations.AddField(
+            model_name='messagearchive',
+            name='group',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archives', to='a_rtchat.chatgroup'),
+        ),
+        migrations.AddIndex(
+            model_name='messagearchive',
+            index=models.Index(fields=['group', '-last_message_id'], name='archive_group_last_id'),
+        ),
+    ]
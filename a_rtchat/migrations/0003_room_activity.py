@@ -0,0 +1,70 @@
+# Generated by Django 5.2.4 on 2026-10-19 09:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_activity(apps, schema_editor):
+    ChatGroup = apps.get_model('a_rtchat', 'ChatGroup')
+    GroupMessage = apps.get_model('a_rtchat', 'GroupMessage')
+    for group in ChatGroup.objects.all().iterator():
+        messages = GroupMessage.objects.filter(group=group)
+        last = messages.order_by('-id').only('id', 'created').first()
+        group.message_count = messages.count()
+        group.last_message = last
+        group.last_activity = last.created if last else None
+        group.save(update_fields=['message_count', 'last_message', 'last_activity'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('a_rtchat', '0002_message_archive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomReadState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('read_count', models.PositiveIntegerField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='chatgroup',
+            name='last_activity',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatgroup',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='a_rtchat.groupmessage'),
+        ),
+        migrations.AddField(
+            model_name='chatgroup',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='chatgroup',
+            index=models.Index(fields=['-last_activity'], name='chatgroup_last_activity'),
+        ),
+        migrations.AddField(
+            model_name='roomreadstate',
+            name='group',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to='a_rtchat.chatgroup'),
+        ),
+        migrations.AddField(
+            model_name='roomreadstate',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='room_read_states', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='roomreadstate',
+            constraint=models.UniqueConstraint(fields=('user', 'group'), name='roomreadstate_user_group'),
+        ),
+        migrations.RunPython(backfill_activity, migrations.RunPython.noop),
+    ]
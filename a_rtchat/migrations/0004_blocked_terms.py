@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-19 09:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('a_rtchat', '0003_room_activity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlockedTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=200, unique=True)),
+                ('action', models.CharField(choices=[('mask', 'Mask'), ('block', 'Block message')], default='mask', max_length=10)),
+                ('substring', models.BooleanField(default=False)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['term'],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-19 09:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('a_rtchat', '0004_blocked_terms'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Mention',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField()),
+                ('read', models.BooleanField(default=False)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='a_rtchat.chatgroup')),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mentions', to='a_rtchat.groupmessage')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mentions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created'],
+                'indexes': [models.Index(fields=['user', '-created'], name='mention_user_created'), models.Index(condition=models.Q(('read', False)), fields=['user'], name='mention_user_unread')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'message'), name='mention_user_message')],
+            },
+        ),
+    ]
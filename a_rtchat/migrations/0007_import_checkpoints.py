@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-19 09:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('a_rtchat', '0006_purge_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=500, unique=True)),
+                ('offset', models.BigIntegerField(default=0)),
+                ('messages', models.PositiveIntegerField(default=0)),
+                ('done', models.BooleanField(default=False)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('group', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='a_rtchat.chatgroup')),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-19 09:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('a_rtchat', '0008_message_edits_reactions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='groupmessage',
+            name='last_reply',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='a_rtchat.groupmessage'),
+        ),
+        migrations.AddField(
+            model_name='groupmessage',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='groupmessage',
+            name='reply_to',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='replies', to='a_rtchat.groupmessage'),
+        ),
+        migrations.AddIndex(
+            model_name='groupmessage',
+            index=models.Index(fields=['reply_to', 'id'], name='groupmessage_reply_to_id'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-19 10:03
+
+from django.db import migrations, models
+
+
+def backfill_heartbeat(apps, schema_editor):
+    # Jobs running now are judged by when they started, as before
+    PurgeJob = apps.get_model('a_rtchat', 'PurgeJob')
+    PurgeJob.objects.filter(heartbeat__isnull=True).update(heartbeat=models.F('started'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('a_rtchat', '0009_message_threads'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purgejob',
+            name='heartbeat',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='purgejob',
+            name='retry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_heartbeat, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-19 10:04
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('a_rtchat', '0010_purge_job_heartbeat'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='mention',
+            name='mention_user_created',
+        ),
+        migrations.AddIndex(
+            model_name='mention',
+            index=models.Index(fields=['user', '-id'], name='mention_user_id'),
+        ),
+    ]
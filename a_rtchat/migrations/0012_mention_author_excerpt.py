@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-19 10:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_author(apps, schema_editor):
+    Mention = apps.get_model('a_rtchat', 'Mention')
+    GroupMessage = apps.get_model('a_rtchat', 'GroupMessage')
+    authors = GroupMessage.objects.filter(pk=models.OuterRef('message_id')).values('author_id')[:1]
+    Mention.objects.filter(author__isnull=True).update(author_id=models.Subquery(authors))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('a_rtchat', '0011_mention_user_id_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mention',
+            name='author',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='mention',
+            name='excerpt',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AlterField(
+            model_name='mention',
+            name='message',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='mentions', to='a_rtchat.groupmessage'),
+        ),
+        migrations.RunPython(backfill_author, migrations.RunPython.noop),
+    ]
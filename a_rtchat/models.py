@@ -11,6 +11,13 @@ import re
 import mimetypes
 
 
+class ChatGroupManager(models.Manager):
+    """Hides rooms deleted by their admin while their purge job runs"""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class ChatGroup(models.Model):
     group_name = models.CharField(max_length=128, unique=True, blank=True)
     groupchat_name = models.CharField(max_length=128, null=True, blank=True)
@@ -32,6 +39,25 @@ class ChatGroup(models.Model):
         blank=True
     )
     is_private = models.BooleanField(default=False)
+    # Days of history kept in GroupMessage before archive_messages moves it
+    # to MessageArchive, None falls back to CHAT_DEFAULT_RETENTION_DAYS
+    retention_days = models.PositiveIntegerField(null=True, blank=True)
+    # Activity summary kept up to date by the GroupMessage signals.
+    # message_count counts every message ever posted, deletes don't lower it
+    last_message = models.ForeignKey(
+        'GroupMessage',
+        related_name='+',
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL
+    )
+    last_activity = models.DateTimeField(null=True, blank=True)
+    message_count = models.PositiveIntegerField(default=0)
+    # Set when the room is deleted, a PurgeJob then removes it in batches
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = ChatGroupManager()
+    all_objects = models.Manager()
 
     def __str__(self):
         return self.group_name
@@ -41,6 +67,36 @@ class ChatGroup(models.Model):
             self.group_name = shortuuid.uuid()
         super().save(*args, **kwargs)
 
+    @staticmethod
+    def record_message(message):
+        """Atomically count a new message and move last_message forward"""
+        newer = models.Q(last_message_id__gt=message.id)
+        ChatGroup.objects.filter(pk=message.group_id).update(
+            message_count=models.F('message_count') + 1,
+            last_message_id=models.Case(
+                models.When(newer, then=models.F('last_message_id')), default=models.Value(message.id)
+            ),
+            last_activity=models.Case(
+                models.When(newer, then=models.F('last_activity')), default=models.Value(message.created)
+            ),
+        )
+
+    def refresh_activity(self, recount=False):
+        """Recompute last_message (and the count) from GroupMessage, e.g. after bulk_create"""
+        last = self.chat_messages.order_by('-id').only('id', 'created').first()
+        self.last_message = last
+        self.last_activity = last.created if last else None
+        fields = ['last_message', 'last_activity']
+        if recount:
+            self.message_count = self.chat_messages.count()
+            fields.append('message_count')
+        self.save(update_fields=fields)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-last_activity'], name='chatgroup_last_activity'),
+        ]
+
 
 class GroupMessage(models.Model):
     group = models.ForeignKey(ChatGroup, related_name='chat_messages', on_delete=models.CASCADE)
@@ -54,6 +110,21 @@ class GroupMessage(models.Model):
     seen_by = models.ManyToManyField(
         settings.AUTH_USER_MODEL, related_name='seen_messages', blank=True
     )
+    # Part of the cache key of the rendered message, bumped by edits, deletes and reactions
+    version = models.PositiveIntegerField(default=1)
+    edited = models.DateTimeField(null=True, blank=True)
+    # Soft delete: the row stays, the body is no longer shown
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    # Reaction counts by emoji, {"👍": 3}, kept in step with the Reaction rows
+    reactions = models.JSONField(default=dict, blank=True)
+    # Replies form one level of thread under a timeline message and are left
+    # out of the timeline, which shows the parent's reply_count and last_reply.
+    # Indexed together with id for thread pages, see groupmessage_reply_to_id
+    reply_to = models.ForeignKey(
+        'self', related_name='replies', blank=True, null=True, db_index=False, on_delete=models.SET_NULL
+    )
+    reply_count = models.PositiveIntegerField(default=0)
+    last_reply = models.ForeignKey('self', related_name='+', blank=True, null=True, on_delete=models.SET_NULL)
 
     @property
     def filename(self):
@@ -82,8 +153,25 @@ class GroupMessage(models.Model):
             return
         super().save(*args, **kwargs)
 
+    @staticmethod
+    def record_reply(reply):
+        """Atomically count a new reply on its parent and move last_reply forward"""
+        GroupMessage.objects.filter(pk=reply.reply_to_id).update(
+            reply_count=models.F('reply_count') + 1,
+            last_reply_id=models.Case(
+                models.When(last_reply_id__gt=reply.id, then=models.F('last_reply_id')),
+                default=models.Value(reply.id),
+            ),
+            # The parent's cached renders show the count and the preview
+            version=models.F('version') + 1,
+        )
+
     class Meta:
         ordering = ['-created']
+        indexes = [
+            models.Index(fields=['group', '-created'], name='groupmessage_group_created'),
+            models.Index(fields=['reply_to', 'id'], name='groupmessage_reply_to_id'),
+        ]
 
     # -------------------------------
     # Fixed file type detection
@@ -143,3 +231,183 @@ class GroupMessage(models.Model):
         elif any(url.endswith(ext) for ext in [".mp3", ".wav", ".ogg"]):
             return "audio"
         return "file"
+
+
+class Reaction(models.Model):
+    """One user's emoji on a message, GroupMessage.reactions holds the counts"""
+    EMOJI = ['👍', '❤️', '😂', '😮', '😢', '🎉']
+
+    message = models.ForeignKey(GroupMessage, related_name='reaction_set', on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='reactions', on_delete=models.CASCADE)
+    emoji = models.CharField(max_length=16)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.user.username} : {self.emoji}'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['message', 'user', 'emoji'], name='reaction_message_user_emoji'),
+        ]
+
+
+class RoomReadState(models.Model):
+    """How many of a room's messages a user had when they last read it"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='room_read_states', on_delete=models.CASCADE)
+    group = models.ForeignKey(ChatGroup, related_name='read_states', on_delete=models.CASCADE)
+    read_count = models.PositiveIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.user.username} : {self.group.group_name}'
+
+    @staticmethod
+    def mark_read(user, group):
+        count = ChatGroup.objects.values_list('message_count', flat=True).get(pk=group.pk)
+        RoomReadState.objects.update_or_create(user=user, group=group, defaults={'read_count': count})
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'group'], name='roomreadstate_user_group'),
+        ]
+
+
+class Mention(models.Model):
+    """A user @mentioned in a message, written once when the message is stored"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='mentions', on_delete=models.CASCADE)
+    # Null once the message is archived, the inbox then shows the excerpt kept here
+    message = models.ForeignKey(GroupMessage, related_name='mentions', null=True, on_delete=models.SET_NULL)
+    author = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', null=True, on_delete=models.CASCADE)
+    excerpt = models.CharField(max_length=200, blank=True)
+    group = models.ForeignKey(ChatGroup, related_name='+', on_delete=models.CASCADE)
+    created = models.DateTimeField()
+    read = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f'@{self.user.username} in {self.group.group_name}'
+
+    class Meta:
+        ordering = ['-created']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'message'], name='mention_user_message'),
+        ]
+        indexes = [
+            # The inbox pages back by id
+            models.Index(fields=['user', '-id'], name='mention_user_id'),
+            models.Index(fields=['user'], condition=models.Q(read=False), name='mention_user_unread'),
+        ]
+
+
+class MessageArchive(models.Model):
+    """
+    A compressed chunk of archived history: gzip'd JSONL of up to
+    CHAT_ARCHIVE_CHUNK_SIZE messages of one group, all from the same month.
+    """
+    group = models.ForeignKey(ChatGroup, related_name='archives', on_delete=models.CASCADE)
+    month = models.DateField()
+    first_message_id = models.BigIntegerField()
+    last_message_id = models.BigIntegerField()
+    first_created = models.DateTimeField()
+    last_created = models.DateTimeField()
+    message_count = models.PositiveIntegerField()
+    data = models.BinaryField()
+    archived = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.group.group_name} {self.month:%Y-%m} #{self.first_message_id}-{self.last_message_id}'
+
+    class Meta:
+        ordering = ['-last_message_id']
+        indexes = [
+            models.Index(fields=['group', '-last_message_id'], name='archive_group_last_id'),
+        ]
+
+
+class BlockedTerm(models.Model):
+    """A word or phrase the content filter masks or rejects in message bodies"""
+    MASK = 'mask'
+    BLOCK = 'block'
+    ACTION_CHOICES = [
+        (MASK, 'Mask'),
+        (BLOCK, 'Block message'),
+    ]
+    term = models.CharField(max_length=200, unique=True)
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES, default=MASK)
+    # Match inside longer words too, e.g. for link fragments like "bit.ly/"
+    substring = models.BooleanField(default=False)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.term
+
+    def save(self, *args, **kwargs):
+        self.term = self.term.strip().lower()
+        super().save(*args, **kwargs)
+
+    class Meta:
+        ordering = ['term']
+
+
+class PurgeJob(models.Model):
+    """Background deletion of a soft-deleted room or account, see a_rtchat.purge"""
+    ROOM = 'room'
+    USER = 'user'
+    KIND_CHOICES = [
+        (ROOM, 'Room'),
+        (USER, 'User'),
+    ]
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    target_id = models.BigIntegerField()
+    label = models.CharField(max_length=150, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    # Messages to delete when the job started, and deleted so far
+    total = models.PositiveIntegerField(default=0)
+    deleted = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    # Refreshed with every batch, a running job whose heartbeat stops was abandoned
+    heartbeat = models.DateTimeField(null=True, blank=True)
+    # A failed attempt isn't retried before this
+    retry_at = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.kind} {self.label or self.target_id} ({self.status})'
+
+    @property
+    def progress(self):
+        if not self.total:
+            return 100 if self.status == self.DONE else 0
+        return min(100, round(100 * self.deleted / self.total))
+
+    class Meta:
+        ordering = ['-created']
+        indexes = [
+            models.Index(fields=['status', 'created'], name='purgejob_status_created'),
+        ]
+
+
+class ImportCheckpoint(models.Model):
+    """How far import_chat_history got in one source file, saved with each batch"""
+    source = models.CharField(max_length=500, unique=True)
+    group = models.ForeignKey(ChatGroup, related_name='+', null=True, blank=True, on_delete=models.SET_NULL)
+    # Byte offset of the first line not imported yet
+    offset = models.BigIntegerField(default=0)
+    messages = models.PositiveIntegerField(default=0)
+    done = models.BooleanField(default=False)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.source} @ {self.offset}'
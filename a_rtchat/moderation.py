@@ -0,0 +1,189 @@
+"""
+Content filter for message bodies.
+
+Every BlockedTerm is compiled into one Aho-Corasick automaton, so a body
+is scanned in a single pass whatever the number of terms. Masked terms are
+replaced by asterisks, a blocked term rejects the whole message. With
+CHAT_BLOCK_LINKS on, URLs (LINK_PATTERN) reject it too.
+
+Saving or deleting a term bumps a version in the cache; each worker checks
+it at most every CHAT_MODERATION_RELOAD_INTERVAL seconds and swaps in a
+freshly built automaton, so a scan never sees a half-built one.
+"""
+import logging
+import re
+import threading
+import time
+from collections import deque, namedtuple
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+BLOCK_LINKS = getattr(settings, 'CHAT_BLOCK_LINKS', False)
+RELOAD_INTERVAL = getattr(settings, 'CHAT_MODERATION_RELOAD_INTERVAL', 5.0)
+# A scheme or "www." starting a word, followed by a host: "awww." or "shttp" aren't links
+LINK_PATTERN = re.compile(
+    r'(?<![\w.@/-])(?:https?://[^\s/?#<>]+|www\.[a-z0-9-]+(?:\.[a-z0-9-]+)*\.[a-z]{2,}\b)[^\s<>]*',
+    re.IGNORECASE,
+)
+
+VERSION_KEY = 'chat:moderation:version'
+
+Match = namedtuple('Match', 'start end term action')
+Verdict = namedtuple('Verdict', 'text matches blocked')
+
+
+class MessageBlocked(Exception):
+    def __init__(self, matches):
+        super().__init__("Message rejected by the content filter")
+        self.matches = matches
+
+
+def _fold(text):
+    """Lowercase without changing the length, so spans map back onto the text"""
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return ''.join(c if len(c.lower()) != 1 else c.lower() for c in text)
+
+
+class Matcher:
+    """Aho-Corasick automaton over (term, action, substring) patterns, plus LINK_PATTERN when block_links"""
+
+    def __init__(self, patterns, block_links=False):
+        self.block_links = block_links
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+        self.patterns = []
+        for term, action, substring in patterns:
+            term = _fold(term.strip())
+            if term:
+                self._add(term, len(self.patterns))
+                self.patterns.append((term, action, substring))
+        self._link()
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def _add(self, term, index):
+        node = 0
+        for char in term:
+            following = self.goto[node].get(char)
+            if following is None:
+                following = len(self.goto)
+                self.goto[node][char] = following
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(())
+            node = following
+        self.out[node] += (index,)
+
+    def _link(self):
+        """Breadth-first failure links, outputs merged along them"""
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, following in self.goto[node].items():
+                queue.append(following)
+                state = self.fail[node]
+                while state and char not in self.goto[state]:
+                    state = self.fail[state]
+                target = self.goto[state].get(char, 0)
+                self.fail[following] = target if target != following else 0
+                self.out[following] += self.out[self.fail[following]]
+
+    def find(self, text):
+        """All matches in text, word terms only where they stand on their own"""
+        folded = _fold(text)
+        goto, fail, out = self.goto, self.fail, self.out
+        matches = []
+        state = 0
+        for position, char in enumerate(folded):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in out[state]:
+                term, action, substring = self.patterns[index]
+                start = position - len(term) + 1
+                end = position + 1
+                if not substring and (
+                    (start > 0 and folded[start - 1].isalnum()) or (end < len(folded) and folded[end].isalnum())
+                ):
+                    continue
+                matches.append(Match(start, end, text[start:end], action))
+        if self.block_links:
+            matches += [Match(m.start(), m.end(), m.group(), 'block') for m in LINK_PATTERN.finditer(text)]
+        matches.sort()
+        return matches
+
+
+def apply(matcher, text):
+    matches = matcher.find(text)
+    if not matches:
+        return Verdict(text, matches, False)
+    if any(match.action == 'block' for match in matches):
+        return Verdict(text, matches, True)
+    chars = list(text)
+    for match in matches:
+        chars[match.start:match.end] = '*' * (match.end - match.start)
+    return Verdict(''.join(chars), matches, False)
+
+
+def build_matcher():
+    from .models import BlockedTerm
+    patterns = list(BlockedTerm.objects.values_list('term', 'action', 'substring'))
+    return Matcher(patterns, block_links=BLOCK_LINKS)
+
+
+class FilterState:
+    def __init__(self):
+        self.matcher = None
+        self.version = None
+        self.checked = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+        if self.matcher is not None and now - self.checked < RELOAD_INTERVAL:
+            return self.matcher
+        with self._lock:
+            if self.matcher is not None and now - self.checked < RELOAD_INTERVAL:
+                return self.matcher
+            version = cache.get(VERSION_KEY, 0)
+            if self.matcher is None or version != self.version:
+                started = time.perf_counter()
+                matcher = build_matcher()
+                # A single assignment: scans use either the old or the new automaton
+                self.matcher, self.version = matcher, version
+                logger.info(
+                    f"Content filter loaded {len(matcher)} terms in {(time.perf_counter() - started) * 1000:.1f}ms"
+                )
+            self.checked = now
+            return self.matcher
+
+
+_state = FilterState()
+
+
+def invalidate():
+    """Make every worker rebuild its matcher on its next check"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+    _state.checked = 0.0
+
+
+def moderate(text):
+    """Verdict for a message body; reads the term list, so call it from sync code"""
+    return apply(_state.get(), text)
+
+
+def clean_body(text):
+    """Body to store, masked where needed; raises MessageBlocked"""
+    verdict = moderate(text)
+    if verdict.blocked:
+        raise MessageBlocked(verdict.matches)
+    return verdict.text
@@ -0,0 +1,246 @@
+"""
+Soft delete now, purge later.
+
+Deleting a room or an account used to cascade through every GroupMessage
+and its seen_by/delivered_to rows inside the request. Now the request only
+hides the room (ChatGroup.deleted_at) or deactivates the user and queues a
+PurgeJob. The run_purge_worker command then deletes the rows in batches of
+CHAT_PURGE_BATCH_SIZE, each in its own short transaction, recording
+progress on the job as it goes. Deleting an account hides its messages
+and profile at once. The purge keeps the messages other people replied
+to as empty tombstones owned by a shared placeholder account, so their
+threads stay whole, and recounts the threads the user replied in.
+"""
+import logging
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .edits import refresh_reaction_counts
+from .models import ChatGroup, GroupMessage, Mention, MessageArchive, PurgeJob, Reaction, RoomReadState
+from .recent_cache import invalidate_group
+from .threads import refresh_reply_counts
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = getattr(settings, 'CHAT_PURGE_BATCH_SIZE', 500)
+# Pause between batches so the purge doesn't starve live traffic
+BATCH_PAUSE = getattr(settings, 'CHAT_PURGE_BATCH_PAUSE', 0.05)
+MAX_ATTEMPTS = 3
+# Seconds before the first retry of a failed job, doubled for each further attempt
+RETRY_BACKOFF = getattr(settings, 'CHAT_PURGE_RETRY_BACKOFF', 60)
+
+
+def delete_room(chat_group):
+    """Hide the room at once and queue the purge of its content"""
+    ChatGroup.all_objects.filter(pk=chat_group.pk).update(deleted_at=timezone.now())
+    invalidate_group(chat_group.pk)
+    return PurgeJob.objects.create(kind=PurgeJob.ROOM, target_id=chat_group.pk, label=chat_group.group_name)
+
+
+# Owns the tombstones of purged accounts, not a name anyone can sign up with
+TOMBSTONE_USERNAME = '[deleted]'
+
+
+def delete_account(user):
+    """
+    Deactivate the user at once (no login, no search results), show their
+    messages as deleted and their profile as a deleted account, and queue
+    the purge
+    """
+    user.is_active = False
+    user.save(update_fields=['is_active'])
+    messages = GroupMessage.objects.filter(author_id=user.pk)
+    group_ids = list(messages.values_list('group_id', flat=True).distinct())
+    messages.filter(deleted_at__isnull=True).update(deleted_at=timezone.now(), version=F('version') + 1)
+    # Thread previews showing one of the user's replies
+    GroupMessage.objects.filter(last_reply__author_id=user.pk).update(version=F('version') + 1)
+    Mention.objects.filter(author_id=user.pk).delete()
+    user.chat_groups.clear()
+    user.online_in_groups.clear()
+    # Profile.name and the avatars now read as a deleted account
+    if hasattr(user, 'profile'):
+        user.profile.bump_version()
+    for group_id in group_ids:
+        invalidate_group(group_id)
+    return PurgeJob.objects.create(kind=PurgeJob.USER, target_id=user.pk, label=user.username)
+
+
+def _delete_in_batches(job, queryset, batch_size, pause, count=False):
+    """Delete queryset's rows batch by batch, returns how many were deleted"""
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        with transaction.atomic():
+            queryset.model._base_manager.filter(pk__in=ids).delete()
+        deleted += len(ids)
+        progress = {'heartbeat': timezone.now()}
+        if count:
+            before = job.progress
+            job.deleted += len(ids)
+            progress['deleted'] = job.deleted
+        PurgeJob.objects.filter(pk=job.pk).update(**progress)
+        if count:
+            if job.progress // 10 != before // 10:
+                logger.info(f"Purging {job.kind} {job.label}: {job.deleted}/{job.total} messages ({job.progress}%)")
+        if pause:
+            time.sleep(pause)
+
+
+def _replied_to(user_id):
+    """user_id's messages with replies from other people, they stay as tombstones"""
+    replies = GroupMessage.objects.filter(reply_to__author_id=user_id).exclude(author_id=user_id)
+    return GroupMessage.objects.filter(pk__in=replies.values('reply_to_id'))
+
+
+def _tombstone_author():
+    user, created = get_user_model().objects.get_or_create(
+        username=TOMBSTONE_USERNAME, defaults={'is_active': False}
+    )
+    if created:
+        user.set_unusable_password()
+        user.save(update_fields=['password'])
+    return user
+
+
+def _delete_messages(job, messages, batch_size, pause):
+    # The through rows and reactions go first in their own batches, the
+    # message deletes then only touch one batch of them each
+    for through in (GroupMessage.seen_by.through, GroupMessage.delivered_to.through):
+        _delete_in_batches(job, through.objects.filter(groupmessage__in=messages), batch_size, pause)
+    _delete_in_batches(job, Reaction.objects.filter(message__in=messages), batch_size, pause)
+    # Archived messages leave their mentions behind, deleted ones don't
+    _delete_in_batches(job, Mention.objects.filter(message__in=messages), batch_size, pause)
+    _delete_in_batches(job, messages, batch_size, pause, count=True)
+
+
+def purge_room(job, batch_size=BATCH_SIZE, pause=BATCH_PAUSE):
+    chat_group = ChatGroup.all_objects.filter(pk=job.target_id).first()
+    if chat_group is None:
+        return
+    messages = GroupMessage.objects.filter(group_id=chat_group.pk)
+    _delete_messages(job, messages, batch_size, pause)
+    for queryset in (
+        Mention.objects.filter(group_id=chat_group.pk),
+        MessageArchive.objects.filter(group_id=chat_group.pk),
+        RoomReadState.objects.filter(group_id=chat_group.pk),
+        ChatGroup.members.through.objects.filter(chatgroup_id=chat_group.pk),
+        ChatGroup.users_online.through.objects.filter(chatgroup_id=chat_group.pk),
+    ):
+        _delete_in_batches(job, queryset, batch_size, pause)
+    chat_group.delete()
+    invalidate_group(chat_group.pk)
+
+
+def purge_user(job, batch_size=BATCH_SIZE, pause=BATCH_PAUSE):
+    user = get_user_model().objects.filter(pk=job.target_id).first()
+    if user is None:
+        return
+    messages = GroupMessage.objects.filter(author_id=user.pk)
+    group_ids = list(messages.values_list('group_id', flat=True).distinct())
+    # Threads the user replied in, under other people's messages
+    parent_ids = list(
+        messages.filter(reply_to__isnull=False).exclude(reply_to__author_id=user.pk)
+        .values_list('reply_to_id', flat=True).distinct()
+    )
+    # Emptied and handed to the placeholder account, the replies under them
+    # are other people's and stay where they are
+    tombstones = _replied_to(user.pk)
+    tombstone_ids = list(tombstones.values_list('id', flat=True))
+    if tombstone_ids:
+        tombstones = GroupMessage.objects.filter(pk__in=tombstone_ids)
+        for through in (GroupMessage.seen_by.through, GroupMessage.delivered_to.through):
+            _delete_in_batches(job, through.objects.filter(groupmessage__in=tombstones), batch_size, pause)
+        _delete_in_batches(job, Reaction.objects.filter(message__in=tombstones), batch_size, pause)
+        _delete_in_batches(job, Mention.objects.filter(message__in=tombstones), batch_size, pause)
+        tombstones.update(
+            author=_tombstone_author(), body=None, file=None, reactions={},
+            deleted_at=Coalesce('deleted_at', Value(timezone.now())), version=F('version') + 1,
+        )
+        job.deleted += len(tombstone_ids)
+        PurgeJob.objects.filter(pk=job.pk).update(deleted=job.deleted, heartbeat=timezone.now())
+    _delete_messages(job, messages, batch_size, pause)
+    # The user's own replies under the tombstones are gone too
+    refresh_reply_counts(parent_ids + tombstone_ids)
+    reactions = Reaction.objects.filter(user_id=user.pk)
+    reacted_ids = list(reactions.values_list('message_id', flat=True).distinct())
+    _delete_in_batches(job, reactions, batch_size, pause)
+    refresh_reaction_counts(reacted_ids)
+    for queryset in (
+        # Receipts and mentions of this user on other people's messages
+        GroupMessage.seen_by.through.objects.filter(user_id=user.pk),
+        GroupMessage.delivered_to.through.objects.filter(user_id=user.pk),
+        Mention.objects.filter(user_id=user.pk),
+        RoomReadState.objects.filter(user_id=user.pk),
+        ChatGroup.members.through.objects.filter(user_id=user.pk),
+        ChatGroup.users_online.through.objects.filter(user_id=user.pk),
+    ):
+        _delete_in_batches(job, queryset, batch_size, pause)
+    user.delete()
+    for group_id in group_ids:
+        invalidate_group(group_id)
+        # last_message may have pointed at one of the deleted messages
+        group = ChatGroup.all_objects.filter(pk=group_id).first()
+        if group is not None:
+            group.refresh_activity()
+
+
+PURGERS = {
+    PurgeJob.ROOM: purge_room,
+    PurgeJob.USER: purge_user,
+}
+
+
+def requeue_stale(older_than):
+    """Put back jobs left running by a worker that died, no batch done for older_than. Returns how many"""
+    cutoff = timezone.now() - older_than
+    return PurgeJob.objects.filter(status=PurgeJob.RUNNING, heartbeat__lt=cutoff).update(status=PurgeJob.PENDING)
+
+
+def claim_job():
+    """Next pending job marked running, None when the queue is empty"""
+    with transaction.atomic():
+        now = timezone.now()
+        queryset = PurgeJob.objects.filter(
+            Q(retry_at__isnull=True) | Q(retry_at__lte=now), status=PurgeJob.PENDING
+        ).order_by('created')
+        if connection.features.has_select_for_update_skip_locked:
+            # Several workers can share the queue
+            queryset = queryset.select_for_update(skip_locked=True)
+        job = queryset.first()
+        if job is None:
+            return None
+        job.status = PurgeJob.RUNNING
+        job.started = job.heartbeat = now
+        job.attempts += 1
+        job.save(update_fields=['status', 'started', 'heartbeat', 'attempts'])
+        return job
+
+
+def run_job(job, batch_size=BATCH_SIZE, pause=BATCH_PAUSE):
+    if job.kind == PurgeJob.ROOM:
+        job.total = GroupMessage.objects.filter(group_id=job.target_id).count()
+    else:
+        job.total = GroupMessage.objects.filter(author_id=job.target_id).count()
+    job.deleted = 0
+    job.save(update_fields=['total', 'deleted'])
+    try:
+        PURGERS[job.kind](job, batch_size, pause)
+    except Exception as e:
+        logger.error(f"Purge of {job} failed: {e}")
+        # Deleting is idempotent, a retry picks up where this attempt stopped
+        job.status = PurgeJob.PENDING if job.attempts < MAX_ATTEMPTS else PurgeJob.FAILED
+        job.retry_at = timezone.now() + timedelta(seconds=RETRY_BACKOFF * 2 ** (job.attempts - 1))
+        job.error = str(e)
+        job.save(update_fields=['status', 'retry_at', 'error'])
+        return job
+    job.status = PurgeJob.DONE
+    job.finished = timezone.now()
+    job.save(update_fields=['status', 'finished'])
+    return job
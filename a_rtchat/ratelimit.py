@@ -0,0 +1,128 @@
+"""
+Per-user flood control for sending messages.
+
+Each worker keeps a token bucket per (user, room kind) that rejects a
+flood without any I/O. Sends that pass it are also counted in a Redis
+sliding window (two fixed windows, the previous one weighted by how much
+of it still overlaps), so a user spreading tabs over several workers is
+held to the same limit. Without Redis only the local buckets apply.
+
+Limits are (messages, seconds) per room kind in CHAT_RATE_LIMITS.
+"""
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .connections import TokenBucket
+from .metrics import RATE_LIMITED
+from .redis_conn import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMITS = {
+    'public': (10, 10),
+    'group': (20, 10),
+    'private': (30, 10),
+}
+LIMITS = {**DEFAULT_LIMITS, **getattr(settings, 'CHAT_RATE_LIMITS', {})}
+ENABLED = getattr(settings, 'CHAT_RATE_LIMIT', True)
+# Local buckets kept per worker, least recently used ones are dropped first
+MAX_BUCKETS = 10000
+
+
+def room_kind(chat_group):
+    if chat_group.is_private:
+        return 'private'
+    if chat_group.groupchat_name and chat_group.group_name != 'public-chat':
+        return 'group'
+    return 'public'
+
+
+class LocalLimiter:
+    def __init__(self, max_buckets=MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, window):
+        """Seconds until the next send is allowed, 0 when it is allowed now"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(limit / window, limit)
+                if len(self._buckets) > self.max_buckets:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+        if bucket.take():
+            return 0.0
+        return bucket.wait_time()
+
+
+def _shared_hit(connection, key, limit, window):
+    """Sliding window count in Redis, returns the same as LocalLimiter.hit"""
+    now = time.time()
+    current = int(now // window)
+    elapsed = now - current * window
+    pipe = connection.pipeline()
+    pipe.incr(f'chat:rl:{key}:{current}')
+    pipe.expire(f'chat:rl:{key}:{current}', int(window * 2) + 1)
+    pipe.get(f'chat:rl:{key}:{current - 1}')
+    count, _, previous = pipe.execute()
+    weighted = (int(previous or 0)) * (1 - elapsed / window) + count
+    if weighted <= limit:
+        return 0.0
+    # Roughly when enough of the previous window has slid out
+    return max(0.1, math.ceil(window - elapsed))
+
+
+_local = LocalLimiter()
+
+
+def _check_local(user_id, kind):
+    limit, window = LIMITS[kind]
+    return _local.hit((user_id, kind), limit, window)
+
+
+def _check_shared(user_id, kind):
+    connection = get_redis_connection()
+    if connection is None:
+        return 0.0
+    limit, window = LIMITS[kind]
+    try:
+        return _shared_hit(connection, f'{kind}:{user_id}', limit, window)
+    except Exception as e:
+        # Fail open, the local bucket still applies
+        logger.error(f"Rate limit check failed: {e}")
+        return 0.0
+
+
+def _record(kind, retry_after, source):
+    if retry_after:
+        RATE_LIMITED.inc(kind=kind, source=source)
+    return retry_after
+
+
+def check(user_id, kind, source):
+    """Seconds the user has to wait before sending to this kind of room, 0 if none"""
+    if not ENABLED:
+        return 0.0
+    retry_after = _check_local(user_id, kind) or _check_shared(user_id, kind)
+    return _record(kind, retry_after, source)
+
+
+async def acheck(user_id, kind, source):
+    """check() for consumers, Redis is only reached when the local bucket passes"""
+    if not ENABLED:
+        return 0.0
+    retry_after = _check_local(user_id, kind)
+    if not retry_after and get_redis_connection() is not None:
+        retry_after = await sync_to_async(_check_shared, thread_sensitive=False)(user_id, kind)
+    return _record(kind, retry_after, source)
+
+
+def error_frame(retry_after):
+    return {"type": "error", "code": "rate_limited", "retry_after": int(retry_after * 1000)}
@@ -0,0 +1,308 @@
+"""
+Per-room ring buffer of the most recent messages, rendered once at write
+time so the initial room render and the WebSocket fan-out never go back
+to the database for them.
+
+Backed by a Redis list per room (LPUSH + LTRIM), or by in-process deques
+when Redis isn't configured.
+
+Only warm buffers are pushed to, a cold room is filled from the database
+by the next reader. A message saved while that reader is querying would
+be missing from its fill, so every push bumps the room's generation and a
+fill is only written when the generation it read before querying is still
+current. A fill that loses is dropped, the next reader tries again.
+
+Messages changed in place (edits, deletes, reactions, a new reply) and
+the messages of an author whose profile changed get their entries
+rewritten where they sit, the rest of the buffer stays.
+"""
+import json
+import logging
+import threading
+from collections import deque
+from django.conf import settings
+from django.db import models
+from django.template.loader import render_to_string
+from .models import GroupMessage
+from .redis_conn import get_redis_connection
+from .replicas import primary_reads
+
+logger = logging.getLogger(__name__)
+
+RECENT_CACHE_SIZE = getattr(settings, 'CHAT_RECENT_CACHE_SIZE', 50)
+RECENT_CACHE_TTL = getattr(settings, 'CHAT_RECENT_CACHE_TTL', 60 * 60 * 24)
+ENABLED = getattr(settings, 'CHAT_RECENT_CACHE', True)
+
+
+def _key(group_id):
+    return f'chat:recent:{group_id}'
+
+
+def _generation_key(group_id):
+    return f'chat:recent:{group_id}:generation'
+
+
+def message_payload(message):
+    """The WebSocket frame for a message, None when it has no content"""
+    if message.deleted_at:
+        return None
+    payload = {
+        "message_id": message.id,
+        "username": message.author.username,
+        "timestamp": message.created.isoformat(),
+    }
+    if message.body and message.body.strip():
+        payload["message"] = message.body.strip()
+        payload["type"] = "text"
+    elif message.file:
+        payload["file_url"] = message.file.url
+        payload["filename"] = message.filename
+        payload["file_type"] = message.file_type
+        payload["is_image"] = message.is_image
+        payload["is_gif"] = message.is_gif
+        payload["is_pdf"] = message.is_pdf
+        payload["type"] = "file"
+    else:
+        return None
+    if message.reply_to_id:
+        payload["reply_to"] = message.reply_to_id
+    return payload
+
+
+def build_entry(message):
+    """Cache entry holding the frame and both rendered variants of a message"""
+    return {
+        'id': message.id,
+        'author_id': message.author_id,
+        'payload': message_payload(message),
+        'sent': render_to_string('a_rtchat/chat_message.html', {'message': message, 'user': message.author}),
+        'received': render_to_string('a_rtchat/chat_message.html', {'message': message, 'user': None}),
+    }
+
+
+class LocalBackend:
+    """In-process fallback, each worker keeps its own buffers"""
+
+    def __init__(self):
+        self._groups = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def _bump(self, group_id):
+        self._generations[group_id] = self._generations.get(group_id, 0) + 1
+
+    def generation(self, group_id):
+        with self._lock:
+            return self._generations.get(group_id, 0)
+
+    def push(self, group_id, entry):
+        with self._lock:
+            self._bump(group_id)
+            buffer = self._groups.get(group_id)
+            if buffer is not None:
+                buffer.appendleft(entry)
+
+    def fill(self, group_id, entries, generation):
+        with self._lock:
+            if self._generations.get(group_id, 0) != generation:
+                return False
+            self._groups[group_id] = deque(entries, maxlen=RECENT_CACHE_SIZE)
+            return True
+
+    def replace(self, group_id, entries):
+        by_id = {entry['id']: entry for entry in entries}
+        with self._lock:
+            self._bump(group_id)
+            buffer = self._groups.get(group_id)
+            if buffer is not None:
+                for index, entry in enumerate(buffer):
+                    if entry['id'] in by_id:
+                        buffer[index] = by_id[entry['id']]
+
+    def get(self, group_id, limit):
+        with self._lock:
+            buffer = self._groups.get(group_id)
+            return None if buffer is None else list(buffer)[:limit]
+
+    def invalidate(self, group_id):
+        with self._lock:
+            self._bump(group_id)
+            self._groups.pop(group_id, None)
+
+
+class RedisBackend:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def _bump(self, pipe, group_id):
+        generation_key = _generation_key(group_id)
+        pipe.incr(generation_key)
+        pipe.expire(generation_key, RECENT_CACHE_TTL)
+
+    def generation(self, group_id):
+        return self.connection.get(_generation_key(group_id))
+
+    def push(self, group_id, entry):
+        key = _key(group_id)
+        pipe = self.connection.pipeline()
+        self._bump(pipe, group_id)
+        pipe.lpushx(key, json.dumps(entry))
+        pipe.ltrim(key, 0, RECENT_CACHE_SIZE - 1)
+        pipe.execute()
+
+    def fill(self, group_id, entries, generation):
+        from redis.exceptions import WatchError
+        key, generation_key = _key(group_id), _generation_key(group_id)
+        with self.connection.pipeline() as pipe:
+            try:
+                # A push between the check and EXEC aborts the write
+                pipe.watch(generation_key)
+                if pipe.get(generation_key) != generation:
+                    return False
+                pipe.multi()
+                pipe.delete(key)
+                if entries:
+                    pipe.rpush(key, *(json.dumps(entry) for entry in entries))
+                    pipe.expire(key, RECENT_CACHE_TTL)
+                pipe.execute()
+            except WatchError:
+                return False
+        return True
+
+    def replace(self, group_id, entries):
+        key = _key(group_id)
+        by_id = {entry['id']: json.dumps(entry) for entry in entries}
+
+        def rewrite(pipe):
+            items = pipe.lrange(key, 0, -1)
+            pipe.multi()
+            for index, item in enumerate(items):
+                message_id = json.loads(item)['id']
+                if message_id in by_id:
+                    pipe.lset(key, index, by_id[message_id])
+            # Also turns away a fill that read the old rows
+            self._bump(pipe, group_id)
+
+        # Retried when a push or trim moves the list under it
+        self.connection.transaction(rewrite, key)
+
+    def get(self, group_id, limit):
+        key = _key(group_id)
+        pipe = self.connection.pipeline()
+        pipe.exists(key)
+        pipe.lrange(key, 0, limit - 1)
+        exists, items = pipe.execute()
+        if not exists:
+            return None
+        return [json.loads(item) for item in items]
+
+    def invalidate(self, group_id):
+        pipe = self.connection.pipeline()
+        self._bump(pipe, group_id)
+        pipe.delete(_key(group_id))
+        pipe.execute()
+
+
+_local_backend = LocalBackend()
+
+
+def get_backend():
+    connection = get_redis_connection()
+    if connection is None:
+        return _local_backend
+    return RedisBackend(connection)
+
+
+def push_message(message):
+    """Add a freshly saved message to its room's buffer, returns its entry"""
+    entry = build_entry(message)
+    # Replies aren't in the timeline, their parent's entry is re-rendered instead
+    if ENABLED and not message.reply_to_id:
+        try:
+            get_backend().push(message.group_id, entry)
+        except Exception as e:
+            logger.error(f"Recent cache push failed: {e}")
+    return entry
+
+
+def recent_entries(chat_group, limit):
+    """
+    Newest-last entries of a room's latest messages. Filled from the
+    database on a miss, so only the first render after a cold start or
+    invalidation pays for the query and template rendering.
+    """
+    if not ENABLED:
+        return None
+    backend = get_backend()
+    try:
+        entries = backend.get(chat_group.id, limit)
+    except Exception as e:
+        logger.error(f"Recent cache read failed: {e}")
+        return None
+    if entries is None:
+        try:
+            # Read before the query, a message saved meanwhile moves it on
+            generation = backend.generation(chat_group.id)
+        except Exception as e:
+            logger.error(f"Recent cache read failed: {e}")
+            return None
+        # The buffer is shared by every reader of the room, a lagging replica
+        # would leave the messages it hasn't got yet out of it for everyone
+        with primary_reads():
+            messages = chat_group.chat_messages.select_related('author__profile', 'last_reply__author').order_by(
+                '-created'
+            ).filter(
+                models.Q(body__isnull=False, body__gt='') | models.Q(file__isnull=False), reply_to__isnull=True
+            )[:RECENT_CACHE_SIZE]
+            entries = [build_entry(message) for message in messages]
+        try:
+            backend.fill(chat_group.id, entries, generation)
+        except Exception as e:
+            logger.error(f"Recent cache fill failed: {e}")
+        entries = entries[:limit]
+    else:
+        # A message pushed just after a fill that already held it is in twice
+        seen = set()
+        entries = [entry for entry in entries if not (entry['id'] in seen or seen.add(entry['id']))]
+    entries.reverse()
+    return entries
+
+
+def refresh_entries(group_id, message_ids):
+    """Re-render the entries of messages changed in place, those not in the buffer are skipped"""
+    if not ENABLED or not message_ids:
+        return
+    messages = GroupMessage.objects.select_related('author__profile', 'last_reply__author').filter(
+        pk__in=message_ids, group_id=group_id, reply_to__isnull=True
+    )
+    try:
+        get_backend().replace(group_id, [build_entry(message) for message in messages])
+    except Exception as e:
+        logger.error(f"Recent cache refresh failed: {e}")
+
+
+def refresh_author(user_id, group_ids):
+    """Re-render the buffered entries showing user_id's profile, the rest of each buffer stays"""
+    if not ENABLED:
+        return
+    backend = get_backend()
+    for group_id in group_ids:
+        try:
+            entries = backend.get(group_id, RECENT_CACHE_SIZE)
+        except Exception as e:
+            logger.error(f"Recent cache read failed: {e}")
+            continue
+        if not entries:
+            continue
+        message_ids = GroupMessage.objects.filter(
+            models.Q(author_id=user_id) | models.Q(last_reply__author_id=user_id),
+            pk__in=[entry['id'] for entry in entries],
+        ).values_list('id', flat=True)
+        refresh_entries(group_id, list(message_ids))
+
+
+def invalidate_group(group_id):
+    try:
+        get_backend().invalidate(group_id)
+    except Exception as e:
+        logger.error(f"Recent cache invalidation failed: {e}")
@@ -0,0 +1,22 @@
+import threading
+from django.conf import settings
+
+_connection = None
+_lock = threading.Lock()
+
+
+def get_redis_connection():
+    """
+    Shared sync Redis client for REDIS_URL, or None when Redis isn't
+    configured (development uses in-process fallbacks instead).
+    """
+    global _connection
+    url = getattr(settings, 'REDIS_URL', None)
+    if not url:
+        return None
+    if _connection is None:
+        with _lock:
+            if _connection is None:
+                import redis
+                _connection = redis.Redis.from_url(url, health_check_interval=30)
+    return _connection
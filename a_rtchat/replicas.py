@@ -0,0 +1,96 @@
+"""
+Read replica routing.
+
+Reads only go to a replica where a view opts in with replica_reads():
+history, search and the sidebar. Everything else, and every write, uses
+the primary. A user who has just written is pinned to the primary for
+CHAT_DB_PIN_SECONDS, so their next pages show their own messages even
+while the replicas lag behind.
+
+Replicas are the aliases in CHAT_DB_REPLICAS, by default the databases
+other than "default" whose TEST MIRROR is "default" (see DATABASES in
+settings), so tests run them against the primary.
+"""
+import functools
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_SECONDS = getattr(settings, 'CHAT_DB_PIN_SECONDS', 5)
+
+REPLICAS = getattr(settings, 'CHAT_DB_REPLICAS', [
+    alias for alias, config in settings.DATABASES.items()
+    if alias != DEFAULT_DB_ALIAS and config.get('TEST', {}).get('MIRROR') == DEFAULT_DB_ALIAS
+])
+
+# Replica chosen for the current replica_reads() block
+_replica = ContextVar('chat_replica', default=None)
+
+
+def _pin_key(user_id):
+    return f'chat:db:pin:{user_id}'
+
+
+def pin_primary(user):
+    """Read from the primary for the next PIN_SECONDS, after the user wrote something"""
+    if REPLICAS and user.is_authenticated:
+        cache.set(_pin_key(user.pk), 1, PIN_SECONDS)
+
+
+def is_pinned(user):
+    return user.is_authenticated and cache.get(_pin_key(user.pk)) is not None
+
+
+@contextmanager
+def replica_reads(user=None):
+    """Send the reads made in the block to a replica, unless user is pinned to the primary"""
+    if not REPLICAS or _replica.get() or (user is not None and is_pinned(user)):
+        yield
+        return
+    token = _replica.set(random.choice(REPLICAS))
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """Send the reads made in the block to the primary, even inside replica_reads()"""
+    token = _replica.set(None)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def reads_from_replica(view):
+    """replica_reads() around a view or context processor, for request.user"""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with replica_reads(request.user):
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replica = _replica.get()
+        # Reads inside a transaction that may have written must see its writes
+        if replica is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return replica
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same rows as the primary
+        return True
+
+    # No allow_migrate: real replicas get the schema through replication and
+    # are never migrated directly, while a test database of an unmirrored
+    # replica needs it
@@ -7,4 +7,7 @@ websocket_urlpatterns = [
 
     # Online status
     re_path(r"^ws/online-status/$", consumers.OnlineStatusConsumer.as_asgi()),
+
+    # One socket for many rooms and the presence feed
+    re_path(r"^ws/multiplex/$", consumers.MultiplexConsumer.as_asgi()),
 ]
@@ -0,0 +1,86 @@
+from django.dispatch import receiver
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_out
+from a_users.models import Profile
+from .auth import invalidate_cached_user
+from .models import BlockedTerm, ChatGroup, GroupMessage
+from .moderation import invalidate as invalidate_filter
+from .mentions import invalidate_all as invalidate_mentions, invalidate_room as invalidate_room_mentions
+from .recent_cache import invalidate_group, refresh_author, refresh_entries
+
+
+@receiver(post_save, sender=GroupMessage)
+def message_postsave(sender, instance, created, **kwargs):
+    if created:
+        ChatGroup.record_message(instance)
+        if instance.reply_to_id:
+            GroupMessage.record_reply(instance)
+            refresh_entries(instance.group_id, [instance.reply_to_id])
+
+
+@receiver(post_delete, sender=GroupMessage)
+def message_postdelete(sender, instance, **kwargs):
+    invalidate_group(instance.group_id)
+
+
+@receiver(m2m_changed, sender=ChatGroup.members.through)
+def members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        invalidate_room_mentions(instance.pk)
+        return
+    # Changed from the user's side, pk_set holds the groups (None on clear)
+    if pk_set is None:
+        invalidate_mentions()
+        return
+    for group_id in pk_set:
+        invalidate_room_mentions(group_id)
+
+
+@receiver(post_save, sender=BlockedTerm)
+@receiver(post_delete, sender=BlockedTerm)
+def blocked_term_changed(sender, instance, **kwargs):
+    invalidate_filter()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    # Username, password (session hash) or is_active may have changed
+    invalidate_cached_user(instance.pk)
+
+
+@receiver(user_logged_out)
+def user_loggedout(sender, request, user, **kwargs):
+    if user is not None:
+        invalidate_cached_user(user.pk)
+
+
+@receiver(pre_save, sender=Profile)
+def profile_presave(sender, instance, update_fields=None, **kwargs):
+    # Compared in profile_postsave, only a new name makes mention indexes stale
+    instance._previous_displayname = instance.displayname
+    if instance.pk and (update_fields is None or 'displayname' in update_fields):
+        instance._previous_displayname = (
+            Profile.objects.filter(pk=instance.pk).values_list('displayname', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Profile)
+def profile_postsave(sender, instance, created, update_fields=None, **kwargs):
+    invalidate_cached_user(instance.user_id)
+    if created:
+        return
+    # Only the rooms the user is a member of index the name or buffer their messages
+    group_ids = list(
+        ChatGroup.members.through.objects.filter(user_id=instance.user_id).values_list('chatgroup_id', flat=True)
+    )
+    if instance.displayname != getattr(instance, '_previous_displayname', instance.displayname):
+        for group_id in group_ids:
+            invalidate_room_mentions(group_id)
+    # A new version means a new name or avatar. Rendered fragments are keyed
+    # by it, the entries in the recent buffers are re-rendered
+    if update_fields is None or 'version' in update_fields:
+        refresh_author(instance.user_id, group_ids)
@@ -0,0 +1,76 @@
+"""
+Approximate count of a room's spectators, the readers on its SSE stream.
+
+Spectators aren't written to ChatGroup.users_online. Every open stream
+adds its id to a HyperLogLog of the room for the current window of
+CHAT_SPECTATOR_WINDOW seconds, and the count is the PFCOUNT of the
+current and the previous window. That is a few KB per room whatever the
+audience, one PFADD per stream per heartbeat, and readers who left drop
+out within two windows. Without Redis each worker counts its own streams.
+"""
+import threading
+import time
+from django.conf import settings
+from .redis_conn import get_redis_connection
+
+WINDOW = getattr(settings, 'CHAT_SPECTATOR_WINDOW', 30)
+
+
+def _key(room, window):
+    return f'chat:spectators:{room}:{window}'
+
+
+class LocalCounter:
+    """In-process fallback, exact for the streams of this worker"""
+
+    def __init__(self):
+        self._rooms = {}
+        self._lock = threading.Lock()
+
+    def touch(self, room, stream_id):
+        with self._lock:
+            self._rooms.setdefault(room, {})[stream_id] = time.monotonic()
+
+    def leave(self, room, stream_id):
+        with self._lock:
+            streams = self._rooms.get(room)
+            if streams is not None:
+                streams.pop(stream_id, None)
+                if not streams:
+                    del self._rooms[room]
+
+    def count(self, room):
+        cutoff = time.monotonic() - 2 * WINDOW
+        with self._lock:
+            streams = self._rooms.get(room, {})
+            return sum(1 for seen in streams.values() if seen >= cutoff)
+
+
+class RedisCounter:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def touch(self, room, stream_id):
+        key = _key(room, int(time.time() // WINDOW))
+        pipe = self.connection.pipeline()
+        pipe.pfadd(key, stream_id)
+        pipe.expire(key, 3 * WINDOW)
+        pipe.execute()
+
+    def leave(self, room, stream_id):
+        # A HyperLogLog can't forget a member, the stream ages out with its window
+        pass
+
+    def count(self, room):
+        window = int(time.time() // WINDOW)
+        return self.connection.pfcount(_key(room, window), _key(room, window - 1))
+
+
+_local_counter = LocalCounter()
+
+
+def get_counter():
+    connection = get_redis_connection()
+    if connection is None:
+        return _local_counter
+    return RedisCounter(connection)
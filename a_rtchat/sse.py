@@ -0,0 +1,122 @@
+"""
+Read-only Server-Sent Events stream of a room.
+
+For readers who don't need a socket: spectators of busy public rooms and
+clients behind proxies that break WebSockets. A stream listens to the
+room's channel layer group like a room socket does and sends the same
+frames, but it never joins users_online, it is counted by
+a_rtchat.spectators instead. Streams opening, closing and heartbeating
+schedule the room's online count broadcast like sockets joining do.
+
+Message frames carry the message id as their SSE event id. A reconnecting
+EventSource sends it back as Last-Event-ID and first gets the messages it
+missed, up to CHAT_SSE_REPLAY_LIMIT of them. Edits, deletes and reactions
+made while it was away aren't replayed.
+"""
+import asyncio
+import json
+import time
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from .consumers import schedule_online_count
+from .metrics import SSE_EVENTS_SENT, SSE_STREAMS
+from .recent_cache import message_payload
+from .spectators import get_counter
+
+HEARTBEAT = getattr(settings, 'CHAT_SSE_HEARTBEAT', 15)
+REPLAY_LIMIT = getattr(settings, 'CHAT_SSE_REPLAY_LIMIT', 100)
+# Reconnect delay the browser is told to use
+RETRY_MS = getattr(settings, 'CHAT_SSE_RETRY_MS', 3000)
+
+
+def format_event(frame, event_id=None):
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    lines.append(f'data: {json.dumps(frame)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def event_frame(event):
+    """The frame a room socket would send for a channel layer event, None for the ones streams skip"""
+    kind = event.get('type')
+    if kind in ('chat.message', 'message.handler'):
+        # Events without a payload predate it, they aren't worth a query per stream
+        payload = event.get('payload')
+        return dict(payload, type='message') if payload else None
+    if kind == 'message.edit':
+        return {"type": "edit", "message_id": event["message_id"], "message": event["body"],
+                "edited": event["edited"]}
+    if kind == 'message.delete':
+        return {"type": "delete", "message_id": event["message_id"]}
+    if kind == 'message.reactions':
+        return {"type": "reactions", "reactions": event["reactions"]}
+    if kind == 'online.count':
+        return {"type": "online_count", "online_count": event["online_count"],
+                "spectators": event.get("spectators", 0)}
+    # Typing is only for the people taking part
+    return None
+
+
+def replay(chat_group, after_id, limit=REPLAY_LIMIT):
+    """(id, frame) of the messages after after_id, oldest first"""
+    messages = (
+        chat_group.chat_messages.select_related('author')
+        .filter(id__gt=after_id, deleted_at__isnull=True).order_by('id')[:limit]
+    )
+    frames = []
+    for message in messages:
+        frame = message_payload(message)
+        if frame:
+            frames.append((message.id, dict(frame, type='message')))
+    return frames
+
+
+async def room_stream(chat_group, last_event_id=None):
+    """The text/event-stream body for one reader of chat_group"""
+    room = chat_group.group_name
+    channel_layer = get_channel_layer()
+    channel = await channel_layer.new_channel()
+    counter = get_counter()
+    # Joined before the replay so nothing falls in between
+    await channel_layer.group_add(room, channel)
+    SSE_STREAMS.inc()
+    try:
+        await sync_to_async(counter.touch, thread_sensitive=False)(room, channel)
+        touched = time.monotonic()
+        schedule_online_count(chat_group)
+        yield f'retry: {RETRY_MS}\n\n'
+        replayed_upto = None
+        if last_event_id is not None:
+            for message_id, frame in await database_sync_to_async(replay)(chat_group, last_event_id):
+                replayed_upto = message_id
+                SSE_EVENTS_SENT.inc(type='message')
+                yield format_event(frame, message_id)
+
+        while True:
+            if time.monotonic() - touched >= HEARTBEAT:
+                await sync_to_async(counter.touch, thread_sensitive=False)(room, channel)
+                touched = time.monotonic()
+                # Readers that left drop out of the count as their windows pass
+                schedule_online_count(chat_group)
+            try:
+                event = await asyncio.wait_for(channel_layer.receive(channel), HEARTBEAT)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle stream
+                yield ': ping\n\n'
+                continue
+            frame = event_frame(event)
+            if frame is None:
+                continue
+            event_id = None
+            if frame["type"] == "message":
+                if replayed_upto is not None and frame["message_id"] <= replayed_upto:
+                    continue
+                event_id = frame["message_id"]
+            SSE_EVENTS_SENT.inc(type=frame["type"])
+            yield format_event(frame, event_id)
+    finally:
+        SSE_STREAMS.dec()
+        await channel_layer.group_discard(room, channel)
+        counter.leave(room, channel)
+        schedule_online_count(chat_group)
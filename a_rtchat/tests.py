@@ -1,3 +1,253 @@
-from django.test import TestCase
+import csv
+import json
+import secrets
+import tracemalloc
+import zlib
+from datetime import timedelta
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from . import replicas
+from .archive import archive_group, iter_archived_rows
+from .moderation import Matcher, apply
+from .models import ChatGroup, GroupMessage, Mention, MessageArchive, PurgeJob
+from .purge import TOMBSTONE_USERNAME, delete_account, run_job
+from .recent_cache import invalidate_group, recent_entries
+from .replicas import ReplicaRouter, pin_primary, replica_reads
 
-# Create your tests here.
+# The SQLite stand-in replica, see DATABASES in settings
+HAS_REPLICA = 'replica' in settings.DATABASES
+
+
+@skipUnless(HAS_REPLICA, "run with SQLITE_REPLICA=True")
+@mock.patch.object(replicas, 'REPLICAS', ['replica'])
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    The replica's test database isn't a mirror, nothing written to the
+    primary shows up on it. TestCase would wrap every test in atomic(),
+    which on its own sends reads to the primary.
+    """
+    databases = {'default', 'replica'} if HAS_REPLICA else {'default'}
+
+    def setUp(self):
+        cache.clear()
+        self.router = ReplicaRouter()
+        self.user = User.objects.create(username='reader')
+        self.chat_group = ChatGroup.objects.create(group_name='replica-room', groupchat_name='Replica')
+
+    def test_reads_use_primary_outside_replica_reads(self):
+        self.assertEqual(self.router.db_for_read(GroupMessage), 'default')
+
+    def test_replica_reads(self):
+        with replica_reads(self.user):
+            self.assertEqual(self.router.db_for_read(GroupMessage), 'replica')
+        self.assertEqual(self.router.db_for_read(GroupMessage), 'default')
+
+    def test_pinned_user_reads_primary(self):
+        pin_primary(self.user)
+        with replica_reads(self.user):
+            self.assertEqual(self.router.db_for_read(GroupMessage), 'default')
+
+    def test_atomic_block_reads_primary(self):
+        with replica_reads(self.user), transaction.atomic():
+            self.assertEqual(self.router.db_for_read(GroupMessage), 'default')
+
+    def test_writes_use_primary(self):
+        with replica_reads(self.user):
+            self.assertEqual(self.router.db_for_write(GroupMessage), 'default')
+
+    def test_just_written_row_read_from_primary_while_pinned(self):
+        message = GroupMessage.objects.create(group=self.chat_group, author=self.user, body='hello')
+        with replica_reads(self.user):
+            # Not replicated, the read went to the replica
+            self.assertFalse(GroupMessage.objects.filter(pk=message.pk).exists())
+        pin_primary(self.user)
+        with replica_reads(self.user):
+            self.assertTrue(GroupMessage.objects.filter(pk=message.pk).exists())
+
+    def test_cold_recent_cache_filled_from_primary(self):
+        message = GroupMessage.objects.create(group=self.chat_group, author=self.user, body='not replicated')
+        invalidate_group(self.chat_group.pk)
+        self.chat_group.members.add(self.user)
+        self.client.force_login(self.user)
+        response = self.client.get('/chat/room/replica-room')
+        self.assertContains(response, 'not replicated')
+        # What the render filled the room's buffer with, every reader gets it
+        with replica_reads():
+            entries = recent_entries(self.chat_group, 30)
+        self.assertEqual([entry['id'] for entry in entries], [message.id])
+
+
+class ExportTests(TestCase):
+    """The export streams rows in order with memory bounded whatever the room's size"""
+    LIVE = 30000
+    ARCHIVED = 2000
+    # Well below the size of the export itself, about 9 MB uncompressed
+    MEMORY_CEILING = 4 * 1024 * 1024
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='exporter', is_staff=True)
+        cls.chat_group = ChatGroup.objects.create(group_name='export-room', groupchat_name='Export')
+        GroupMessage.objects.bulk_create(
+            GroupMessage(group=cls.chat_group, author=cls.user, body=f'message {i} {secrets.token_hex(100)}')
+            for i in range(cls.LIVE + cls.ARCHIVED)
+        )
+        ids = list(cls.chat_group.chat_messages.order_by('id').values_list('id', flat=True))
+        old = timezone.now() - timedelta(days=400)
+        GroupMessage.objects.filter(id__lte=ids[cls.ARCHIVED - 1]).update(created=old)
+        # Deleted rows are left out, from the archive and from the live table
+        GroupMessage.objects.filter(id__in=[ids[10], ids[-10]]).update(deleted_at=timezone.now())
+        archive_group(cls.chat_group, old + timedelta(days=1))
+        cls.expected = len(ids) - 2
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def _lines(self, response, compress):
+        """Decoded lines of the body, read chunk by chunk like a client would"""
+        decompressor = zlib.decompressobj(31) if compress else None
+        pending = b''
+        for chunk in response.streaming_content:
+            while chunk:
+                if compress:
+                    # Inflated a bit at a time, so the test itself stays within the ceiling
+                    data = decompressor.decompress(chunk, 64 * 1024)
+                    chunk = decompressor.unconsumed_tail
+                else:
+                    data, chunk = chunk, b''
+                *lines, pending = (pending + data).split(b'\n')
+                for line in lines:
+                    yield line.decode('utf-8')
+        if compress:
+            pending += decompressor.flush()
+            self.assertTrue(decompressor.eof)
+        self.assertEqual(pending, b'')
+
+    def _ids(self, lines, fmt):
+        if fmt == 'jsonl':
+            for line in lines:
+                yield json.loads(line)['id']
+            return
+        rows = csv.reader(line.rstrip('\r') for line in lines)
+        self.assertEqual(next(rows), ['id', 'author', 'body', 'file', 'created', 'reply_to'])
+        for row in rows:
+            yield int(row[0])
+
+    def test_streamed_export(self):
+        self.assertTrue(MessageArchive.objects.filter(group=self.chat_group).exists())
+        for fmt in ('jsonl', 'csv'):
+            for compress in (False, True):
+                with self.subTest(format=fmt, gzip=compress):
+                    tracemalloc.start()
+                    try:
+                        response = self.client.get(
+                            f'/chat/export/export-room?format={fmt}&gzip={int(compress)}'
+                        )
+                        self.assertTrue(response.streaming)
+                        count, last_id = 0, 0
+                        for message_id in self._ids(self._lines(response, compress), fmt):
+                            self.assertGreater(message_id, last_id)
+                            count, last_id = count + 1, message_id
+                        _, peak = tracemalloc.get_traced_memory()
+                    finally:
+                        tracemalloc.stop()
+                    self.assertEqual(count, self.expected)
+                    self.assertLess(peak, self.MEMORY_CEILING)
+
+
+class ArchiveThreadTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='archiver')
+        self.other = User.objects.create(username='mentioned')
+        self.chat_group = ChatGroup.objects.create(group_name='archive-room', groupchat_name='Archive')
+        self.old = timezone.now() - timedelta(days=400)
+        self.cutoff = self.old + timedelta(days=1)
+
+    def _message(self, body, old=True, reply_to=None):
+        message = GroupMessage.objects.create(group=self.chat_group, author=self.user, body=body, reply_to=reply_to)
+        if old:
+            GroupMessage.objects.filter(pk=message.pk).update(created=self.old)
+        return message
+
+    def _archived_rows(self):
+        return {row['id']: row for row in iter_archived_rows(self.chat_group)}
+
+    def test_parent_with_live_reply_stays_live(self):
+        before = self._message('before')
+        parent = self._message('parent')
+        after = self._message('after')
+        reply = self._message('reply', old=False, reply_to=parent)
+
+        self.assertEqual(archive_group(self.chat_group, self.cutoff), 1)
+        self.assertEqual(list(self._archived_rows()), [before.id])
+        reply.refresh_from_db()
+        self.assertEqual(reply.reply_to_id, parent.id)
+        self.assertEqual(GroupMessage.objects.filter(pk__in=[parent.id, after.id]).count(), 2)
+
+    def test_thread_archived_with_its_parent(self):
+        parent = self._message('parent @mentioned')
+        Mention.objects.create(
+            user=self.other, message=parent, author=self.user, group=self.chat_group, created=self.old
+        )
+        self._message('between')
+        reply = self._message('reply', reply_to=parent)
+        self._message('live', old=False)
+
+        # Batches of one, the reply still goes with its parent
+        self.assertEqual(archive_group(self.chat_group, self.cutoff, chunk_size=1), 3)
+        self.assertEqual(self._archived_rows()[reply.id]['reply_to'], parent.id)
+        mention = Mention.objects.get(user=self.other)
+        self.assertIsNone(mention.message_id)
+        self.assertEqual(mention.excerpt, 'parent @mentioned')
+
+
+class LinkFilterTests(TestCase):
+    def setUp(self):
+        self.matcher = Matcher([], block_links=True)
+
+    def test_links_blocked(self):
+        for text in ('see www.example.com', 'https://example.com/a?b=1', 'go to HTTP://10.0.0.1:8000'):
+            with self.subTest(text=text):
+                self.assertTrue(apply(self.matcher, text).blocked)
+
+    def test_words_containing_markers_pass(self):
+        for text in ('awww. so cute', 'awww.', 'www. is not a site', 'shttp://', 'email me at bob@www.lan'):
+            with self.subTest(text=text):
+                self.assertFalse(apply(self.matcher, text).blocked)
+
+
+class AccountPurgeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='leaving')
+        self.other = User.objects.create(username='staying')
+        self.chat_group = ChatGroup.objects.create(group_name='purge-room', groupchat_name='Purge')
+
+    def test_account_hidden_at_once(self):
+        message = GroupMessage.objects.create(group=self.chat_group, author=self.user, body='goodbye')
+        delete_account(self.user)
+        message.refresh_from_db()
+        self.assertIsNotNone(message.deleted_at)
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.name, 'Deleted account')
+
+    def test_other_peoples_replies_kept(self):
+        parent = GroupMessage.objects.create(group=self.chat_group, author=self.user, body='question')
+        reply = GroupMessage.objects.create(group=self.chat_group, author=self.other, body='answer', reply_to=parent)
+        alone = GroupMessage.objects.create(group=self.chat_group, author=self.user, body='no replies')
+        job = delete_account(self.user)
+        run_job(job, pause=0)
+
+        self.assertEqual(job.status, PurgeJob.DONE)
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(GroupMessage.objects.filter(pk=alone.pk).exists())
+        reply.refresh_from_db()
+        self.assertEqual(reply.reply_to_id, parent.id)
+        parent.refresh_from_db()
+        self.assertEqual(parent.author.username, TOMBSTONE_USERNAME)
+        self.assertIsNone(parent.body)
+        self.assertIsNotNone(parent.deleted_at)
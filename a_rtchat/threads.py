@@ -0,0 +1,54 @@
+"""
+Reply threads.
+
+A reply hangs under a timeline message, replying to a reply joins the same
+thread, and is left out of the timeline. The parent carries reply_count
+and last_reply, updated by GroupMessage.record_reply when a reply is
+saved, so rendering the timeline never counts replies. Thread pages are
+read oldest first by id, keyset paginated on the groupmessage_reply_to_id
+index.
+"""
+from django.conf import settings
+from django.db.models import Count, F, Max
+from .models import GroupMessage
+
+THREAD_PAGE_SIZE = getattr(settings, 'CHAT_THREAD_PAGE_SIZE', 30)
+
+
+def thread_root(chat_group, message_id):
+    """Id of the message a reply to message_id goes under, None when it is gone"""
+    row = (
+        GroupMessage.objects.filter(group=chat_group, pk=message_id, deleted_at__isnull=True)
+        .values_list('id', 'reply_to_id').first()
+    )
+    if row is None:
+        return None
+    message_id, reply_to_id = row
+    return reply_to_id or message_id
+
+
+def reply_count(message_id):
+    return GroupMessage.objects.values_list('reply_count', flat=True).get(pk=message_id)
+
+
+def thread_page(parent, after_id=0, limit=THREAD_PAGE_SIZE):
+    """Replies to parent with an id above after_id, oldest first, and whether more follow"""
+    replies = list(
+        parent.replies.select_related('author__profile').filter(id__gt=after_id).order_by('id')[:limit + 1]
+    )
+    return replies[:limit], len(replies) > limit
+
+
+def refresh_reply_counts(parent_ids):
+    """Recount reply_count and last_reply of thread parents, after replies were removed in bulk"""
+    counts = {parent_id: (0, None) for parent_id in parent_ids}
+    rows = (
+        GroupMessage.objects.filter(reply_to_id__in=parent_ids)
+        .values_list('reply_to_id').annotate(count=Count('id'), last=Max('id')).order_by()
+    )
+    for parent_id, count, last in rows:
+        counts[parent_id] = (count, last)
+    for parent_id, (count, last) in counts.items():
+        GroupMessage.objects.filter(pk=parent_id).update(
+            reply_count=count, last_reply_id=last, version=F('version') + 1
+        )
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import logging
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .redis_conn import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between two accepted "is typing" events of one user in one room
+TYPING_THROTTLE = getattr(settings, 'CHAT_TYPING_THROTTLE', 3.0)
+# Seconds after the last accepted event before a user stops "typing"
+TYPING_TTL = getattr(settings, 'CHAT_TYPING_TTL', 6.0)
+# Seconds between two merged typing frames of one room
+TYPING_TICK = getattr(settings, 'CHAT_TYPING_TICK', 1.0)
+# Names spelled out before the rest is summarised as "N others"
+TYPING_MAX_NAMES = 2
+
+
+def _key(room):
+    return f'chat:typing:{room}'
+
+
+def _frame_key(room):
+    return f'chat:typing:{room}:frame'
+
+
+def typing_text(names):
+    """Build the 'X, Y and 3 others are typing' line"""
+    if not names:
+        return ""
+    if len(names) == 1:
+        return f"{names[0]} is typing"
+    if len(names) <= TYPING_MAX_NAMES:
+        return f"{', '.join(names[:-1])} and {names[-1]} are typing"
+    shown = names[:TYPING_MAX_NAMES]
+    others = len(names) - TYPING_MAX_NAMES
+    label = "other" if others == 1 else "others"
+    return f"{', '.join(shown)} and {others} {label} are typing"
+
+
+class TypingTracker:
+    """
+    Registry of who is typing in which room.
+
+    Nothing here touches the database. Each user gets at most one accepted
+    event per room every TYPING_THROTTLE seconds, entries expire after
+    TYPING_TTL and every room gets at most one merged frame per TYPING_TICK,
+    sent only when the set of typists actually changed.
+
+    Typing events reach the worker holding the user's socket. With Redis
+    configured a worker whose typists of a room changed writes them to the
+    room's hash on its next tick, and the frame carries the typists of all
+    workers read back from it, so workers don't overwrite each other's
+    partial sets. The last frame of the room is kept next to the hash, a
+    worker only sends when its merged set replaces a different one, so each
+    change goes out once however many workers see it.
+    """
+
+    def __init__(self):
+        # room -> {username: [display_name, expires_at, accepted_at, since]}
+        self._rooms = {}
+        self._dirty = set()
+        self._tasks = {}
+        # room -> usernames this worker wrote to the room's hash
+        self._shared = {}
+        # room -> typists of the last frame this worker sent, without Redis
+        self._sent = {}
+
+    def touch(self, room, username, display_name, now=None):
+        """Register a typing event, returns False when it was throttled"""
+        now = now or time.monotonic()
+        typists = self._rooms.setdefault(room, {})
+        entry = typists.get(username)
+        if entry and now - entry[2] < TYPING_THROTTLE:
+            return False
+        # A later expiry is a change too, the shared hash has to follow it
+        self._dirty.add(room)
+        typists[username] = [display_name, now + TYPING_TTL, now, entry[3] if entry else time.time()]
+        return True
+
+    def clear(self, room, username):
+        """Drop a user from a room, e.g. after they sent their message"""
+        typists = self._rooms.get(room)
+        if typists and typists.pop(username, None):
+            self._dirty.add(room)
+            return True
+        return False
+
+    def typists(self, room, now=None):
+        """Return [(username, display_name)] of a room, expiring stale entries"""
+        now = now or time.monotonic()
+        typists = self._rooms.get(room, {})
+        for username in [u for u, entry in typists.items() if entry[1] <= now]:
+            del typists[username]
+            self._dirty.add(room)
+        return [(username, entry[0]) for username, entry in typists.items()]
+
+    def _share(self, connection, room, typists, now=None):
+        """
+        Write this worker's typists of room to its hash, returns the typists
+        of every worker and whether they differ from the room's last frame
+        """
+        now = now or time.monotonic()
+        wall = time.time()
+        key = _key(room)
+        gone = self._shared.get(room, set()) - set(typists)
+        pipe = connection.pipeline()
+        if gone:
+            pipe.hdel(key, *gone)
+        if typists:
+            pipe.hset(key, mapping={
+                username: json.dumps([entry[0], wall + entry[1] - now, entry[3]])
+                for username, entry in typists.items()
+            })
+            pipe.pexpire(key, int(TYPING_TTL * 1000))
+        pipe.hgetall(key)
+        fields = pipe.execute()[-1]
+        self._shared[room] = set(typists)
+        merged = []
+        for username, value in fields.items():
+            display_name, expires_at, since = json.loads(value)
+            # Left behind by a worker that went away
+            if expires_at > wall:
+                merged.append((since, username.decode(), display_name))
+        merged.sort()
+        merged = [(username, display_name) for since, username, display_name in merged]
+        # Swapped in atomically, of the workers holding the same set only the first sends it
+        frame = json.dumps(merged)
+        pipe = connection.pipeline()
+        pipe.getset(_frame_key(room), frame)
+        pipe.pexpire(_frame_key(room), int(TYPING_TTL * 2000))
+        previous = pipe.execute()[0]
+        previous = previous.decode() if previous is not None else '[]'
+        return merged, previous != frame
+
+    def schedule(self, room, channel_layer):
+        """Make sure a flush loop is running for the room"""
+        if room not in self._tasks:
+            self._tasks[room] = asyncio.ensure_future(self._flush_loop(room, channel_layer))
+
+    async def _flush_loop(self, room, channel_layer):
+        try:
+            while True:
+                await asyncio.sleep(TYPING_TICK)
+                local = typists = self.typists(room)
+                if room in self._dirty:
+                    self._dirty.discard(room)
+                    connection = get_redis_connection()
+                    if connection is None:
+                        changed = typists != self._sent.get(room)
+                        self._sent[room] = typists
+                    else:
+                        # Only written when this worker's typists changed
+                        typists, changed = await sync_to_async(self._share, thread_sensitive=False)(
+                            connection, room, dict(self._rooms.get(room, {}))
+                        )
+                    if changed:
+                        await channel_layer.group_send(
+                            room,
+                            {
+                                "type": "typing.update",
+                                "room": room,
+                                "typists": typists,
+                            }
+                        )
+                if not local:
+                    self._rooms.pop(room, None)
+                    self._shared.pop(room, None)
+                    self._sent.pop(room, None)
+                    break
+        except Exception as e:
+            logger.error(f"Typing flush failed for {room}: {e}")
+        finally:
+            self._tasks.pop(room, None)
+
+
+typing_tracker = TypingTracker()
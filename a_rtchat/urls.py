@@ -1,17 +1,23 @@
 from django.urls import path
-from .views import chat_view , get_or_create_chatroom, create_groupchat,chatroom_edit_view , chatroom_delete_view,leave_group_view,chat_file_upload
+from .views import chat_view , get_or_create_chatroom, create_groupchat,chatroom_edit_view , chatroom_delete_view,leave_group_view,chat_file_upload,chat_history_view,chat_member_search_view,mentions_view,chat_export_view,chat_thread_view,chat_stream_view
 from django.conf import settings
 from django.conf.urls.static import static
 
 urlpatterns = [
     path('' , chat_view , name="home"),
+    path('chat/mentions/', mentions_view, name="mentions"),
     path('chat/<username>' , get_or_create_chatroom, name="start-chat"),
     path('chat/room/<chatroom_name>' , chat_view , name="chatroom"),
     path('chat/new_groupchat/' , create_groupchat, name="new-groupchat"), 
     path('chat/edit/<chatroom_name>', chatroom_edit_view, name="edit-chatroom"),
     path('chat/delete/<chatroom_name>' , chatroom_delete_view, name="chatroom-delete"),
     path('chat/leave/<chatroom_name>', leave_group_view, name="chatroom-leave"),
-    path('chat/fileupload/<chatroom_name>', chat_file_upload , name="chat-file-upload")
+    path('chat/fileupload/<chatroom_name>', chat_file_upload , name="chat-file-upload"),
+    path('chat/history/<chatroom_name>', chat_history_view, name="chat-history"),
+    path('chat/thread/<int:message_id>', chat_thread_view, name="chat-thread"),
+    path('chat/stream/<chatroom_name>', chat_stream_view, name="chat-stream"),
+    path('chat/members/<chatroom_name>', chat_member_search_view, name="chat-member-search"),
+    path('chat/export/<chatroom_name>', chat_export_view, name="chat-export"),
 ]
 
 if settings.DEBUG:
@@ -1,15 +1,41 @@
 # Leave group view
+import logging
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.shortcuts import render , get_object_or_404 , redirect
 from django.contrib.auth.decorators import login_required
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.utils.safestring import mark_safe
 from django.contrib import messages
 from django.http import Http404
 from django.core.exceptions import ValidationError
 from .models import *
 from .forms import *
+from .metrics import MESSAGES_CREATED, registry
+from .archive import history_page
+from .recent_cache import push_message, recent_entries
+from .ratelimit import check as rate_limit_check, room_kind
+from .moderation import MessageBlocked, clean_body
+from .mentions import notify_mentions, record_mentions, room_index
+from .purge import delete_room
+from .export import FORMATS, aiter_chunks, export_chunks, export_filename
+from .replicas import reads_from_replica, replica_reads
+from .threads import thread_page
+from .sse import room_stream
+
+logger = logging.getLogger(__name__)
+
+HISTORY_PAGE_SIZE = 30
+MENTIONS_PAGE_SIZE = 30
+
+
+def rate_limited_response(retry_after):
+    response = HttpResponse(status=429)
+    response['Retry-After'] = max(1, round(retry_after))
+    return response
 
 
 # Create your views here.
@@ -26,26 +52,25 @@ def chat_view(request, chatroom_name="public-chat"):
     else:
         chat_group = get_object_or_404(ChatGroup, group_name=chatroom_name)
     
-    # Only include messages that have either body or file
-    valid_messages = chat_group.chat_messages.order_by('-created').filter(
-        models.Q(body__isnull=False, body__gt='') | models.Q(file__isnull=False)
-    )[:30]
-    chat_messages = reversed(valid_messages)
     form = ChatmessageCreateForm()
 
+    # Loaded once with profiles, the template lists every member's avatar
+    members = list(chat_group.members.select_related('profile'))
+
     other_user = None
     if chat_group.is_private:
-        if request.user not in chat_group.members.all():
+        if request.user not in members:
             raise Http404
-        for member in chat_group.members.all():
+        for member in members:
             if member != request.user:
                 other_user = member
                 break
 
     if chat_group.groupchat_name:
-        if request.user not in chat_group.members.all():
+        if request.user not in members:
             if request.user.emailaddress_set.filter(verified=True).exists():
                 chat_group.members.add(request.user)
+                members.append(request.user)
             else:
                 messages.warning(request, "You need to first verify your email to join a chat.")
                 return redirect('profile-settings')
@@ -65,10 +90,17 @@ def chat_view(request, chatroom_name="public-chat"):
             # Prevent saving if both body and file are empty
             if not body_content and not file_content:
                 return HttpResponse(status=204)  # No content
+
+            retry_after = rate_limit_check(request.user.id, room_kind(chat_group), "htmx")
+            if retry_after:
+                return rate_limited_response(retry_after)
             
             # Only set body if it's not empty
             if body_content:
-                message.body = body_content
+                try:
+                    message.body = clean_body(body_content)
+                except MessageBlocked:
+                    return HttpResponse(status=422)
                 
             # Handle file upload if present
             if file_content:
@@ -76,6 +108,11 @@ def chat_view(request, chatroom_name="public-chat"):
             
             try:
                 message.save()
+                MESSAGES_CREATED.inc(source="htmx")
+                push_message(message)
+                mentioned = record_mentions(message)
+                if mentioned:
+                    async_to_sync(notify_mentions)(get_channel_layer(), message, mentioned)
                 context = {
                     'message': message,
                     'user': request.user,
@@ -86,29 +123,188 @@ def chat_view(request, chatroom_name="public-chat"):
                 return HttpResponse(status=204)
             except Exception as e:
                 # Handle other errors
-                print(f"Error saving message: {e}")
+                logger.error(f"Error saving message: {e}")
                 return HttpResponse(status=500)
         else:
             # Form is invalid
             return HttpResponse(status=400)
 
-    chatroom_name = chat_group.group_name
+    RoomReadState.mark_read(request.user, chat_group)
+
+    # History and the sidebar rendered with the page are read from a replica
+    with replica_reads(request.user):
+        return _render_chat(request, chat_group, form, members, other_user)
+
+
+def _render_chat(request, chat_group, form, members, other_user):
+    # Served from the recent messages cache, rendered when they were sent
+    chat_messages = []
+    rendered_messages = []
+    entries = recent_entries(chat_group, HISTORY_PAGE_SIZE)
+    if entries is not None:
+        rendered_messages = [
+            mark_safe(entry['sent'] if entry['author_id'] == request.user.id else entry['received'])
+            for entry in entries
+        ]
+        oldest_id = entries[0]['id'] if entries else None
+    else:
+        # Only include messages that have either body or file
+        valid_messages = chat_group.chat_messages.select_related('author__profile', 'last_reply__author').order_by(
+            '-created'
+        ).filter(
+            models.Q(body__isnull=False, body__gt='') | models.Q(file__isnull=False), reply_to__isnull=True
+        )[:HISTORY_PAGE_SIZE]
+        chat_messages = list(reversed(valid_messages))
+        oldest_id = chat_messages[0].id if chat_messages else None
+    page_length = len(rendered_messages or chat_messages)
+    # Older pages are loaded on scroll, from the archive once the live table runs out
+    has_more = page_length == HISTORY_PAGE_SIZE or chat_group.archives.exists()
+
     context = {
         'chat_messages': chat_messages,
+        'rendered_messages': rendered_messages,
+        'oldest_id': oldest_id,
         'form': form,
         'other_user': other_user,
         'chatroom_name': chat_group.group_name,
-        'chat_group': chat_group
+        'chat_group': chat_group,
+        'members': members,
+        'has_more': has_more,
+        'reaction_emoji': Reaction.EMOJI,
     }
     
     return render(request, 'a_rtchat/chat.html', context)
 
+
+@login_required
+@reads_from_replica
+def chat_history_view(request, chatroom_name):
+    """Page of messages older than ?before=<id>, including archived ones"""
+    chat_group = get_object_or_404(ChatGroup, group_name=chatroom_name)
+    if chat_group.is_private and request.user not in chat_group.members.all():
+        raise Http404
+    try:
+        before_id = int(request.GET['before'])
+    except (KeyError, ValueError):
+        return HttpResponse(status=400)
+
+    chat_messages = history_page(chat_group, before_id, HISTORY_PAGE_SIZE)
+    context = {
+        'chat_messages': chat_messages,
+        'chatroom_name': chatroom_name,
+        'oldest_id': chat_messages[0].id if chat_messages else None,
+        'has_more': len(chat_messages) == HISTORY_PAGE_SIZE,
+    }
+    return render(request, 'a_rtchat/partials/chat_history_p.html', context)
+
+
+@login_required
+@reads_from_replica
+def chat_thread_view(request, message_id):
+    """A thread: the parent and its first page of replies, ?after=<reply id> for the next pages"""
+    parent = get_object_or_404(
+        GroupMessage.objects.select_related('group', 'author__profile', 'last_reply__author'), pk=message_id, reply_to__isnull=True
+    )
+    chat_group = parent.group
+    if chat_group.deleted_at or (chat_group.is_private and request.user not in chat_group.members.all()):
+        raise Http404
+    after = request.GET.get('after', '')
+    replies, has_more = thread_page(parent, int(after) if after.isdigit() else 0)
+    context = {
+        'parent': parent,
+        'replies': replies,
+        'has_more': has_more,
+        'last_id': replies[-1].id if replies else None,
+        'first_page': not after.isdigit(),
+    }
+    return render(request, 'a_rtchat/partials/thread_p.html', context)
+
+
+@login_required
+def mentions_view(request):
+    """Inbox of the messages mentioning the user, ?before=<mention id> pages back"""
+    mentions = Mention.objects.filter(user=request.user).select_related(
+        'group', 'message', 'author__profile'
+    ).order_by('-id')
+    before = request.GET.get('before', '')
+    if before.isdigit():
+        mentions = mentions.filter(id__lt=int(before))
+    mentions = list(mentions[:MENTIONS_PAGE_SIZE])
+    unread_ids = [mention.id for mention in mentions if not mention.read]
+    if unread_ids:
+        Mention.objects.filter(id__in=unread_ids).update(read=True)
+    context = {
+        'mentions': mentions,
+        'oldest_id': mentions[-1].id if mentions else None,
+        'has_more': len(mentions) == MENTIONS_PAGE_SIZE,
+        'first_page': not before.isdigit(),
+    }
+    return render(request, 'a_rtchat/mentions.html', context)
+
+
+@login_required
+def chat_export_view(request, chatroom_name):
+    """Download the room's whole history, ?format=jsonl|csv&gzip=1"""
+    chat_group = get_object_or_404(ChatGroup, group_name=chatroom_name)
+    if not request.user.is_staff and not chat_group.members.filter(pk=request.user.pk).exists():
+        raise Http404
+    fmt = request.GET.get('format', 'jsonl')
+    if fmt not in FORMATS:
+        return HttpResponse(status=400)
+    compress = request.GET.get('gzip') == '1'
+
+    chunks = export_chunks(chat_group, fmt, compress)
+    if isinstance(request, ASGIRequest):
+        chunks = aiter_chunks(chunks)
+    response = StreamingHttpResponse(
+        chunks, content_type='application/gzip' if compress else f'{FORMATS[fmt]}; charset=utf-8'
+    )
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(chat_group, fmt, compress)}"'
+    return response
+
+
+@login_required
+async def chat_stream_view(request, chatroom_name):
+    """Read-only Server-Sent Events stream of a room, resumed from Last-Event-ID"""
+    user = await request.auser()
+    chat_group = await ChatGroup.objects.filter(group_name=chatroom_name).afirst()
+    if chat_group is None:
+        raise Http404
+    is_member = await chat_group.members.filter(pk=user.pk).aexists()
+    if chat_group.is_private and not is_member:
+        raise Http404
+    # Group chats are for verified addresses, as in chat_view
+    if chat_group.groupchat_name and not is_member:
+        if not await user.emailaddress_set.filter(verified=True).aexists():
+            return HttpResponse(status=403)
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    response = StreamingHttpResponse(
+        room_stream(chat_group, int(last_event_id) if last_event_id.isdigit() else None),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Proxies like nginx would otherwise hold the events back
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+@reads_from_replica
+def chat_member_search_view(request, chatroom_name):
+    """@mention suggestions among the room's members"""
+    chat_group = get_object_or_404(ChatGroup, group_name=chatroom_name)
+    if chat_group.is_private and not chat_group.members.filter(pk=request.user.pk).exists():
+        raise Http404
+    prefix = request.GET.get('q', '').strip().lstrip('@')
+    suggestions = room_index(chat_group).suggest(prefix, exclude=request.user.id) if prefix else []
+    return render(request, 'a_rtchat/partials/mention_suggestions.html', {'suggestions': suggestions})
+
 @login_required
 def get_or_create_chatroom(request , username):
     if request.user.username == username:
         return redirect('home')
     
-    other_user = User.objects.get(username = username)
+    other_user = get_object_or_404(User, username=username, is_active=True)
     my_private_chatrooms = request.user.chat_groups.filter(is_private=True)
     
     if my_private_chatrooms.exists():
@@ -121,6 +317,7 @@ def get_or_create_chatroom(request , username):
     return redirect('chatroom', chatroom.group_name)
 
 # In a context processor or in your main view
+@reads_from_replica
 def chat_dropdown_context(request):
     user = request.user
     online_status = {}
@@ -203,7 +400,8 @@ def chatroom_delete_view(request , chatroom_name):
         return Http404()
     
     if request.method == 'POST':
-        chat_group.delete()
+        # Hidden right away, its messages are purged in the background
+        delete_room(chat_group)
         messages.success(request , "Chatroom Deleted Successfully.")
         return redirect('home')
     
@@ -237,12 +435,19 @@ def chat_file_upload(request , chatroom_name):
         file = request.FILES.get('file')
         # Only create message if file is present and not empty
         if file and getattr(file, 'size', 0) > 0:
+            retry_after = rate_limit_check(request.user.id, room_kind(chat_group), "upload")
+            if retry_after:
+                return rate_limited_response(retry_after)
             message = GroupMessage(file=file, author=request.user, group=chat_group)
             message.save()
+            MESSAGES_CREATED.inc(source="upload")
+            entry = push_message(message)
             channel_layer = get_channel_layer()
             event={
                 'type' : 'chat.message',
+                'room': chatroom_name,
                 'message_id':message.id,
+                'payload': entry['payload'],
             }
             async_to_sync(channel_layer.group_send)(
                 chatroom_name, event
@@ -253,4 +458,14 @@ def chat_file_upload(request , chatroom_name):
                 'user': request.user,
             }
             return render(request, 'a_rtchat/partials/chat_message_p.html', context)
-    return HttpResponse()
\ No newline at end of file
+    return HttpResponse()
+
+
+def metrics_view(request):
+    """Prometheus metrics of this worker process"""
+    token = settings.METRICS_TOKEN
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponse(status=403)
+    if not token and not request.user.is_staff:
+        return HttpResponse(status=403)
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4')
@@ -1,5 +1,6 @@
 from django.forms import ModelForm
 from django import forms
+from django.db.models import F
 from django.contrib.auth.models import User
 from .models import Profile
 
@@ -12,6 +13,16 @@ class ProfileForm(ModelForm):
             'displayname' : forms.TextInput(attrs={'placeholder': 'Add display name'}),
             'info' : forms.Textarea(attrs={'rows':3, 'placeholder': 'Add information'})
         }
+
+    def save(self, commit=True):
+        # Profile.save resolves the variant URLs of a new image
+        profile = super().save(commit=False)
+        # Cached messages show the old name and avatar, one save for the whole edit
+        profile.version = F('version') + 1
+        if commit:
+            profile.save()
+            profile.refresh_from_db(fields=['version'])
+        return profile
         
         
 class EmailForm(ModelForm):
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 09:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('a_users', '0002_profile_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='avatar_urls',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+# Prefix (text_pattern_ops) and trigram indexes used by a_users.search.
+# Postgres only; built concurrently so a large auth_user isn't locked.
+INDEXES = [
+    ('user_username_prefix', 'auth_user', 'lower(username)', 'btree', 'text_pattern_ops'),
+    ('user_username_trgm', 'auth_user', 'lower(username)', 'gin', 'gin_trgm_ops'),
+    ('profile_displayname_prefix', 'a_users_profile', 'lower(displayname)', 'btree', 'text_pattern_ops'),
+    ('profile_displayname_trgm', 'a_users_profile', 'lower(displayname)', 'gin', 'gin_trgm_ops'),
+]
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, expression, method, opclass in INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} USING {method} (({expression}) {opclass})'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, *_ in INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('a_users', '0003_profile_avatar_urls'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
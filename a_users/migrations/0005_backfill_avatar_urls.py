@@ -0,0 +1,28 @@
+from django.db import migrations
+
+# Mirrors Profile.build_avatar_urls, historical models don't carry its methods
+AVATAR_SIZES = (32, 64, 256)
+
+
+def backfill_avatar_urls(apps, schema_editor):
+    Profile = apps.get_model('a_users', 'Profile')
+    for profile in Profile.objects.filter(avatar_urls={}).exclude(image='').iterator():
+        if not profile.image:
+            continue
+        urls = {'public_id': profile.image.public_id}
+        for size in AVATAR_SIZES:
+            urls[str(size)] = profile.image.build_url(
+                width=size, height=size, crop='fill', gravity='face', format='webp', secure=True
+            )
+        Profile.objects.filter(pk=profile.pk).update(avatar_urls=urls)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('a_users', '0004_user_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_avatar_urls, migrations.RunPython.noop),
+    ]
@@ -3,23 +3,89 @@ from django.contrib.auth.models import User
 from django.conf import settings
 from cloudinary.models import CloudinaryField
 
+# Square WebP renditions of uploaded avatars, in px
+AVATAR_SIZES = (32, 64, 256)
+
+
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     image = CloudinaryField('image', folder='avatars', default='default_avatar')
     displayname = models.CharField(max_length=20, null=True, blank=True)
     info = models.TextField(null=True, blank=True) 
+    # Part of the cache key of every fragment showing this profile
+    version = models.PositiveIntegerField(default=1)
+    # Variant URLs resolved when the image is saved, {"public_id": ..., "32": url, ...}
+    avatar_urls = models.JSONField(default=dict, blank=True)
     
     def __str__(self):
         return str(self.user)
     
+    def save(self, *args, **kwargs):
+        # A new image, whether from ProfileForm or the admin, is uploaded now
+        # so its variant URLs go out with this same save
+        field = self._meta.get_field('image')
+        field.pre_save(self, self._state.adding)
+        if self.image:
+            self.image = field.to_python(self.image)
+        public_id = self.image.public_id if self.image else None
+        if self.avatar_urls.get('public_id') != public_id:
+            self.avatar_urls = self.build_avatar_urls()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'avatar_urls'}
+        super().save(*args, **kwargs)
+
+    def bump_version(self):
+        self.version = models.F('version') + 1
+        self.save(update_fields=['version'])
+        self.refresh_from_db(fields=['version'])
+
     @property
     def name(self):
+        if not self.user.is_active:
+            # Deleted, or waiting for its purge
+            return 'Deleted account'
         if self.displayname:
             return self.displayname
         return self.user.username 
     
     @property
     def avatar(self):
-        if self.image:
+        if self.image and self.user.is_active:
             return self.image.url
         return f'{settings.STATIC_URL}images/avatar.svg'
+
+    def build_avatar_urls(self):
+        if not self.image:
+            return {}
+        urls = {'public_id': self.image.public_id}
+        for size in AVATAR_SIZES:
+            urls[str(size)] = self._build_avatar_url(size)
+        return urls
+
+    def _build_avatar_url(self, size):
+        return self.image.build_url(
+            width=size, height=size, crop='fill', gravity='face', format='webp', secure=True
+        )
+
+    def avatar_variant(self, size):
+        """URL of the smallest avatar rendition at least size px wide"""
+        if not self.image or not self.user.is_active:
+            return f'{settings.STATIC_URL}images/avatar.svg'
+        if self.avatar_urls.get('public_id') != self.image.public_id:
+            # Resolved on save only, renders may run on a replica
+            return self.image.url
+        size = next((s for s in AVATAR_SIZES if s >= size), AVATAR_SIZES[-1])
+        return self.avatar_urls[str(size)]
+
+    @property
+    def avatar_sm(self):
+        return self.avatar_variant(32)
+
+    @property
+    def avatar_md(self):
+        return self.avatar_variant(64)
+
+    @property
+    def avatar_lg(self):
+        return self.avatar_variant(256)
@@ -0,0 +1,85 @@
+"""
+User search over username and Profile.displayname.
+
+On Postgres prefix matches come from text_pattern_ops btree indexes and
+fuzzy matches from pg_trgm GIN indexes (migration 0004), each branch capped
+at the page size so a query only ever touches a handful of index entries.
+Other databases (SQLite in development) fall back to plain LIKE queries.
+"""
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Q
+
+SEARCH_LIMIT = 10
+# Shorter queries only match by prefix, trigrams need some length to mean anything
+FUZZY_MIN_LENGTH = 3
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+_POSTGRES_QUERY = """
+    SELECT id, MAX(rank) AS rank FROM (
+        (SELECT id, 2.0 AS rank FROM auth_user
+         WHERE lower(username) LIKE %(prefix)s AND is_active
+         ORDER BY lower(username) LIMIT %(limit)s)
+        UNION ALL
+        (SELECT user_id, 2.0 FROM a_users_profile
+         WHERE lower(displayname) LIKE %(prefix)s
+         ORDER BY lower(displayname) LIMIT %(limit)s)
+        UNION ALL
+        (SELECT id, similarity(lower(username), %(query)s) FROM auth_user
+         WHERE %(fuzzy)s AND lower(username) %% %(query)s AND is_active
+         ORDER BY 2 DESC LIMIT %(limit)s)
+        UNION ALL
+        (SELECT user_id, similarity(lower(displayname), %(query)s) FROM a_users_profile
+         WHERE %(fuzzy)s AND lower(displayname) %% %(query)s
+         ORDER BY 2 DESC LIMIT %(limit)s)
+    ) AS candidates
+    WHERE id <> %(exclude)s
+    GROUP BY id
+    ORDER BY rank DESC, id
+    LIMIT %(limit)s
+"""
+
+
+def _postgres_ids(query, limit, exclude_id):
+    with connection.cursor() as cursor:
+        cursor.execute(_POSTGRES_QUERY, {
+            'query': query,
+            'prefix': _escape_like(query) + '%',
+            'fuzzy': len(query) >= FUZZY_MIN_LENGTH,
+            'limit': limit,
+            'exclude': exclude_id or 0,
+        })
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _fallback_ids(query, limit, exclude_id):
+    users = User.objects.filter(is_active=True).exclude(pk=exclude_id)
+    prefix = list(
+        users.filter(Q(username__istartswith=query) | Q(profile__displayname__istartswith=query))
+        .order_by('username').values_list('pk', flat=True)[:limit]
+    )
+    if len(prefix) < limit and len(query) >= FUZZY_MIN_LENGTH:
+        prefix += list(
+            users.filter(Q(username__icontains=query) | Q(profile__displayname__icontains=query))
+            .exclude(pk__in=prefix)
+            .order_by('username').values_list('pk', flat=True)[:limit - len(prefix)]
+        )
+    return prefix
+
+
+def search_users(query, limit=SEARCH_LIMIT, exclude=None):
+    """Active users matching query, prefix matches first, with their profiles loaded"""
+    query = query.strip().lstrip('@').lower()
+    if not query:
+        return []
+    exclude_id = getattr(exclude, 'pk', exclude)
+    if connection.vendor == 'postgresql':
+        ids = _postgres_ids(query, limit, exclude_id)
+    else:
+        ids = _fallback_ids(query, limit, exclude_id)
+    users = User.objects.select_related('profile').in_bulk(ids)
+    return [users[pk] for pk in ids if pk in users]
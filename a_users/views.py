@@ -7,6 +7,9 @@ from django.contrib.auth.models import User
 from django.contrib.auth.views import redirect_to_login
 from django.contrib import messages
 from .forms import *
+from .search import search_users
+from a_rtchat.replicas import reads_from_replica
+from a_rtchat.purge import delete_account
 
 def profile_view(request, username=None):
     if username:
@@ -26,6 +29,7 @@ def profile_edit_view(request):
     if request.method == 'POST':
         form = ProfileForm(request.POST, request.FILES, instance=request.user.profile)
         if form.is_valid():
+            # Bumps the profile's version, cached messages show the old name and avatar
             form.save()
             if request.path == reverse('profile-onboarding'):
                 return redirect('profile-settings')   
@@ -90,6 +94,7 @@ def profile_usernamechange(request):
         
         if form.is_valid():
             form.save()
+            request.user.profile.bump_version()
             messages.success(request, 'Username updated successfully.')
             return redirect('profile-settings')
         else:
@@ -110,8 +115,16 @@ def profile_delete_view(request):
     user = request.user
     if request.method == "POST":
         logout(request)
-        user.delete()
+        # Deactivated right away, messages and receipts are purged in the background
+        delete_account(user)
         messages.success(request, 'Account deleted, what a pity')
         return redirect('home')
     
     return render(request, 'a_users/profile_delete.html')
+
+
+@login_required
+@reads_from_replica
+def user_search_view(request):
+    users = search_users(request.GET.get('q', ''), exclude=request.user)
+    return render(request, 'a_users/partials/user_search_results.html', {'users': users})